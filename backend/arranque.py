@@ -0,0 +1,112 @@
+"""
+Arranque en frío: calentamiento en el lifespan y disponibilidad (readiness).
+
+En el plan gratuito de Render la instancia se duerme y cada visita tras la pausa
+paga un arranque en frío. Para acortarlo:
+- Los SDK pesados se importan bajo demanda (ver modelos_gemini.sdk_gemini), no al
+  importar la app, así uvicorn abre el puerto antes.
+- Al arrancar, una tarea de calentamiento en segundo plano ejecuta en paralelo las
+  etapas que pagaría la primera petición (importar el SDK y resolver el modelo de
+  Gemini, abrir las conexiones del pool, cargar los datos locales). La app atiende
+  peticiones mientras tanto; /api/ready responde 503 hasta que termina.
+- Se miden los tiempos de arranque (importación de la app, calentamiento por etapa
+  y primera respuesta correcta) para detectar regresiones en /api/ready y /metrics.
+
+Este módulo solo usa la biblioteca estándar y main lo importa el primero, así el
+tiempo de importación incluye el de FastAPI y el resto de dependencias.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable
+
+INICIO_IMPORTACION = time.perf_counter()
+
+CALENTAMIENTO_ACTIVO = os.getenv("CALENTAMIENTO_ACTIVO", "true").lower() == "true"
+# Tiempo máximo por etapa (segundos): una etapa colgada no deja la app sin estar lista
+CALENTAMIENTO_TIMEOUT = float(os.getenv("CALENTAMIENTO_TIMEOUT", "20"))
+
+
+class EstadoArranque:
+    """
+    Tiempos de arranque (segundos desde que empezó la importación de la app) y
+    estado del calentamiento por etapa.
+    """
+
+    def __init__(self, inicio: float):
+        self.inicio = inicio
+        self.importacion: float | None = None
+        self.primera_respuesta: float | None = None
+        self.calentamiento: float | None = None
+        # etapa -> {"ms": duración, "ok": bool, "error": mensaje}
+        self.etapas: dict[str, dict] = {}
+        self.listo = False
+        self._tarea: asyncio.Task | None = None
+
+    def marcar_importacion(self) -> None:
+        self.importacion = time.perf_counter() - self.inicio
+
+    def marcar_primera_respuesta(self) -> None:
+        if self.primera_respuesta is None:
+            self.primera_respuesta = time.perf_counter() - self.inicio
+
+    async def _etapa(self, nombre: str, etapa: Callable[[], Awaitable]) -> None:
+        inicio = time.perf_counter()
+        try:
+            await asyncio.wait_for(etapa(), CALENTAMIENTO_TIMEOUT)
+            self.etapas[nombre] = {"ms": round(1000 * (time.perf_counter() - inicio), 1), "ok": True}
+        except Exception as e:
+            # Una etapa fallida solo significa que esa parte se hará en la primera petición
+            mensaje = str(e) or type(e).__name__
+            self.etapas[nombre] = {"ms": round(1000 * (time.perf_counter() - inicio), 1), "ok": False, "error": mensaje}
+            print(f"⚠️  Calentamiento: la etapa {nombre} falló: {mensaje}")
+
+    async def calentar(self, etapas: dict[str, Callable[[], Awaitable]]) -> None:
+        """
+        Ejecuta todas las etapas en paralelo y marca la app como lista al terminar
+        (aunque alguna haya fallado).
+        """
+        inicio = time.perf_counter()
+        await asyncio.gather(*(self._etapa(nombre, etapa) for nombre, etapa in etapas.items()))
+        self.calentamiento = time.perf_counter() - inicio
+        self.listo = True
+        print(f"🔥 Calentamiento terminado en {1000 * self.calentamiento:.0f} ms")
+
+    def iniciar(self, etapas: dict[str, Callable[[], Awaitable]]) -> None:
+        """
+        Lanza el calentamiento en segundo plano (o marca la app como lista si está
+        desactivado con CALENTAMIENTO_ACTIVO=false).
+        """
+        if not CALENTAMIENTO_ACTIVO:
+            self.listo = True
+            return
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self.calentar(etapas))
+
+    async def detener(self) -> None:
+        if self._tarea is None:
+            return
+        self._tarea.cancel()
+        try:
+            await self._tarea
+        except asyncio.CancelledError:
+            pass
+        self._tarea = None
+
+    def tiempos(self) -> dict[str, float]:
+        """
+        Fases de arranque ya medidas, en segundos.
+        """
+        fases = {"importacion": self.importacion, "calentamiento": self.calentamiento,
+                 "primera_respuesta": self.primera_respuesta}
+        return {fase: segundos for fase, segundos in fases.items() if segundos is not None}
+
+    def estado(self) -> dict:
+        return {
+            "listo": self.listo,
+            "tiempos_ms": {fase: round(1000 * segundos, 1) for fase, segundos in self.tiempos().items()},
+            "etapas": self.etapas,
+        }
+
+
+ESTADO_ARRANQUE = EstadoArranque(INICIO_IMPORTACION)
@@ -0,0 +1,165 @@
+"""
+Benchmark del arranque en frío de la API.
+
+Arranca la app varias veces en un proceso nuevo (como un arranque en frío de Render,
+con uvicorn) contra los stubs locales de las APIs externas y mide:
+- importacion_ms: tiempo de `import main` en un intérprete recién iniciado, y si el
+  SDK de Gemini se importó en ese momento (no debería: se importa bajo demanda).
+- hasta_primera_respuesta_ms: desde que se lanza el proceso hasta el primer 200 de
+  /api/health (el puerto ya acepta peticiones).
+- hasta_listo_ms: desde que se lanza el proceso hasta el primer 200 de /api/ready
+  (calentamiento terminado).
+- Los tiempos que mide la propia app (importación, calentamiento por etapa y primera
+  respuesta), tal como los publica /api/ready.
+
+Uso (desde la carpeta backend):
+    python benchmarks/bench_arranque.py [--repeticiones 5] [--salida resultado.json]
+
+Imprime (o guarda) un JSON para comparar ejecuciones.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import signal
+import socket
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+RUTA_BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RUTA_BACKEND))
+
+
+def servir(puerto: int, url_stubs: str) -> None:
+    """
+    Proceso de la app: importa main antes que nada (para medir su importación sin
+    otras dependencias ya cargadas) y la sirve con uvicorn en `puerto`.
+    """
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        inicio = time.perf_counter()
+        import main
+        importacion_ms = (time.perf_counter() - inicio) * 1000
+    sdk_importado = "google.generativeai" in sys.modules
+    print(json.dumps({"importacion_ms": round(importacion_ms, 1), "sdk_importado": sdk_importado}), flush=True)
+
+    import httpx
+    import uvicorn
+    from stubs import ModeloGeminiStub, comprobar_modelo_stub
+
+    cliente_gemini = httpx.AsyncClient(timeout=60)
+    main.SELECTOR_MODELOS._crear_modelo = lambda nombre: ModeloGeminiStub(nombre, url_stubs, cliente_gemini)
+    main.SELECTOR_MODELOS._comprobar_modelo = lambda nombre: comprobar_modelo_stub(nombre, url_stubs, cliente_gemini)
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        uvicorn.run(main.app, host="127.0.0.1", port=puerto, log_level="warning", access_log=False)
+
+
+def puerto_libre() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def esperar_200(cliente, url: str, limite: float) -> dict:
+    """
+    Consulta `url` cada 5 ms hasta el primer 200. Retorna el JSON de la respuesta.
+    """
+    while time.perf_counter() < limite:
+        try:
+            respuesta = await cliente.get(url)
+            if respuesta.status_code == 200:
+                return respuesta.json()
+        except Exception:
+            pass
+        await asyncio.sleep(0.005)
+    raise TimeoutError(f"{url} no respondió 200 a tiempo")
+
+
+async def medir_un_arranque(url_stubs: str, timeout: float) -> dict:
+    import httpx
+
+    puerto = puerto_libre()
+    url_app = f"http://127.0.0.1:{puerto}"
+    inicio = time.perf_counter()
+    proceso = await asyncio.create_subprocess_exec(
+        sys.executable, str(Path(__file__).resolve()), "--servir", "--puerto", str(puerto), "--url-stubs", url_stubs,
+        cwd=RUTA_BACKEND, stdout=asyncio.subprocess.PIPE,
+    )
+    try:
+        async with httpx.AsyncClient(timeout=1) as cliente:
+            limite = inicio + timeout
+            importacion = json.loads(await asyncio.wait_for(proceso.stdout.readline(), timeout))
+            await esperar_200(cliente, f"{url_app}/api/health", limite)
+            hasta_primera_respuesta = time.perf_counter() - inicio
+            listo = await esperar_200(cliente, f"{url_app}/api/ready", limite)
+            hasta_listo = time.perf_counter() - inicio
+    finally:
+        if proceso.returncode is None:
+            proceso.send_signal(signal.SIGTERM)
+        await proceso.wait()
+
+    return {
+        **importacion,
+        "hasta_primera_respuesta_ms": round(1000 * hasta_primera_respuesta, 1),
+        "hasta_listo_ms": round(1000 * hasta_listo, 1),
+        "app": listo,
+    }
+
+
+def resumir(valores: list[float]) -> dict:
+    return {"mediana": round(statistics.median(valores), 1), "min": min(valores), "max": max(valores)}
+
+
+async def ejecutar(args) -> dict:
+    from bench_carga import configurar_entorno
+    from stubs import ConfigStubs, crear_app_stubs, detener_servidor, iniciar_servidor
+
+    servidor_stubs, tarea_stubs, url_stubs = await iniciar_servidor(crear_app_stubs(ConfigStubs()))
+    # Los procesos de la app heredan las variables (API keys falsas y URLs de los stubs)
+    configurar_entorno(url_stubs, sin_cache=False)
+    try:
+        arranques = [await medir_un_arranque(url_stubs, args.timeout) for _ in range(args.repeticiones)]
+    finally:
+        await detener_servidor(servidor_stubs, tarea_stubs)
+
+    return {
+        "benchmark": "arranque_api",
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "repeticiones": args.repeticiones,
+        "sdk_gemini_importado_al_importar": any(a["sdk_importado"] for a in arranques),
+        "importacion_ms": resumir([a["importacion_ms"] for a in arranques]),
+        "hasta_primera_respuesta_ms": resumir([a["hasta_primera_respuesta_ms"] for a in arranques]),
+        "hasta_listo_ms": resumir([a["hasta_listo_ms"] for a in arranques]),
+        # Tiempos medidos por la propia app en el último arranque
+        "app": arranques[-1]["app"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60, help="segundos máximos por arranque")
+    parser.add_argument("--salida", help="archivo donde guardar el JSON (por defecto, la salida estándar)")
+    parser.add_argument("--servir", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--puerto", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--url-stubs", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servir:
+        servir(args.puerto, args.url_stubs)
+        return
+
+    resultado = json.dumps(asyncio.run(ejecutar(args)), ensure_ascii=False, indent=2)
+    if args.salida:
+        Path(args.salida).write_text(resultado + "\n", encoding="utf-8")
+    else:
+        print(resultado)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Benchmark de la caché compartida entre procesos (cache_compartida.py).
+
+- Serialización: bytes y coste de codificar/decodificar los valores reales de la app
+  (clima, fotos, tabla de tipos de cambio, respuesta de Gemini) comparados con
+  pickle y con JSON sin comprimir.
+- Concurrencia: N procesos (como N workers de uvicorn) con varias corrutinas cada
+  uno leen y escriben a la vez las mismas claves durante un tiempo fijo, contra
+  SQLite-WAL y contra el sustituto local de Redis (redis_local.py). Mide operaciones
+  por segundo, latencias p50/p99 de lectura y escritura y errores.
+- Consistencia: el TTL se respeta igual en todos los procesos (una entrada se ve
+  desde otro proceso mientras está vigente y deja de verse al vencer) y, en SQLite,
+  con dos escritores gana el valor que vence más tarde.
+
+Uso (desde la carpeta backend):
+    python benchmarks/bench_cache_compartida.py [--procesos 4] [--corrutinas 8]
+        [--duracion 5] [--claves 200] [--lecturas 0.8] [--almacenes sqlite,redis]
+        [--salida resultado.json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cache_compartida import clave_compartida, codificar, crear_almacen, decodificar  # noqa: E402
+from divisas import TablaTipos  # noqa: E402
+from fotos import recortar_foto  # noqa: E402
+from stubs import TEXTO_GEMINI  # noqa: E402
+
+
+def percentil(valores_ordenados: list[float], p: float) -> float:
+    if not valores_ordenados:
+        return 0.0
+    indice = min(len(valores_ordenados) - 1, int(round(p / 100 * (len(valores_ordenados) - 1))))
+    return valores_ordenados[indice]
+
+
+def _foto_de_ejemplo(i: int) -> dict:
+    """
+    Foto recortada como la guarda la app (fotos.recortar_foto).
+    """
+    return recortar_foto({
+        "id": f"Xk3pQ9fL2m{i}", "width": 6000, "height": 4000, "color": "#a6c0d9",
+        "blur_hash": "LKO2?U%2Tw=w]~RBVZRi};RPxuwH", "alt_description": "vista aérea de la ciudad al atardecer",
+        "urls": {"raw": f"https://images.unsplash.com/photo-1539037116277-4db20889f2d{i}?ixid=M3w1&ixlib=rb-4.0.3",
+                 "regular": f"https://images.unsplash.com/photo-1539037116277-4db20889f2d{i}?ixid=M3w1&w=1080&q=80"},
+        "user": {"name": "Nombre Apellido", "links": {"html": "https://unsplash.com/@usuario"}},
+    })
+
+
+def valores_de_ejemplo() -> dict:
+    """
+    Valores con la forma y el tamaño de los que guarda la app.
+    """
+    azar = random.Random(1)
+    codigos = sorted({"".join(azar.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(3)) for _ in range(170)})
+    return {
+        "clima": {
+            "coord": {"lat": 40.4168, "lon": -3.7038}, "weather": [{"id": 800, "main": "Clear", "description": "cielo claro", "icon": "01d"}],
+            "main": {"temp": 21.3, "feels_like": 20.8, "temp_min": 19.9, "temp_max": 22.6, "pressure": 1017, "humidity": 45},
+            "wind": {"speed": 3.2, "deg": 210}, "sys": {"country": "ES", "sunrise": 1718166000, "sunset": 1718219600},
+            "timezone": 7200, "id": 3117735, "name": "Madrid", "cod": 200,
+        },
+        "fotos": [_foto_de_ejemplo(i) for i in range(6)],
+        "tipo_cambio": TablaTipos("USD", {codigo: azar.uniform(0.01, 5000) for codigo in codigos}).como_dict(),
+        "respuestas": [TEXTO_GEMINI, [_foto_de_ejemplo(i) for i in range(3)]],
+    }
+
+
+def medir_serializacion(repeticiones: int) -> dict:
+    resultado = {}
+    expira = time.time() + 600
+    for nombre, valor in valores_de_ejemplo().items():
+        datos = codificar(valor, expira)
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            codificar(valor, expira)
+        codificar_us = (time.perf_counter() - inicio) / repeticiones * 1e6
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            decodificar(datos)
+        decodificar_us = (time.perf_counter() - inicio) / repeticiones * 1e6
+        resultado[nombre] = {
+            "bytes": len(datos),
+            "bytes_json": len(json.dumps(valor, ensure_ascii=False).encode("utf-8")),
+            "bytes_pickle": len(pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)),
+            "codificar_us": round(codificar_us, 1),
+            "decodificar_us": round(decodificar_us, 1),
+        }
+    return resultado
+
+
+async def _carga(url: str, duracion: float, claves: int, lecturas: float, corrutinas: int, semilla: int) -> dict:
+    almacen = crear_almacen(url)
+    valores = valores_de_ejemplo()
+    datos = [codificar(valor, time.time() + 3600) for valor in valores.values()]
+    latencias = {"leer": [], "escribir": []}
+    fin = time.perf_counter() + duracion
+
+    async def corrutina(indice: int):
+        azar = random.Random(semilla * 1000 + indice)
+        while time.perf_counter() < fin:
+            clave = clave_compartida("bench", azar.randrange(claves))
+            inicio = time.perf_counter()
+            if azar.random() < lecturas:
+                await almacen.leer(clave)
+                latencias["leer"].append(time.perf_counter() - inicio)
+            else:
+                await almacen.escribir(clave, azar.choice(datos), time.time() + 60)
+                latencias["escribir"].append(time.perf_counter() - inicio)
+
+    await asyncio.gather(*(corrutina(i) for i in range(corrutinas)))
+    estadisticas = almacen.estadisticas()
+    await almacen.cerrar()
+    return {"latencias": latencias, "errores": estadisticas["errores"], "aciertos": estadisticas["aciertos"]}
+
+
+def _proceso_de_carga(url: str, duracion: float, claves: int, lecturas: float, corrutinas: int, semilla: int, cola) -> None:
+    cola.put(asyncio.run(_carga(url, duracion, claves, lecturas, corrutinas, semilla)))
+
+
+def medir_concurrencia(url: str, args) -> dict:
+    contexto = multiprocessing.get_context("spawn")
+    cola = contexto.Queue()
+    procesos = [
+        contexto.Process(target=_proceso_de_carga,
+                         args=(url, args.duracion, args.claves, args.lecturas, args.corrutinas, semilla, cola))
+        for semilla in range(args.procesos)
+    ]
+    for proceso in procesos:
+        proceso.start()
+    resultados = [cola.get() for _ in procesos]
+    for proceso in procesos:
+        proceso.join()
+
+    resumen = {"errores": sum(r["errores"] for r in resultados), "aciertos_lectura": sum(r["aciertos"] for r in resultados)}
+    total = 0
+    for operacion in ("leer", "escribir"):
+        latencias = sorted(l for r in resultados for l in r["latencias"][operacion])
+        total += len(latencias)
+        resumen[operacion] = {
+            "operaciones": len(latencias),
+            "p50_ms": round(1000 * percentil(latencias, 50), 3),
+            "p99_ms": round(1000 * percentil(latencias, 99), 3),
+            "max_ms": round(1000 * latencias[-1], 3) if latencias else 0.0,
+        }
+    resumen["operaciones_por_segundo"] = round(total / args.duracion, 1)
+    return resumen
+
+
+async def comprobar_consistencia(url: str, sqlite: bool) -> dict:
+    escritor, lector = crear_almacen(url), crear_almacen(url)
+    clave = clave_compartida("consistencia", time.time())
+    await escritor.escribir(clave, codificar("a", time.time() + 0.3), time.time() + 0.3)
+    visible = await lector.leer(clave) is not None
+    await asyncio.sleep(0.4)
+    vencida = await lector.leer(clave) is None
+    resultado = {"visible_desde_otro_proceso": visible, "ttl_respetado": vencida}
+    if sqlite:
+        # Un escritor tardío con un valor que vence antes no pisa al más reciente
+        clave = clave_compartida("consistencia", time.time())
+        await escritor.escribir(clave, codificar("nuevo", time.time() + 60), time.time() + 60)
+        await lector.escribir(clave, codificar("viejo", time.time() + 30), time.time() + 30)
+        _expira, valor = decodificar(await escritor.leer(clave))
+        resultado["gana_el_mas_reciente"] = valor == "nuevo"
+    await escritor.cerrar()
+    await lector.cerrar()
+    return resultado
+
+
+def puerto_libre() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def ejecutar(args) -> dict:
+    almacenes = {}
+    for almacen in args.almacenes.split(","):
+        if almacen == "sqlite":
+            directorio = tempfile.mkdtemp(prefix="viajeia-bench-")
+            url = f"sqlite://{os.path.join(directorio, 'cache.db')}"
+            almacenes["sqlite"] = {
+                "concurrencia": medir_concurrencia(url, args),
+                "consistencia": asyncio.run(comprobar_consistencia(url, sqlite=True)),
+            }
+        elif almacen == "redis":
+            # El sustituto corre en su propio proceso, como un servidor real
+            puerto = puerto_libre()
+            servidor = subprocess.Popen([sys.executable, str(Path(__file__).resolve().parent / "redis_local.py"),
+                                         "--puerto", str(puerto)], stdout=subprocess.PIPE, text=True)
+            try:
+                url = servidor.stdout.readline().strip()
+                almacenes["redis_local"] = {
+                    "concurrencia": medir_concurrencia(url, args),
+                    "consistencia": asyncio.run(comprobar_consistencia(url, sqlite=False)),
+                }
+            finally:
+                servidor.terminate()
+                servidor.wait(timeout=10)
+
+    return {
+        "benchmark": "cache_compartida",
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "configuracion": {
+            "procesos": args.procesos,
+            "corrutinas_por_proceso": args.corrutinas,
+            "duracion_s": args.duracion,
+            "claves": args.claves,
+            "fraccion_lecturas": args.lecturas,
+        },
+        "serializacion": medir_serializacion(args.repeticiones),
+        "almacenes": almacenes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, default=4)
+    parser.add_argument("--corrutinas", type=int, default=8, help="corrutinas concurrentes por proceso")
+    parser.add_argument("--duracion", type=float, default=5, help="segundos de carga por almacén")
+    parser.add_argument("--claves", type=int, default=200, help="claves distintas (menos claves, más contención)")
+    parser.add_argument("--lecturas", type=float, default=0.8, help="fracción de operaciones que son lecturas")
+    parser.add_argument("--almacenes", default="sqlite,redis")
+    parser.add_argument("--repeticiones", type=int, default=2000, help="repeticiones de la medición de serialización")
+    parser.add_argument("--salida", help="archivo donde guardar el JSON (por defecto, la salida estándar)")
+    args = parser.parse_args()
+
+    resultado = json.dumps(ejecutar(args), ensure_ascii=False, indent=2)
+    if args.salida:
+        Path(args.salida).write_text(resultado + "\n", encoding="utf-8")
+    else:
+        print(resultado)
+
+
+if __name__ == "__main__":
+    main()
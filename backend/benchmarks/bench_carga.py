@@ -0,0 +1,373 @@
+"""
+Benchmark de carga de la API con stubs locales de las APIs externas.
+
+En un proceso aparte levanta el servidor de stubs (OpenWeatherMap, Unsplash,
+exchangerate-api y Gemini, ver stubs.py) y la app de FastAPI con uvicorn en puertos
+locales; este proceso genera carga contra /api/planificar y /api/info-panel con N
+clientes concurrentes durante un tiempo fijo y mide el throughput y las latencias
+p50/p95/p99. Así el generador de carga no compite por el event loop de la app.
+También incluye micro-benchmarks de extraer_destino_de_pregunta, construir_prompt
+y del coste por petición de la pila ASGI (middlewares), sin red.
+
+Uso (desde la carpeta backend):
+    python benchmarks/bench_carga.py [--concurrencia 16] [--duracion 10]
+        [--endpoints planificar,info-panel,preflight] [--sin-cache]
+        [--latencias gemini=800,owm=50] [--errores gemini=0.05]
+        [--salida resultado.json]
+
+Imprime (o guarda) un JSON para comparar ejecuciones. Las variables de entorno de
+la app (GEMINI_CONCURRENCIA, LIMITE_*, CACHE_*...) se respetan si ya están definidas.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+
+from stubs import (  # noqa: E402
+    ConfigStubs,
+    ModeloGeminiStub,
+    comprobar_modelo_stub,
+    crear_app_stubs,
+    detener_servidor,
+    iniciar_servidor,
+)
+
+DESTINOS = ["París", "Roma", "Tokio", "Nueva York", "Lima", "Cancún", "Madrid", "Buenos Aires", "Praga", "Marrakech"]
+PLANTILLAS = [
+    "¿Qué hacer en {destino}?",
+    "Recomiéndame dónde comer en {destino}",
+    "¿Cuál es el mejor barrio para alojarse en {destino}?",
+    "Itinerario de 3 días en {destino} con presupuesto medio",
+]
+
+
+def percentil(valores_ordenados: list[float], p: float) -> float:
+    """
+    Percentil por rango más cercano sobre una lista ya ordenada.
+    """
+    if not valores_ordenados:
+        return 0.0
+    indice = max(0, min(len(valores_ordenados) - 1, round(p / 100 * len(valores_ordenados) + 0.5) - 1))
+    return valores_ordenados[indice]
+
+
+def resumir_latencias(latencias: list[float], codigos: dict, errores: int, duracion: float) -> dict:
+    ordenadas = sorted(latencias)
+    return {
+        "peticiones": len(latencias),
+        "errores": errores,
+        "codigos": codigos,
+        "throughput_rps": round(len(latencias) / duracion, 2) if duracion else 0.0,
+        "p50_ms": round(percentil(ordenadas, 50) * 1000, 2),
+        "p95_ms": round(percentil(ordenadas, 95) * 1000, 2),
+        "p99_ms": round(percentil(ordenadas, 99) * 1000, 2),
+        "max_ms": round(ordenadas[-1] * 1000, 2) if ordenadas else 0.0,
+    }
+
+
+def peticion_planificar(n: int, sin_cache: bool) -> tuple[str, str, dict]:
+    destino = DESTINOS[n % len(DESTINOS)]
+    pregunta = PLANTILLAS[(n // len(DESTINOS)) % len(PLANTILLAS)].format(destino=destino)
+    if sin_cache:
+        pregunta += f" (#{n})"
+    return "POST", "/api/planificar", {"json": {"pregunta": pregunta, "usar_cache": not sin_cache}}
+
+
+def peticion_info_panel(n: int, sin_cache: bool) -> tuple[str, str, dict]:
+    return "GET", "/api/info-panel", {"params": {"ciudad": DESTINOS[n % len(DESTINOS)]}}
+
+
+def peticion_preflight(n: int, sin_cache: bool) -> tuple[str, str, dict]:
+    # Preflight CORS que el navegador envía antes de cada POST con JSON
+    return "OPTIONS", "/api/planificar", {"headers": {
+        "Access-Control-Request-Method": "POST", "Access-Control-Request-Headers": "content-type",
+    }}
+
+
+PETICIONES = {"planificar": peticion_planificar, "info-panel": peticion_info_panel, "preflight": peticion_preflight}
+
+
+async def generar_carga(cliente: httpx.AsyncClient, crear_peticion, concurrencia: int, duracion: float, calentamiento: float, sin_cache: bool) -> dict:
+    """
+    Bucle cerrado: `concurrencia` clientes que lanzan la siguiente petición en cuanto
+    termina la anterior. Las peticiones del calentamiento no se cuentan.
+    """
+    latencias: list[float] = []
+    codigos: dict[str, int] = {}
+    errores = 0
+    bytes_recibidos = 0
+    contador = 0
+    inicio_medicion = time.perf_counter() + calentamiento
+    fin = inicio_medicion + duracion
+
+    async def cliente_virtual():
+        nonlocal errores, contador, bytes_recibidos
+        while True:
+            inicio = time.perf_counter()
+            if inicio >= fin:
+                return
+            n, contador = contador, contador + 1
+            metodo, ruta, opciones = crear_peticion(n, sin_cache)
+            try:
+                respuesta = await cliente.request(metodo, ruta, **opciones)
+                codigo = str(respuesta.status_code)
+                fallo = respuesta.status_code not in (200, 204, 304)
+                # Bytes del cuerpo tal como llegaron (comprimidos, si el servidor comprime)
+                recibidos = respuesta.num_bytes_downloaded
+            except httpx.HTTPError as e:
+                codigo, fallo, recibidos = type(e).__name__, True, 0
+            if inicio < inicio_medicion:
+                continue
+            bytes_recibidos += recibidos
+            latencias.append(time.perf_counter() - inicio)
+            codigos[codigo] = codigos.get(codigo, 0) + 1
+            errores += fallo
+
+    await asyncio.gather(*(cliente_virtual() for _ in range(concurrencia)))
+    resumen = resumir_latencias(latencias, codigos, errores, duracion)
+    resumen["bytes_medios"] = round(bytes_recibidos / len(latencias)) if latencias else 0
+    return resumen
+
+
+def micro_benchmarks(repeticiones: int) -> dict:
+    """
+    Tiempo medio de la extracción de destino, de la construcción del prompt y de
+    la conversión de monedas por lotes.
+    """
+    import main
+    from divisas import TablaTipos
+    from bench_destinos import PREGUNTAS
+
+    historial = [
+        main.MensajeHistorial(pregunta=f"¿Qué hacer en {d}?", respuesta="ALOJAMIENTO: ... " * 40)
+        for d in DESTINOS[:5]
+    ]
+    info_viaje = main.InformacionViaje(destino="Roma", fecha="2025-06", presupuesto="medio", preferencia="cultura")
+    clima = "🌤️ CLIMA ACTUAL EN ROMA, IT:\n• Temperatura: 24.0°C\n• Condiciones: Cielo claro"
+    resumen = "\n".join(f"- ¿Qué hacer en {d}? (destino: {d})" for d in DESTINOS[:4])
+
+    def medir(funcion, veces: int) -> float:
+        inicio = time.perf_counter()
+        for _ in range(veces):
+            funcion()
+        return round((time.perf_counter() - inicio) / veces * 1e6, 2)
+
+    main.extraer_destino_de_pregunta("calentar el gazetteer")
+    preguntas = [p for p, _ in PREGUNTAS]
+    resultado = {
+        "extraer_destino_us": round(medir(lambda: [main.extraer_destino_de_pregunta(p) for p in preguntas], repeticiones) / len(preguntas), 2),
+    }
+    resultado["construir_prompt_sin_historial_us"] = medir(
+        lambda: main.construir_prompt("¿Qué hacer en Roma?", info_viaje, [], clima), repeticiones
+    )
+    resultado["construir_prompt_5_turnos_us"] = medir(
+        lambda: main.construir_prompt("¿Y allí qué comer?", info_viaje, historial, clima), repeticiones
+    )
+    resultado["construir_prompt_sesion_us"] = medir(
+        lambda: main.construir_prompt("¿Y allí qué comer?", info_viaje, historial[-3:], clima, resumen), repeticiones
+    )
+    # Tabla del tamaño de la de exchangerate-api (~160 monedas) y 1000 importes
+    tabla = TablaTipos("USD", {f"M{i:03d}": 1 + i / 10 for i in range(160)})
+    conversiones = [(100.0 + i, f"M{i % 160:03d}", f"M{i * 7 % 160:03d}") for i in range(1000)]
+    resultado["convertir_lote_1000_us"] = medir(lambda: tabla.convertir_lote(conversiones), repeticiones)
+    resultado.update(medir_pila_asgi(main.app, repeticiones))
+    return resultado
+
+
+def medir_pila_asgi(app, repeticiones: int) -> dict:
+    """
+    Coste por petición de la pila ASGI (middlewares, enrutado y serialización),
+    llamando a la app directamente sin red: una ruta trivial, el preflight CORS y
+    /api/limites (JSON de ~1 KB), con Origin y Accept-Encoding como un navegador.
+    """
+    def alcance(metodo: str, ruta: str, cabeceras: list[tuple[bytes, bytes]]) -> dict:
+        return {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": metodo,
+            "scheme": "http", "path": ruta, "raw_path": ruta.encode(), "query_string": b"", "root_path": "",
+            "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+            "headers": [(b"host", b"bench"), (b"origin", b"http://localhost:5173"), (b"accept-encoding", b"gzip, br")] + cabeceras,
+        }
+
+    async def recibir():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def enviar(mensaje):
+        pass
+
+    casos = {
+        "asgi_health_us": alcance("GET", "/api/health", []),
+        "asgi_preflight_us": alcance("OPTIONS", "/api/planificar", [
+            (b"access-control-request-method", b"POST"), (b"access-control-request-headers", b"content-type"),
+        ]),
+        "asgi_limites_us": alcance("GET", "/api/limites", []),
+    }
+
+    async def medir_todo() -> dict:
+        resultado = {}
+        for nombre, scope in casos.items():
+            for _ in range(50):
+                await app(dict(scope), recibir, enviar)
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                await app(dict(scope), recibir, enviar)
+            resultado[nombre] = round((time.perf_counter() - inicio) / repeticiones * 1e6, 2)
+        return resultado
+
+    return asyncio.run(medir_todo())
+
+
+def parsear_pares(texto: str, tipo=float) -> dict:
+    """
+    "gemini=800,owm=50" -> {"gemini": 800.0, "owm": 50.0}
+    """
+    pares = {}
+    for par in filter(None, texto.split(",")):
+        clave, valor = par.split("=")
+        pares[clave.strip()] = tipo(valor)
+    return pares
+
+
+def configurar_entorno(url_stubs: str, sin_cache: bool) -> None:
+    """
+    Variables de entorno de la app antes de importarla. Las ya definidas se respetan.
+    """
+    os.environ.setdefault("GEMINI_API_KEY", "stub")
+    os.environ.setdefault("OPENWEATHER_API_KEY", "stub")
+    os.environ.setdefault("UNSPLASH_ACCESS_KEY", "stub")
+    os.environ.setdefault("OPENWEATHER_URL", url_stubs)
+    os.environ.setdefault("UNSPLASH_URL", url_stubs)
+    os.environ.setdefault("TIPO_CAMBIO_URL", url_stubs)
+    # Sin límites de tasa: se mide la app, no los límites de los planes gratuitos
+    for variable in ("LIMITE_OPENWEATHER_POR_MINUTO", "LIMITE_OPENWEATHER_RAFAGA", "LIMITE_UNSPLASH_POR_HORA",
+                     "LIMITE_UNSPLASH_RAFAGA", "LIMITE_TIPO_CAMBIO_POR_MINUTO", "LIMITE_GEMINI_POR_MINUTO"):
+        os.environ.setdefault(variable, "1000000")
+    if sin_cache:
+        for variable in ("CACHE_TTL_CLIMA", "CACHE_TTL_FOTOS", "CACHE_TTL_TIPO_CAMBIO",
+                         "CACHE_GRACIA_CLIMA", "CACHE_GRACIA_FOTOS", "CACHE_GRACIA_TIPO_CAMBIO"):
+            os.environ.setdefault(variable, "0")
+        os.environ.setdefault("CACHE_RESPUESTAS_ACTIVA", "false")
+        os.environ.setdefault("REFRESCO_ACTIVO", "false")
+
+
+async def servir(args) -> None:
+    """
+    Proceso del servidor: stubs y app en puertos locales hasta recibir SIGTERM.
+    Escribe una línea JSON con las URLs en la salida estándar cuando está listo.
+    """
+    config = ConfigStubs(parsear_pares(args.latencias), parsear_pares(args.errores), args.variacion)
+    servidor_stubs, tarea_stubs, url_stubs = await iniciar_servidor(crear_app_stubs(config))
+    configurar_entorno(url_stubs, args.sin_cache)
+
+    # La app imprime diagnósticos en cada petición: se descartan
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        inicio_importacion = time.perf_counter()
+        import main
+        importacion_ms = (time.perf_counter() - inicio_importacion) * 1000
+
+        cliente_gemini = httpx.AsyncClient(timeout=60, limits=httpx.Limits(max_connections=None))
+        main.SELECTOR_MODELOS._crear_modelo = lambda nombre: ModeloGeminiStub(nombre, url_stubs, cliente_gemini)
+        main.SELECTOR_MODELOS._comprobar_modelo = lambda nombre: comprobar_modelo_stub(nombre, url_stubs, cliente_gemini)
+        servidor_app, tarea_app, url_app = await iniciar_servidor(main.app)
+
+        listo = {"url_app": url_app, "url_stubs": url_stubs, "importacion_app_ms": round(importacion_ms, 1),
+                 "stubs": config.como_dict()}
+        print(json.dumps(listo), file=sys.__stdout__, flush=True)
+
+        detener = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, detener.set)
+        await detener.wait()
+        await detener_servidor(servidor_app, tarea_app)
+        await cliente_gemini.aclose()
+        await detener_servidor(servidor_stubs, tarea_stubs)
+
+
+async def generar_toda_la_carga(args, url_app: str) -> dict:
+    carga = {}
+    # Como un navegador: con Origin (CORS) y aceptando respuestas comprimidas
+    cabeceras = {"Origin": args.origen, "Accept-Encoding": "gzip, br"} if args.origen else {}
+    async with httpx.AsyncClient(base_url=url_app, timeout=60, limits=httpx.Limits(max_connections=None), headers=cabeceras) as cliente:
+        for endpoint in args.endpoints.split(","):
+            carga[endpoint] = await generar_carga(
+                cliente, PETICIONES[endpoint], args.concurrencia, args.duracion, args.calentamiento, args.sin_cache
+            )
+    return carga
+
+
+def ejecutar(args) -> dict:
+    comando = [sys.executable, str(Path(__file__).resolve()), "--servir"] + sys.argv[1:]
+    proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, text=True)
+    try:
+        linea = proceso.stdout.readline()
+        if not linea:
+            raise RuntimeError("El proceso del servidor terminó antes de estar listo")
+        servidor = json.loads(linea)
+        carga = asyncio.run(generar_toda_la_carga(args, servidor["url_app"]))
+        llamadas = httpx.get(f"{servidor['url_stubs']}/_llamadas").json()
+    finally:
+        proceso.send_signal(signal.SIGTERM)
+        proceso.wait(timeout=30)
+
+    # main imprime advertencias al importarse
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        micro = micro_benchmarks(args.repeticiones)
+
+    return {
+        "benchmark": "carga_api",
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "configuracion": {
+            "concurrencia": args.concurrencia,
+            "duracion_s": args.duracion,
+            "calentamiento_s": args.calentamiento,
+            "sin_cache": args.sin_cache,
+            "origen": args.origen,
+            "stubs": servidor["stubs"],
+        },
+        "importacion_app_ms": servidor["importacion_app_ms"],
+        "carga": carga,
+        "llamadas_a_stubs": llamadas,
+        "micro": micro,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--duracion", type=float, default=10, help="segundos de medición por endpoint")
+    parser.add_argument("--calentamiento", type=float, default=1, help="segundos iniciales que no se miden")
+    parser.add_argument("--endpoints", default="planificar,info-panel", help="planificar, info-panel y/o preflight")
+    parser.add_argument("--origen", default="http://localhost:5173", help="cabecera Origin de las peticiones ('' para no enviarla)")
+    parser.add_argument("--sin-cache", action="store_true", help="desactiva las cachés y usa preguntas distintas")
+    parser.add_argument("--latencias", default="", help="latencia de cada stub en ms, ej. gemini=800,owm=50")
+    parser.add_argument("--errores", default="", help="tasa de errores de cada stub, ej. gemini=0.05")
+    parser.add_argument("--variacion", type=float, default=0.2, help="variación aleatoria relativa de la latencia")
+    parser.add_argument("--repeticiones", type=int, default=2000, help="repeticiones de los micro-benchmarks")
+    parser.add_argument("--salida", help="archivo donde guardar el JSON (por defecto, la salida estándar)")
+    parser.add_argument("--servir", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.servir:
+        asyncio.run(servir(args))
+        return
+
+    resultado = json.dumps(ejecutar(args), ensure_ascii=False, indent=2)
+    if args.salida:
+        Path(args.salida).write_text(resultado + "\n", encoding="utf-8")
+    else:
+        print(resultado)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark del extractor de destinos: gazetteer + trie de palabras frente al enfoque
+anterior con expresiones regulares (re.search con IGNORECASE).
+
+Uso (desde la carpeta backend):
+    python benchmarks/bench_destinos.py [--repeticiones 2000]
+
+Imprime un JSON con el tiempo medio por pregunta y la tasa de aciertos de cada enfoque.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lugares import buscar_lugar_en_texto, gazetteer  # noqa: E402
+
+# (pregunta, destino esperado o None)
+PREGUNTAS = [
+    ("¿Qué hacer en París?", "París"),
+    ("Quiero ir a nueva york en diciembre con mi familia", "Nueva York"),
+    ("Viajo desde Madrid a Tokio la próxima semana, ¿qué me recomiendas?", "Tokio"),
+    ("¿Cuál es el mejor hotel en un barrio céntrico de Roma?", "Roma"),
+    ("mi viaje a Japón será en primavera", "Japón"),
+    ("¿Qué recomiendas para un viaje de aventura barato?", None),
+    ("Es romántico viajar a Praga en invierno", "Praga"),
+    ("Voy a la CDMX y luego a Oaxaca", "Ciudad de México"),
+    ("qué comer en sao paulo", "São Paulo"),
+    ("Dame un itinerario de 5 días para Buenos Aires con presupuesto medio", "Buenos Aires"),
+    ("¿Es seguro viajar sola a Marrakech?", "Marrakech"),
+    ("Necesito ideas para mi luna de miel", None),
+    ("¿Dónde como chile en Oaxaca?", "Oaxaca"),
+]
+
+
+def extraer_destino_regex(pregunta: str) -> str | None:
+    """
+    Copia del extractor anterior basado en expresiones regulares.
+    """
+    patrones = [
+        r'(?:en|a|de|para|hacia|desde)\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)?)',
+        r'([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)?)\s+(?:es|tiene|tiene|ofrece)',
+    ]
+    for patron in patrones:
+        match = re.search(patron, pregunta, re.IGNORECASE)
+        if match:
+            posible_destino = match.group(1).strip()
+            palabras_comunes = ['viaje', 'viajar', 'viajero', 'destino', 'lugar', 'ciudad', 'país', 'país']
+            if posible_destino.lower() not in palabras_comunes:
+                return posible_destino
+    return None
+
+
+def extraer_destino_gazetteer(pregunta: str) -> str | None:
+    lugar = buscar_lugar_en_texto(pregunta)
+    return lugar.nombre if lugar else None
+
+
+def medir(extractor, repeticiones: int) -> dict:
+    aciertos = sum(extractor(p) == esperado for p, esperado in PREGUNTAS)
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        for pregunta, _esperado in PREGUNTAS:
+            extractor(pregunta)
+    total = time.perf_counter() - inicio
+    return {
+        "us_por_pregunta": round(total / (repeticiones * len(PREGUNTAS)) * 1e6, 2),
+        "aciertos": aciertos,
+        "preguntas": len(PREGUNTAS),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=2000)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    gazetteer()
+    carga_ms = (time.perf_counter() - inicio) * 1000
+
+    resultado = {
+        "benchmark": "extractor_destinos",
+        "carga_gazetteer_ms": round(carga_ms, 2),
+        "lugares_gazetteer": len(gazetteer().lugares),
+        "regex": medir(extraer_destino_regex, args.repeticiones),
+        "gazetteer": medir(extraer_destino_gazetteer, args.repeticiones),
+    }
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Sustituto local de Redis para probar y medir el almacén redis:// de la caché
+compartida sin instalar un servidor.
+
+Habla RESP2 y solo implementa lo que usa la app: PING, GET, SET (con PX/EX), DEL,
+DBSIZE, FLUSHDB, SELECT y AUTH (los dos últimos se aceptan sin efecto). Las claves
+vencen por PX/EX como en Redis (se borran al leerlas).
+
+Uso (desde la carpeta backend):
+    python benchmarks/redis_local.py [--puerto 6379]
+"""
+import argparse
+import asyncio
+import time
+
+
+class RedisLocal:
+    def __init__(self):
+        # clave -> (valor, vence en time.monotonic() o None)
+        self.datos: dict[bytes, tuple[bytes, float | None]] = {}
+        self.comandos = 0
+
+    def _vigente(self, clave: bytes) -> bytes | None:
+        entrada = self.datos.get(clave)
+        if entrada is None:
+            return None
+        valor, vence = entrada
+        if vence is not None and vence <= time.monotonic():
+            del self.datos[clave]
+            return None
+        return valor
+
+    def ejecutar(self, partes: list[bytes]) -> bytes:
+        self.comandos += 1
+        comando = partes[0].upper()
+        if comando == b"PING":
+            return b"+PONG\r\n"
+        if comando in (b"SELECT", b"AUTH"):
+            return b"+OK\r\n"
+        if comando == b"GET":
+            valor = self._vigente(partes[1])
+            return b"$-1\r\n" if valor is None else b"$%d\r\n%s\r\n" % (len(valor), valor)
+        if comando == b"SET":
+            vence = None
+            opciones = [p.upper() for p in partes[3:]]
+            if b"PX" in opciones:
+                vence = time.monotonic() + int(partes[3 + opciones.index(b"PX") + 1]) / 1000
+            elif b"EX" in opciones:
+                vence = time.monotonic() + int(partes[3 + opciones.index(b"EX") + 1])
+            self.datos[partes[1]] = (partes[2], vence)
+            return b"+OK\r\n"
+        if comando == b"DEL":
+            borradas = sum(self.datos.pop(clave, None) is not None for clave in partes[1:])
+            return b":%d\r\n" % borradas
+        if comando == b"DBSIZE":
+            return b":%d\r\n" % len(self.datos)
+        if comando == b"FLUSHDB":
+            self.datos.clear()
+            return b"+OK\r\n"
+        return b"-ERR comando no soportado '%s'\r\n" % comando
+
+    async def atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                if not linea.startswith(b"*"):
+                    escritor.write(b"-ERR se esperaba un array RESP\r\n")
+                    continue
+                partes = []
+                for _ in range(int(linea[1:-2])):
+                    largo = int((await lector.readline())[1:-2])
+                    partes.append((await lector.readexactly(largo + 2))[:-2])
+                escritor.write(self.ejecutar(partes))
+                await escritor.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            escritor.close()
+
+
+async def iniciar_redis_local(puerto: int = 0) -> tuple[asyncio.base_events.Server, RedisLocal, str]:
+    """
+    Sirve el sustituto en 127.0.0.1 (puerto libre si es 0). Retorna (servidor, estado, url).
+    """
+    redis = RedisLocal()
+    servidor = await asyncio.start_server(redis.atender, "127.0.0.1", puerto)
+    puerto = servidor.sockets[0].getsockname()[1]
+    return servidor, redis, f"redis://127.0.0.1:{puerto}/0"
+
+
+async def servir(puerto: int) -> None:
+    servidor, _redis, url = await iniciar_redis_local(puerto)
+    print(url, flush=True)
+    async with servidor:
+        await servidor.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--puerto", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(servir(args.puerto))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Servidores falsos (stubs) de las APIs externas para los benchmarks.
+
+Un único servidor Starlette local responde como OpenWeatherMap, Unsplash,
+exchangerate-api y Gemini, con latencia configurable (más una variación aleatoria)
+e inyección de errores por API. La API de zonas horarias (timeapi.io) ya no se usa:
+la zona horaria se resuelve localmente, así que no necesita stub.
+"""
+import asyncio
+import random
+import socket
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+APIS = ("owm", "unsplash", "tipo_cambio", "gemini")
+
+# Latencias por defecto (ms), parecidas a las observadas en producción
+LATENCIAS_POR_DEFECTO = {"owm": 80, "unsplash": 150, "tipo_cambio": 60, "gemini": 1200}
+
+# Respuesta con las 5 secciones y un tamaño parecido al de una respuesta real (~3 KB)
+TEXTO_GEMINI = "¡Hola! Soy Alex, tu consultor personal de viajes ✈️\n\n" + "\n".join(
+    f"{seccion}:\n" + "".join(
+        f"• {emoji} Recomendación {i} para tu viaje, con detalles prácticos, horarios y precios aproximados\n"
+        for i in range(1, 7)
+    )
+    for seccion, emoji in (
+        ("ALOJAMIENTO", "🏨"), ("COMIDA LOCAL", "🍽️"), ("LUGARES IMPERDIBLES", "🏛️"),
+        ("CONSEJOS LOCALES", "🎒"), ("ESTIMACIÓN DE COSTOS", "💰"),
+    )
+)
+
+
+class ConfigStubs:
+    """
+    Latencia (ms), variación relativa de la latencia y tasa de errores por API.
+    """
+
+    def __init__(self, latencias: dict | None = None, errores: dict | None = None, variacion: float = 0.2, semilla: int = 1):
+        self.latencias = {**LATENCIAS_POR_DEFECTO, **(latencias or {})}
+        self.errores = {api: 0.0 for api in APIS} | (errores or {})
+        self.variacion = variacion
+        self.llamadas = {api: 0 for api in APIS}
+        self._azar = random.Random(semilla)
+
+    async def simular(self, api: str) -> bool:
+        """
+        Espera la latencia de la API y decide si la respuesta es un error.
+        """
+        self.llamadas[api] += 1
+        latencia = self.latencias[api] / 1000
+        latencia *= 1 + self._azar.uniform(-self.variacion, self.variacion)
+        await asyncio.sleep(max(0.0, latencia))
+        return self._azar.random() < self.errores[api]
+
+    def como_dict(self) -> dict:
+        return {"latencias_ms": self.latencias, "tasa_errores": self.errores, "variacion": self.variacion}
+
+
+def crear_app_stubs(config: ConfigStubs) -> Starlette:
+    async def clima(request: Request):
+        if await config.simular("owm"):
+            return JSONResponse({"cod": 500, "message": "error inyectado"}, status_code=500)
+        lat = float(request.query_params.get("lat", 40.4))
+        lon = float(request.query_params.get("lon", -3.7))
+        return JSONResponse({
+            "coord": {"lat": lat, "lon": lon},
+            "weather": [{"description": "cielo claro"}],
+            "main": {"temp": 21.3, "feels_like": 20.8, "humidity": 45},
+            "wind": {"speed": 3.2},
+            "sys": {"country": "ES"},
+            "timezone": 3600,
+            "name": request.query_params.get("q", "Madrid"),
+        })
+
+    async def fotos(request: Request):
+        if await config.simular("unsplash"):
+            return JSONResponse({"errors": ["error inyectado"]}, status_code=500)
+        cantidad = int(request.query_params.get("per_page", 3))
+        return JSONResponse({"results": [
+            {
+                "id": f"foto-{i}",
+                "width": 6000,
+                "height": 4000,
+                "color": "#8ca6c0",
+                "blur_hash": "LKO2?U%2Tw=w]~RBVZRi};RPxuwH",
+                "alt_description": f"vista de {request.query_params.get('query', '')}",
+                "urls": {
+                    "raw": f"https://images.unsplash.test/foto-{i}?ixid=stub&ixlib=rb-4.0.3",
+                    "regular": f"https://images.unsplash.test/foto-{i}?w=1080",
+                },
+                "user": {"name": "Autor Stub", "links": {"html": "https://unsplash.test/@stub"}},
+            }
+            for i in range(cantidad)
+        ]})
+
+    async def tipo_cambio(request: Request):
+        if await config.simular("tipo_cambio"):
+            return JSONResponse({"result": "error"}, status_code=500)
+        return JSONResponse({"base": "USD", "rates": {"USD": 1, "EUR": 0.92, "MXN": 17.1, "GBP": 0.79}})
+
+    async def gemini(request: Request):
+        if await config.simular("gemini"):
+            return JSONResponse({"error": "error inyectado"}, status_code=500)
+        return JSONResponse({"texto": TEXTO_GEMINI})
+
+    async def modelo_gemini(request: Request):
+        # Metadatos del modelo (como genai.get_model): sin latencia de generación
+        return JSONResponse({"name": f"models/{request.path_params['modelo']}"})
+
+    async def llamadas(request: Request):
+        return JSONResponse(config.llamadas)
+
+    return Starlette(routes=[
+        Route("/data/2.5/weather", clima),
+        Route("/search/photos", fotos),
+        Route("/v4/latest/USD", tipo_cambio),
+        Route("/gemini/{modelo}", gemini, methods=["POST"]),
+        Route("/gemini/{modelo}", modelo_gemini, methods=["GET"]),
+        Route("/_llamadas", llamadas),
+    ])
+
+
+async def iniciar_servidor(app) -> tuple[uvicorn.Server, asyncio.Task, str]:
+    """
+    Sirve una app ASGI con uvicorn en un puerto libre de 127.0.0.1.
+    Retorna (servidor, tarea, url_base).
+    """
+    # Con proto=IPPROTO_TCP asyncio activa TCP_NODELAY en las conexiones aceptadas;
+    # sin él, el algoritmo de Nagle añade ~40 ms a cada respuesta
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    puerto = sock.getsockname()[1]
+    servidor = uvicorn.Server(uvicorn.Config(app, log_level="warning", access_log=False, lifespan="auto"))
+    tarea = asyncio.create_task(servidor.serve(sockets=[sock]))
+    while not servidor.started:
+        if tarea.done():
+            tarea.result()
+        await asyncio.sleep(0.01)
+    return servidor, tarea, f"http://127.0.0.1:{puerto}"
+
+
+async def detener_servidor(servidor: uvicorn.Server, tarea: asyncio.Task) -> None:
+    servidor.should_exit = True
+    await tarea
+
+
+class _RespuestaGemini:
+    def __init__(self, texto: str):
+        self.text = texto
+
+
+class _FragmentosGemini:
+    """
+    Respuesta en streaming: el texto del stub dividido en fragmentos.
+    """
+
+    def __init__(self, texto: str, tamano: int = 80):
+        self._fragmentos = [_RespuestaGemini(texto[i:i + tamano]) for i in range(0, len(texto), tamano)]
+
+    def __aiter__(self):
+        return self._iterar()
+
+    async def _iterar(self):
+        for fragmento in self._fragmentos:
+            yield fragmento
+
+
+class ModeloGeminiStub:
+    """
+    Sustituto de genai.GenerativeModel que llama al stub de Gemini por HTTP.
+    """
+
+    def __init__(self, nombre: str, url_base: str, cliente: httpx.AsyncClient):
+        self.nombre = nombre
+        self._url = f"{url_base}/gemini/{nombre}"
+        self._cliente = cliente
+
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        respuesta = await self._cliente.post(self._url, json={"prompt": prompt})
+        if respuesta.status_code != 200:
+            raise RuntimeError(f"{respuesta.status_code} Error del stub de Gemini")
+        texto = respuesta.json()["texto"]
+        return _FragmentosGemini(texto) if stream else _RespuestaGemini(texto)
+
+
+async def comprobar_modelo_stub(nombre: str, url_base: str, cliente: httpx.AsyncClient) -> bool:
+    """
+    Sustituto de la comprobación de modelo del arranque (genai.get_model).
+    """
+    respuesta = await cliente.get(f"{url_base}/gemini/{nombre}")
+    return respuesta.status_code == 200
@@ -0,0 +1,353 @@
+"""
+Caché en memoria con expiración (TTL) y desalojo LRU para las consultas a APIs externas.
+
+Cada fuente (clima, tipo de cambio, fotos) tiene su propia instancia
+con un TTL y un número máximo de entradas. Las claves de ciudades se normalizan
+(sin acentos, sin mayúsculas) para que "París", "paris" y "PARIS" compartan entrada.
+Además, las peticiones concurrentes a la misma clave se coalescen en una sola
+llamada a la API externa (single-flight).
+
+Con un periodo de gracia (stale-while-revalidate), una entrada vencida se sigue
+sirviendo durante la gracia mientras se refresca en segundo plano, así la petición
+que llega justo después del vencimiento no paga la latencia de la API.
+
+Con una caché compartida entre procesos (ver cache_compartida.py), la memoria del
+proceso es el primer nivel: antes de calcular una clave que no está (o de refrescarla)
+se busca en el almacén compartido, y lo que se guarda se publica en él.
+"""
+import asyncio
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from cache_compartida import ALMACEN_COMPARTIDO, AlmacenCompartido, clave_compartida, codificar, decodificar
+from divisas import TablaTipos
+from plazos import sin_plazo
+
+
+# Tabla para quitar los acentos más comunes sin pasar por unicodedata. Los signos
+# de apertura y las comillas tipográficas se cambian por su equivalente ASCII para
+# que las preguntas normales ("¿Qué hacer en París?") no caigan en el caso lento.
+_SIN_ACENTOS = str.maketrans(
+    "áéíóúüñàèìòùâêîôûäëïöçãõÁÉÍÓÚÜÑÀÈÌÒÙÂÊÎÔÛÄËÏÖÇÃÕ¿¡“”‘’«»–—",
+    "aeiouunaeiouaeiouaeiocaoAEIOUUNAEIOUAEIOUAEIOCAO?!\"\"''\"\"--",
+)
+
+
+def normalizar_clave(texto: str) -> str:
+    """
+    Normaliza un texto para usarlo como clave: quita acentos, pasa a minúsculas
+    (casefold) y colapsa los espacios.
+    """
+    sin_acentos = texto.translate(_SIN_ACENTOS)
+    if not sin_acentos.isascii():
+        # Caso lento solo para caracteres fuera de la tabla
+        sin_acentos = unicodedata.normalize("NFKD", sin_acentos)
+        sin_acentos = "".join(c for c in sin_acentos if not unicodedata.combining(c))
+    return " ".join(sin_acentos.casefold().split())
+
+
+class SingleFlight:
+    """
+    Coalescencia de peticiones en vuelo: si varias corrutinas piden la misma clave
+    a la vez, solo la primera ejecuta la llamada real y el resto espera su resultado.
+    Los errores se propagan a todos los que esperan.
+    Con `sin_plazo`, la llamada real no hereda el plazo de la petición que la lanzó:
+    cada petición acota solo su propia espera (con_plazo) y la llamada sigue hasta
+    terminar para el resto.
+    """
+
+    def __init__(self, sin_plazo: bool = False):
+        self._en_vuelo: dict[Any, asyncio.Future] = {}
+        self.coalescidas = 0
+        self.sin_plazo = sin_plazo
+
+    def lanzar(self, clave: Any, calcular: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """
+        Inicia el cálculo de una clave (o se une al que ya está en vuelo) sin esperarlo.
+        """
+        tarea = self._en_vuelo.get(clave)
+        if tarea is None:
+            tarea = asyncio.ensure_future(sin_plazo(calcular()) if self.sin_plazo else calcular())
+            self._en_vuelo[clave] = tarea
+            tarea.add_done_callback(lambda t: self._terminar(clave, t))
+        else:
+            self.coalescidas += 1
+        return tarea
+
+    async def ejecutar(self, clave: Any, calcular: Callable[[], Awaitable[Any]]) -> Any:
+        # shield: si un cliente cancela su petición, la llamada compartida sigue
+        # corriendo para el resto de los que esperan
+        return await asyncio.shield(self.lanzar(clave, calcular))
+
+    def _terminar(self, clave: Any, tarea: asyncio.Future) -> None:
+        if self._en_vuelo.get(clave) is tarea:
+            del self._en_vuelo[clave]
+        # Marcar la excepción como leída aunque todos los que esperaban se hayan cancelado
+        if not tarea.cancelled():
+            tarea.exception()
+
+    def en_vuelo(self) -> int:
+        return len(self._en_vuelo)
+
+    async def cancelar(self) -> None:
+        """
+        Cancela los cálculos en vuelo (incluidos los refrescos en segundo plano que
+        nadie espera) y espera a que terminen. Se usa al apagar la app, antes de
+        cerrar el cliente HTTP que usan.
+        """
+        tareas = list(self._en_vuelo.values())
+        for tarea in tareas:
+            tarea.cancel()
+        if tareas:
+            await asyncio.gather(*tareas, return_exceptions=True)
+
+
+class CacheTTL:
+    """
+    Caché acotada con TTL por entrada y desalojo LRU cuando se alcanza el máximo.
+    """
+
+    def __init__(
+        self,
+        nombre: str,
+        ttl: float,
+        max_entradas: int = 1000,
+        gracia: float = 0,
+        compartida: AlmacenCompartido | None = None,
+        a_json: Callable[[Any], Any] | None = None,
+        desde_json: Callable[[Any], Any] | None = None,
+    ):
+        self.nombre = nombre
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        # Segundos tras el vencimiento en los que la entrada aún se sirve mientras se refresca
+        self.gracia = gracia
+        self._entradas: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.obsoletas_servidas = 0
+        self.refrescos = 0
+        # Las descargas y los refrescos usan HTTP_TIMEOUT, no el plazo de quien los lanzó
+        self._vuelos = SingleFlight(sin_plazo=True)
+        # Segundo nivel compartido entre procesos y conversión de los valores que no
+        # son JSON (ej. TablaTipos) o que JSON no conserva (tuplas)
+        self.compartida = compartida
+        self._a_json = a_json
+        self._desde_json = desde_json
+        self.aciertos_compartida = 0
+
+    def obtener(self, clave: Any) -> tuple[bool, Any]:
+        """
+        Busca una clave. Retorna (encontrado, valor).
+        """
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return False, None
+
+        expira, valor = entrada
+        ahora = time.monotonic()
+        if expira < ahora:
+            # Dentro de la gracia la entrada se conserva para servirla obsoleta
+            if expira + self.gracia < ahora:
+                del self._entradas[clave]
+            self.fallos += 1
+            return False, None
+
+        self._entradas.move_to_end(clave)
+        self.aciertos += 1
+        return True, valor
+
+    def guardar(self, clave: Any, valor: Any, ttl: float | None = None, publicar: bool = True) -> None:
+        """
+        Guarda un valor, desalojando la entrada menos usada si la caché está llena.
+        Si hay caché compartida, el valor se publica en ella en segundo plano.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self._entradas[clave] = (time.monotonic() + ttl, valor)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+            self.desalojos += 1
+        if publicar and self.compartida is not None and ttl > 0:
+            self._publicar(clave, valor, time.time() + ttl)
+
+    def _publicar(self, clave: Any, valor: Any, expira: float) -> None:
+        try:
+            datos = codificar(self._a_json(valor) if self._a_json else valor, expira)
+        except (TypeError, ValueError) as e:
+            print(f"No se pudo serializar {self.nombre} para la caché compartida: {e}")
+            return
+        # En el almacén la entrada dura también la gracia (el valor lleva su vencimiento)
+        self.compartida.escribir_en_segundo_plano(clave_compartida(self.nombre, clave), datos, expira + self.gracia)
+
+    async def obtener_compartida(self, clave: Any) -> tuple[bool, Any]:
+        """
+        Busca la clave en la caché compartida. Si está vigente y vence después que la
+        copia en memoria (otro proceso la descargó o refrescó), se guarda en memoria
+        con el tiempo que le queda. Retorna (encontrado, valor).
+        """
+        if self.compartida is None:
+            return False, None
+        datos = await self.compartida.leer(clave_compartida(self.nombre, clave))
+        if datos is None:
+            return False, None
+        try:
+            expira, valor = decodificar(datos)
+            if self._desde_json:
+                valor = self._desde_json(valor)
+        except Exception as e:
+            print(f"Entrada no válida de {self.nombre} en la caché compartida: {e}")
+            return False, None
+        restante = expira - time.time()
+        local = self.segundos_restantes(clave)
+        if restante <= 0 or (local is not None and local >= restante):
+            return False, None
+        self.guardar(clave, valor, ttl=restante, publicar=False)
+        self.aciertos_compartida += 1
+        return True, valor
+
+    def limpiar(self) -> None:
+        self._entradas.clear()
+
+    def segundos_restantes(self, clave: Any) -> float | None:
+        """
+        Segundos hasta el vencimiento de una entrada (negativo si ya venció pero
+        sigue en su gracia) o None si no está. No cuenta como acierto ni fallo.
+        """
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        restante = entrada[0] - time.monotonic()
+        return restante if restante + self.gracia >= 0 else None
+
+    def consultar(self, clave: Any) -> tuple[bool, Any]:
+        """
+        Valor guardado, vigente u obsoleto dentro de su gracia, sin calcularlo si no
+        está y sin contar acierto ni fallo. Retorna (encontrado, valor).
+        """
+        entrada = self._entradas.get(clave)
+        if entrada is None or entrada[0] + self.gracia < time.monotonic():
+            return False, None
+        return True, entrada[1]
+
+    def _calcular_y_guardar(self, clave: Any, calcular: Callable[[], Awaitable[Any]], cachear_si: Callable[[Any], bool]):
+        async def calcular_y_guardar():
+            encontrado, valor = await self.obtener_compartida(clave)
+            if encontrado:
+                return valor
+            valor = await calcular()
+            if cachear_si(valor):
+                self.guardar(clave, valor)
+            return valor
+        return calcular_y_guardar
+
+    async def refrescar(
+        self,
+        clave: Any,
+        calcular: Callable[[], Awaitable[Any]],
+        cachear_si: Callable[[Any], bool] = bool,
+    ) -> Any:
+        """
+        Recalcula una entrada aunque siga vigente (para refrescarla antes de que venza).
+        Mientras tanto las peticiones siguen recibiendo el valor anterior.
+        """
+        self.refrescos += 1
+        return await self._vuelos.ejecutar(clave, self._calcular_y_guardar(clave, calcular, cachear_si))
+
+    async def obtener_o_calcular(
+        self,
+        clave: Any,
+        calcular: Callable[[], Awaitable[Any]],
+        cachear_si: Callable[[Any], bool] = bool,
+    ) -> Any:
+        """
+        Devuelve el valor en caché o lo calcula con `calcular()` y lo guarda.
+        Solo se guardan los resultados para los que `cachear_si(valor)` es verdadero,
+        así las respuestas vacías por errores no quedan en caché.
+        Las llamadas concurrentes con la misma clave comparten un único cálculo.
+        Si la entrada venció pero está en su gracia, se devuelve el valor obsoleto
+        y se refresca en segundo plano.
+        """
+        encontrado, valor = self.obtener(clave)
+        if encontrado:
+            return valor
+
+        calcular_y_guardar = self._calcular_y_guardar(clave, calcular, cachear_si)
+        obsoleta, valor = self.consultar(clave)
+        if obsoleta:
+            self.obsoletas_servidas += 1
+            self._vuelos.lanzar(clave, calcular_y_guardar)
+            return valor
+
+        return await self._vuelos.ejecutar(clave, calcular_y_guardar)
+
+    def estadisticas(self) -> dict:
+        total = self.aciertos + self.fallos
+        return {
+            "entradas": len(self._entradas),
+            "max_entradas": self.max_entradas,
+            "ttl_segundos": self.ttl,
+            "gracia_segundos": self.gracia,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos,
+            "obsoletas_servidas": self.obsoletas_servidas,
+            "refrescos": self.refrescos,
+            "coalescidas": self._vuelos.coalescidas,
+            "en_vuelo": self._vuelos.en_vuelo(),
+            "aciertos_compartida": self.aciertos_compartida,
+            "tasa_aciertos": round(self.aciertos / total, 4) if total else 0.0,
+        }
+
+
+# Cachés por fuente. TTL y tamaño configurables por variables de entorno.
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "1000"))
+
+# La gracia (CACHE_GRACIA_*) es el tiempo que un valor vencido se sirve mientras se refresca.
+# Todas usan la caché compartida entre procesos si CACHE_COMPARTIDA está configurada.
+CACHE_CLIMA = CacheTTL(
+    "clima", float(os.getenv("CACHE_TTL_CLIMA", "600")), CACHE_MAX_ENTRADAS,
+    gracia=float(os.getenv("CACHE_GRACIA_CLIMA", "300")), compartida=ALMACEN_COMPARTIDO,
+)
+CACHE_TIPO_CAMBIO = CacheTTL(
+    "tipo_cambio", float(os.getenv("CACHE_TTL_TIPO_CAMBIO", "3600")), 16,
+    gracia=float(os.getenv("CACHE_GRACIA_TIPO_CAMBIO", "3600")), compartida=ALMACEN_COMPARTIDO,
+    a_json=TablaTipos.como_dict, desde_json=TablaTipos.desde_dict,
+)
+CACHE_FOTOS = CacheTTL(
+    "fotos", float(os.getenv("CACHE_TTL_FOTOS", "86400")), CACHE_MAX_ENTRADAS,
+    gracia=float(os.getenv("CACHE_GRACIA_FOTOS", "86400")), compartida=ALMACEN_COMPARTIDO,
+)
+
+CACHES = [CACHE_CLIMA, CACHE_TIPO_CAMBIO, CACHE_FOTOS]
+
+
+def estadisticas_caches() -> dict:
+    """
+    Retorna los contadores de aciertos/fallos de todas las cachés (y del almacén
+    compartido, si hay).
+    """
+    estadisticas = {cache.nombre: cache.estadisticas() for cache in CACHES}
+    if ALMACEN_COMPARTIDO is not None:
+        estadisticas["compartida"] = ALMACEN_COMPARTIDO.estadisticas()
+    return estadisticas
+
+
+async def cancelar_descargas() -> None:
+    """
+    Cancela las descargas en vuelo de todas las cachés (ver SingleFlight.cancelar).
+    """
+    await asyncio.gather(*(cache._vuelos.cancelar() for cache in CACHES))
+
+
+async def cerrar_cache_compartida() -> None:
+    """
+    Espera las escrituras pendientes en la caché compartida y cierra la conexión.
+    """
+    if ALMACEN_COMPARTIDO is not None:
+        await ALMACEN_COMPARTIDO.cerrar()
@@ -0,0 +1,415 @@
+"""
+Caché compartida entre procesos: segundo nivel de las cachés en memoria (CacheTTL).
+
+Con varios workers de uvicorn (--workers N) o varias instancias, cada proceso tiene
+sus propias cachés en memoria: sin nada compartido, cada uno arranca en frío y llama
+por su cuenta a las APIs con límite de tasa. Con CACHE_COMPARTIDA configurada, la
+memoria del proceso sigue siendo el primer nivel; cuando una clave no está (o toca
+refrescarla) se consulta antes el almacén compartido, y lo que descarga un proceso
+lo aprovechan los demás.
+
+Almacenes (CACHE_COMPARTIDA):
+- sqlite:///ruta/cache.db: archivo SQLite en modo WAL y con mmap, para los workers
+  de una misma máquina. Los lectores no se bloquean entre sí ni con el escritor.
+  "sqlite://" sin ruta usa un archivo en el directorio temporal.
+- redis://[:clave@]host:puerto/db (o rediss:// con TLS): cualquier servidor que hable
+  el protocolo de Redis, para varias instancias. El cliente (RESP) va incluido, sin
+  dependencias.
+
+Cada valor se guarda como una cabecera de 9 bytes (vencimiento en epoch y banderas)
+seguida de JSON compacto, comprimido con zlib a partir de
+CACHE_COMPARTIDA_COMPRIMIR_DESDE bytes. El vencimiento viaja con el valor, así que
+el TTL es el mismo en todos los procesos y almacenes; el almacén borra la entrada
+cuando termina también el periodo de gracia.
+
+Un error o un timeout del almacén nunca hace fallar una petición: se cuenta y la
+clave se trata como ausente.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from urllib.parse import unquote, urlsplit
+
+CACHE_COMPARTIDA = os.getenv("CACHE_COMPARTIDA", "")
+# Tamaño (bytes de JSON) a partir del cual el valor se comprime
+CACHE_COMPARTIDA_COMPRIMIR_DESDE = int(os.getenv("CACHE_COMPARTIDA_COMPRIMIR_DESDE", "512"))
+# Tiempo máximo de una lectura (la petición espera) y de una escritura (en segundo plano)
+CACHE_COMPARTIDA_TIMEOUT_LECTURA = float(os.getenv("CACHE_COMPARTIDA_TIMEOUT_LECTURA", "0.25"))
+CACHE_COMPARTIDA_TIMEOUT_ESCRITURA = float(os.getenv("CACHE_COMPARTIDA_TIMEOUT_ESCRITURA", "2"))
+
+# Prefijo de las claves: se cambia si cambia el formato de los valores
+VERSION_FORMATO = "v2"
+
+# Vencimiento (epoch, float64) y banderas
+_CABECERA = struct.Struct(">dB")
+_COMPRIMIDO = 1
+
+
+def codificar(valor: Any, expira: float, comprimir_desde: int = CACHE_COMPARTIDA_COMPRIMIR_DESDE) -> bytes:
+    """
+    Valor (serializable a JSON) y su vencimiento en epoch -> bytes para el almacén.
+    """
+    datos = json.dumps(valor, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    banderas = 0
+    if len(datos) >= comprimir_desde:
+        comprimido = zlib.compress(datos, 6)
+        if len(comprimido) < len(datos):
+            datos, banderas = comprimido, _COMPRIMIDO
+    return _CABECERA.pack(expira, banderas) + datos
+
+
+def decodificar(blob: bytes) -> tuple[float, Any]:
+    """
+    Inversa de codificar: retorna (vencimiento en epoch, valor).
+    """
+    expira, banderas = _CABECERA.unpack_from(blob)
+    datos = blob[_CABECERA.size:]
+    if banderas & _COMPRIMIDO:
+        datos = zlib.decompress(datos)
+    return expira, json.loads(datos)
+
+
+def clave_compartida(espacio: str, clave: Any) -> str:
+    """
+    Clave del almacén para una clave de caché (cadena, tupla...): espacio más un
+    hash corto, así las claves largas (preguntas) ocupan siempre lo mismo.
+    """
+    texto = json.dumps(clave, ensure_ascii=False, separators=(",", ":"))
+    return f"{VERSION_FORMATO}:{espacio}:{hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest()}"
+
+
+class AlmacenCompartido:
+    """
+    Almacén de bytes con vencimiento compartido entre procesos. Las subclases
+    implementan _leer, _escribir y _cerrar; aquí se aplican los timeouts, se
+    cuentan las operaciones y se convierten los errores en ausencias.
+    """
+
+    nombre = "almacen"
+
+    def __init__(self):
+        self.lecturas = 0
+        self.aciertos = 0
+        self.escrituras = 0
+        self.errores = 0
+        self._escrituras_pendientes: set[asyncio.Task] = set()
+
+    async def _leer(self, clave: str) -> bytes | None:
+        raise NotImplementedError
+
+    async def _escribir(self, clave: str, valor: bytes, vence: float) -> None:
+        raise NotImplementedError
+
+    async def _cerrar(self) -> None:
+        pass
+
+    def _registrar_error(self, operacion: str, error: Exception) -> None:
+        self.errores += 1
+        print(f"Error en la caché compartida ({self.nombre}, {operacion}): {error!r}")
+
+    async def leer(self, clave: str) -> bytes | None:
+        self.lecturas += 1
+        try:
+            valor = await asyncio.wait_for(self._leer(clave), CACHE_COMPARTIDA_TIMEOUT_LECTURA)
+        except Exception as e:
+            self._registrar_error("leer", e)
+            return None
+        if valor is not None:
+            self.aciertos += 1
+        return valor
+
+    async def escribir(self, clave: str, valor: bytes, vence: float) -> None:
+        """
+        Guarda `valor` hasta `vence` (epoch). Las entradas ya vencidas no se escriben.
+        """
+        if vence <= time.time():
+            return
+        try:
+            await asyncio.wait_for(self._escribir(clave, valor, vence), CACHE_COMPARTIDA_TIMEOUT_ESCRITURA)
+            self.escrituras += 1
+        except Exception as e:
+            self._registrar_error("escribir", e)
+
+    def escribir_en_segundo_plano(self, clave: str, valor: bytes, vence: float) -> None:
+        """
+        Escribe sin hacer esperar a la petición (la tarea se espera al cerrar).
+        """
+        tarea = asyncio.get_running_loop().create_task(self.escribir(clave, valor, vence))
+        self._escrituras_pendientes.add(tarea)
+        tarea.add_done_callback(self._escrituras_pendientes.discard)
+
+    async def cerrar(self) -> None:
+        if self._escrituras_pendientes:
+            await asyncio.gather(*self._escrituras_pendientes, return_exceptions=True)
+        await self._cerrar()
+
+    def estadisticas(self) -> dict:
+        return {
+            "almacen": self.nombre,
+            "lecturas": self.lecturas,
+            "aciertos": self.aciertos,
+            "escrituras": self.escrituras,
+            "escrituras_pendientes": len(self._escrituras_pendientes),
+            "errores": self.errores,
+            "tasa_aciertos": round(self.aciertos / self.lecturas, 4) if self.lecturas else 0.0,
+        }
+
+
+class AlmacenSQLite(AlmacenCompartido):
+    """
+    Archivo SQLite en modo WAL compartido por los procesos de una máquina. Cada
+    proceso usa dos conexiones, cada una en un hilo propio: una para leer y otra
+    para escribir. Así las esperas por el bloqueo de escritura (busy_timeout) nunca
+    bloquean el event loop ni retrasan las lecturas, que en WAL no esperan a nadie.
+    """
+
+    nombre = "sqlite"
+
+    def __init__(self, ruta: str, mmap_bytes: int = 64 * 1024 * 1024, purgar_cada: int = 1000):
+        super().__init__()
+        self.ruta = ruta
+        self.mmap_bytes = mmap_bytes
+        # Cada cuántas escrituras se borran las entradas vencidas
+        self.purgar_cada = purgar_cada
+        self._escrituras_desde_purga = 0
+        # "lectura" / "escritura" -> conexión (cada una solo se usa desde su hilo)
+        self._conexiones: dict[str, sqlite3.Connection] = {}
+        self._hilos = {
+            "lectura": ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-sqlite-lectura"),
+            "escritura": ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-sqlite-escritura"),
+        }
+
+    def _conectar(self, uso: str) -> sqlite3.Connection:
+        conexion = self._conexiones.get(uso)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=CACHE_COMPARTIDA_TIMEOUT_ESCRITURA, isolation_level=None,
+                                       check_same_thread=False)
+            try:
+                conexion.execute("PRAGMA journal_mode=WAL")
+                # En WAL, NORMAL solo sincroniza en los checkpoints: una caché puede perder
+                # las últimas escrituras si se cae la máquina, nunca corromperse
+                conexion.execute("PRAGMA synchronous=NORMAL")
+                conexion.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+                conexion.execute(
+                    "CREATE TABLE IF NOT EXISTS cache (clave TEXT PRIMARY KEY, vence REAL NOT NULL, valor BLOB NOT NULL)"
+                    " WITHOUT ROWID"
+                )
+            except sqlite3.Error:
+                conexion.close()
+                raise
+            self._conexiones[uso] = conexion
+        return conexion
+
+    def _leer_en_hilo(self, clave: str) -> bytes | None:
+        fila = self._conectar("lectura").execute(
+            "SELECT valor FROM cache WHERE clave = ? AND vence > ?", (clave, time.time())
+        ).fetchone()
+        return fila[0] if fila else None
+
+    def _escribir_en_hilo(self, clave: str, valor: bytes, vence: float) -> None:
+        conexion = self._conectar("escritura")
+        # Con escritores concurrentes gana el valor que vence más tarde (el más reciente)
+        conexion.execute(
+            "INSERT INTO cache (clave, vence, valor) VALUES (?, ?, ?)"
+            " ON CONFLICT(clave) DO UPDATE SET vence = excluded.vence, valor = excluded.valor"
+            " WHERE excluded.vence >= cache.vence",
+            (clave, vence, valor),
+        )
+        self._escrituras_desde_purga += 1
+        if self._escrituras_desde_purga >= self.purgar_cada:
+            self._escrituras_desde_purga = 0
+            conexion.execute("DELETE FROM cache WHERE vence <= ?", (time.time(),))
+
+    async def _leer(self, clave: str) -> bytes | None:
+        return await asyncio.get_running_loop().run_in_executor(self._hilos["lectura"], self._leer_en_hilo, clave)
+
+    async def _escribir(self, clave: str, valor: bytes, vence: float) -> None:
+        await asyncio.get_running_loop().run_in_executor(
+            self._hilos["escritura"], self._escribir_en_hilo, clave, valor, vence
+        )
+
+    def _cerrar_en_hilo(self, uso: str) -> None:
+        conexion = self._conexiones.pop(uso, None)
+        if conexion is not None:
+            conexion.close()
+
+    async def _cerrar(self) -> None:
+        bucle = asyncio.get_running_loop()
+        for uso, hilo in self._hilos.items():
+            await bucle.run_in_executor(hilo, self._cerrar_en_hilo, uso)
+
+
+class ErrorRESP(Exception):
+    """
+    Respuesta de error del servidor (línea "-ERR ...").
+    """
+
+
+class ClienteRESP:
+    """
+    Cliente mínimo del protocolo de Redis (RESP2) sobre una sola conexión con
+    pipelining: los comandos se escriben sin esperar a los anteriores y las
+    respuestas, que llegan en el mismo orden, se reparten por una cola de futuros.
+    Si la conexión se pierde, los comandos en curso fallan y el siguiente reconecta.
+    """
+
+    def __init__(self, host: str, puerto: int, db: int = 0, clave: str | None = None, tls: bool = False):
+        self.host = host
+        self.puerto = puerto
+        self.db = db
+        self.clave = clave
+        self.tls = tls
+        self._escritor: asyncio.StreamWriter | None = None
+        self._lector: asyncio.Task | None = None
+        self._esperando: deque[asyncio.Future] = deque()
+        self._conectando = asyncio.Lock()
+
+    @staticmethod
+    def _codificar(partes: tuple) -> bytes:
+        trozos = [b"*%d\r\n" % len(partes)]
+        for parte in partes:
+            if not isinstance(parte, bytes):
+                parte = str(parte).encode("utf-8")
+            trozos.append(b"$%d\r\n%s\r\n" % (len(parte), parte))
+        return b"".join(trozos)
+
+    @classmethod
+    async def _leer_respuesta(cls, lector: asyncio.StreamReader) -> Any:
+        linea = await lector.readline()
+        if not linea:
+            raise ConnectionError("Conexión cerrada por el servidor")
+        tipo, resto = linea[:1], linea[1:-2]
+        if tipo == b"+":
+            return resto.decode()
+        if tipo == b"-":
+            return ErrorRESP(resto.decode())
+        if tipo == b":":
+            return int(resto)
+        if tipo == b"$":
+            largo = int(resto)
+            if largo < 0:
+                return None
+            datos = await lector.readexactly(largo + 2)
+            return datos[:-2]
+        if tipo == b"*":
+            cantidad = int(resto)
+            if cantidad < 0:
+                return None
+            return [await cls._leer_respuesta(lector) for _ in range(cantidad)]
+        raise ConnectionError(f"Respuesta RESP no válida: {linea!r}")
+
+    async def _repartir_respuestas(self, lector: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                respuesta = await self._leer_respuesta(lector)
+                futuro = self._esperando.popleft()
+                if futuro.done():
+                    # Quien esperaba se canceló (timeout): la respuesta se descarta
+                    continue
+                if isinstance(respuesta, ErrorRESP):
+                    futuro.set_exception(respuesta)
+                else:
+                    futuro.set_result(respuesta)
+        except asyncio.CancelledError:
+            self._desconectar(ConnectionError("Cliente cerrado"))
+            raise
+        except Exception as e:
+            self._desconectar(e)
+
+    def _desconectar(self, error: Exception) -> None:
+        if self._escritor is not None:
+            self._escritor.close()
+            self._escritor = None
+        while self._esperando:
+            futuro = self._esperando.popleft()
+            if not futuro.done():
+                futuro.set_exception(error)
+
+    def _enviar(self, partes: tuple) -> asyncio.Future:
+        futuro = asyncio.get_running_loop().create_future()
+        # Escribir y encolar sin await en medio mantiene el orden de las respuestas
+        self._escritor.write(self._codificar(partes))
+        self._esperando.append(futuro)
+        return futuro
+
+    async def _conectar(self) -> None:
+        async with self._conectando:
+            if self._escritor is not None:
+                return
+            lector, escritor = await asyncio.open_connection(self.host, self.puerto, ssl=self.tls or None)
+            self._escritor = escritor
+            self._lector = asyncio.create_task(self._repartir_respuestas(lector))
+            if self.clave:
+                await self._enviar(("AUTH", self.clave))
+            if self.db:
+                await self._enviar(("SELECT", self.db))
+
+    async def comando(self, *partes) -> Any:
+        if self._escritor is None:
+            await self._conectar()
+        return await self._enviar(partes)
+
+    async def cerrar(self) -> None:
+        if self._lector is not None:
+            self._lector.cancel()
+            try:
+                await self._lector
+            except asyncio.CancelledError:
+                pass
+            self._lector = None
+        self._desconectar(ConnectionError("Cliente cerrado"))
+
+
+class AlmacenRedis(AlmacenCompartido):
+    """
+    Servidor con el protocolo de Redis compartido por varias instancias. Cada
+    entrada se guarda con SET ... PX, así el servidor la borra al vencer la gracia.
+    """
+
+    nombre = "redis"
+
+    def __init__(self, cliente: ClienteRESP, prefijo: str = "viajeia:"):
+        super().__init__()
+        self.cliente = cliente
+        self.prefijo = prefijo
+
+    async def _leer(self, clave: str) -> bytes | None:
+        return await self.cliente.comando("GET", self.prefijo + clave)
+
+    async def _escribir(self, clave: str, valor: bytes, vence: float) -> None:
+        milisegundos = int((vence - time.time()) * 1000)
+        if milisegundos > 0:
+            await self.cliente.comando("SET", self.prefijo + clave, valor, "PX", milisegundos)
+
+    async def _cerrar(self) -> None:
+        await self.cliente.cerrar()
+
+
+def crear_almacen(url: str) -> AlmacenCompartido | None:
+    """
+    Almacén según la URL de CACHE_COMPARTIDA, o None si está vacía.
+    """
+    if not url:
+        return None
+    partes = urlsplit(url)
+    if partes.scheme == "sqlite":
+        ruta = (partes.netloc + partes.path) or os.path.join(tempfile.gettempdir(), "viajeia-cache.db")
+        return AlmacenSQLite(ruta)
+    if partes.scheme in ("redis", "rediss"):
+        db = int(partes.path.lstrip("/") or 0)
+        clave = unquote(partes.password) if partes.password else None
+        cliente = ClienteRESP(partes.hostname or "localhost", partes.port or 6379, db, clave, tls=partes.scheme == "rediss")
+        return AlmacenRedis(cliente)
+    raise ValueError(f"CACHE_COMPARTIDA no reconocida (sqlite:// o redis://): {url}")
+
+
+ALMACEN_COMPARTIDO = crear_almacen(CACHE_COMPARTIDA)
@@ -0,0 +1,181 @@
+"""
+Caché de respuestas generadas por Gemini.
+
+Muchas preguntas son casi idénticas ("¿Qué hacer en París?" con el mismo destino,
+presupuesto y preferencia). La clave combina la pregunta normalizada con el perfil
+del viaje (y opcionalmente un resumen del historial), así que esas preguntas se
+responden sin volver a llamar a Gemini.
+
+Además hay una búsqueda opcional de preguntas similares: dentro del mismo perfil se
+comparan los tokens de la pregunta con los de las preguntas cacheadas recientemente
+(similitud de Jaccard) para que reformulaciones triviales también acierten.
+
+Con caché compartida entre procesos, las respuestas se publican en ella y una
+pregunta exacta que no está en memoria se busca ahí antes de llamar a Gemini.
+"""
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from cache import CacheTTL, SingleFlight, normalizar_clave
+from cache_compartida import AlmacenCompartido
+
+# Palabras que no aportan al significado de la pregunta para la búsqueda de similares
+PALABRAS_VACIAS = {
+    "a", "al", "algo", "con", "cual", "cuales", "de", "del", "el", "en", "es", "la",
+    "las", "lo", "los", "me", "mi", "para", "por", "puedo", "puede", "que", "se",
+    "su", "un", "una", "unos", "unas", "y", "hay", "podria", "recomiendas", "recomienda",
+}
+
+
+def normalizar_pregunta(pregunta: str) -> str:
+    """
+    Normaliza una pregunta: sin acentos, minúsculas, sin signos de puntuación.
+    """
+    return " ".join(re.findall(r"\w+", normalizar_clave(pregunta)))
+
+
+def tokens_pregunta(pregunta_normalizada: str) -> frozenset[str]:
+    """
+    Conjunto de tokens significativos (shingles de un token) de una pregunta normalizada.
+    """
+    return frozenset(t for t in pregunta_normalizada.split() if t not in PALABRAS_VACIAS)
+
+
+def similitud_jaccard(a: frozenset[str], b: frozenset[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def resumen_historial(historial: list[tuple[str, str]]) -> str:
+    """
+    Digest estable del historial para usarlo en la clave de caché.
+    """
+    if not historial:
+        return ""
+    return hashlib.sha1(json.dumps(historial, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class CacheRespuestas:
+    """
+    Caché de respuestas con TTL, tope de entradas (LRU) y búsqueda de preguntas similares.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entradas: int,
+        umbral_similitud: float = 0.8,
+        max_recientes: int = 200,
+        compartida: AlmacenCompartido | None = None,
+    ):
+        # Los valores son tuplas (respuesta, fotos): JSON las devuelve como listas
+        self._cache = CacheTTL("respuestas", ttl, max_entradas, compartida=compartida, desde_json=tuple)
+        self.umbral_similitud = umbral_similitud
+        self.max_recientes = max_recientes
+        # clave -> (perfil, tokens) de las preguntas cacheadas más recientes
+        self._recientes: OrderedDict[tuple, tuple[tuple, frozenset[str]]] = OrderedDict()
+        self.aciertos_similares = 0
+        self._vuelos = SingleFlight()
+
+    @property
+    def ttl(self) -> float:
+        return self._cache.ttl
+
+    def _buscar_similar(self, pregunta_normalizada: str, perfil: tuple) -> tuple | None:
+        if self.umbral_similitud <= 0:
+            return None
+        tokens = tokens_pregunta(pregunta_normalizada)
+        mejor, mejor_similitud = None, self.umbral_similitud
+        for clave, (perfil_reciente, tokens_reciente) in self._recientes.items():
+            if perfil_reciente != perfil:
+                continue
+            similitud = similitud_jaccard(tokens, tokens_reciente)
+            if similitud >= mejor_similitud:
+                mejor, mejor_similitud = clave, similitud
+        return mejor
+
+    def buscar(self, pregunta: str, perfil: tuple) -> tuple[bool, Any]:
+        """
+        Busca una respuesta para la pregunta exacta o, si no hay, para una similar.
+        Retorna (encontrado, valor).
+        """
+        pregunta_normalizada = normalizar_pregunta(pregunta)
+        encontrado, valor = self._cache.obtener((pregunta_normalizada, perfil))
+        if encontrado:
+            return True, valor
+
+        similar = self._buscar_similar(pregunta_normalizada, perfil)
+        if similar is not None:
+            encontrado, valor = self._cache.obtener(similar)
+            if encontrado:
+                self.aciertos_similares += 1
+                return True, valor
+            self._recientes.pop(similar, None)
+        return False, None
+
+    async def buscar_compartida(self, pregunta: str, perfil: tuple) -> tuple[bool, Any]:
+        """
+        Busca la pregunta exacta en la caché compartida entre procesos (si hay).
+        Retorna (encontrado, valor).
+        """
+        clave = (normalizar_pregunta(pregunta), perfil)
+        encontrado, valor = await self._cache.obtener_compartida(clave)
+        if encontrado:
+            self._recordar(clave)
+        return encontrado, valor
+
+    def guardar(self, pregunta: str, perfil: tuple, valor: Any, ttl: float | None = None) -> None:
+        """
+        Guarda una respuesta con el TTL de la caché o con `ttl` (ej. más corto si
+        la respuesta lleva datos que vencen antes).
+        """
+        clave = (normalizar_pregunta(pregunta), perfil)
+        self._cache.guardar(clave, valor, ttl)
+        self._recordar(clave)
+
+    def _recordar(self, clave: tuple) -> None:
+        # Pregunta reciente para la búsqueda de similares
+        pregunta_normalizada, perfil = clave
+        self._recientes[clave] = (perfil, tokens_pregunta(pregunta_normalizada))
+        self._recientes.move_to_end(clave)
+        while len(self._recientes) > self.max_recientes:
+            self._recientes.popitem(last=False)
+
+    async def obtener_o_generar(
+        self,
+        pregunta: str,
+        perfil: tuple,
+        generar: Callable[[], Awaitable[Any]],
+        cachear_si: Callable[[Any], bool] = bool,
+        ttl_de: Callable[[Any], float | None] | None = None,
+    ) -> Any:
+        """
+        Devuelve la respuesta en caché (exacta o similar) o la genera con `generar()`.
+        Las peticiones idénticas simultáneas comparten una sola generación.
+        `ttl_de(valor)` fija el TTL de la respuesta generada (None: el de la caché).
+        """
+        encontrado, valor = self.buscar(pregunta, perfil)
+        if encontrado:
+            return valor
+
+        async def generar_y_guardar():
+            encontrado, valor = await self.buscar_compartida(pregunta, perfil)
+            if encontrado:
+                return valor
+            valor = await generar()
+            if cachear_si(valor):
+                self.guardar(pregunta, perfil, valor, ttl_de(valor) if ttl_de else None)
+            return valor
+
+        return await self._vuelos.ejecutar((normalizar_pregunta(pregunta), perfil), generar_y_guardar)
+
+    def estadisticas(self) -> dict:
+        estadisticas = self._cache.estadisticas()
+        estadisticas["aciertos_similares"] = self.aciertos_similares
+        estadisticas["coalescidas"] = self._vuelos.coalescidas
+        estadisticas["en_vuelo"] = self._vuelos.en_vuelo()
+        return estadisticas
@@ -0,0 +1,62 @@
+"""
+Cliente HTTP compartido para todas las llamadas a APIs externas.
+
+Se crea un único httpx.AsyncClient con pool de conexiones (keep-alive y HTTP/2
+cuando el paquete h2 está instalado) que vive durante todo el ciclo de vida de
+la aplicación. Así evitamos pagar un handshake TCP+TLS nuevo en cada llamada.
+"""
+import os
+
+import httpx
+
+# Límites del pool configurables por variables de entorno
+HTTP_MAX_CONEXIONES = int(os.getenv("HTTP_MAX_CONEXIONES", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "5"))
+
+# HTTP/2 solo está disponible si el paquete h2 está instalado (httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_DISPONIBLE = True
+except ImportError:
+    HTTP2_DISPONIBLE = False
+
+_cliente: httpx.AsyncClient | None = None
+
+
+def crear_cliente() -> httpx.AsyncClient:
+    """
+    Crea un cliente HTTP asíncrono con los límites de pool configurados.
+    """
+    limites = httpx.Limits(
+        max_connections=HTTP_MAX_CONEXIONES,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        limits=limites,
+        timeout=HTTP_TIMEOUT,
+        http2=HTTP2_DISPONIBLE,
+    )
+
+
+def obtener_cliente() -> httpx.AsyncClient:
+    """
+    Devuelve el cliente compartido. Si aún no existe (por ejemplo, fuera del
+    lifespan de la app) lo crea bajo demanda.
+    """
+    global _cliente
+    if _cliente is None or _cliente.is_closed:
+        _cliente = crear_cliente()
+    return _cliente
+
+
+async def cerrar_cliente() -> None:
+    """
+    Cierra el cliente compartido y libera las conexiones del pool.
+    """
+    global _cliente
+    if _cliente is not None and not _cliente.is_closed:
+        await _cliente.aclose()
+    _cliente = None
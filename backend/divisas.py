@@ -0,0 +1,136 @@
+"""
+Conversión de monedas local con la tabla completa de tipos de cambio.
+
+exchangerate-api devuelve en una sola llamada las tasas de todas las monedas
+respecto al USD. La tabla se guarda entera (en caché y refrescada en segundo plano)
+como un array compacto de floats más un índice código -> posición, así que convertir
+cualquier par de monedas es una división y una multiplicación, sin llamadas a la API
+por petición. La conversión por lotes resuelve cada par distinto una sola vez.
+
+La moneda local de cada destino sale de un archivo de datos (datos/monedas.tsv) con
+la moneda por país (ISO 3166-1 alfa-2).
+"""
+import time
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+RUTA_MONEDAS = Path(__file__).parent / "datos" / "monedas.tsv"
+
+
+class MonedaDesconocida(ValueError):
+    """
+    Código de moneda que no está en la tabla de tipos de cambio.
+    """
+
+
+class TablaTipos:
+    """
+    Tasas de todas las monedas respecto a `base` (1 base = tasa unidades).
+    """
+
+    def __init__(self, base: str, tasas: dict[str, float], actualizada: float | None = None):
+        self.base = base
+        # Solo tasas positivas: una tasa 0 no permite convertir desde esa moneda
+        self.codigos = tuple(sorted(codigo for codigo, tasa in tasas.items() if tasa and tasa > 0))
+        self.indice = {codigo: i for i, codigo in enumerate(self.codigos)}
+        self.tasas = array("d", (float(tasas[codigo]) for codigo in self.codigos))
+        # Momento (epoch) de la última actualización según la API, o el de la descarga
+        self.actualizada = actualizada if actualizada is not None else time.time()
+
+    @classmethod
+    def desde_respuesta(cls, data: dict) -> "TablaTipos":
+        """
+        Tabla a partir de la respuesta de exchangerate-api (/v4/latest/USD).
+        """
+        return cls(data.get("base", "USD"), data["rates"], data.get("time_last_updated"))
+
+    def como_dict(self) -> dict:
+        """
+        Forma compacta para serializar (caché compartida): códigos en una cadena y
+        tasas en el mismo orden.
+        """
+        return {"base": self.base, "actualizada": self.actualizada,
+                "codigos": ",".join(self.codigos), "tasas": self.tasas.tolist()}
+
+    @classmethod
+    def desde_dict(cls, datos: dict) -> "TablaTipos":
+        return cls(datos["base"], dict(zip(datos["codigos"].split(","), datos["tasas"])), datos["actualizada"])
+
+    def __len__(self) -> int:
+        return len(self.codigos)
+
+    def __contains__(self, codigo: str) -> bool:
+        return codigo.upper() in self.indice
+
+    def _posicion(self, codigo: str) -> int:
+        posicion = self.indice.get(codigo.upper())
+        if posicion is None:
+            raise MonedaDesconocida(f"Moneda desconocida: {codigo}")
+        return posicion
+
+    def tasa(self, origen: str, destino: str) -> float:
+        """
+        Unidades de `destino` por cada unidad de `origen`.
+        """
+        return self.tasas[self._posicion(destino)] / self.tasas[self._posicion(origen)]
+
+    def convertir(self, cantidad: float, origen: str, destino: str) -> float:
+        return cantidad * self.tasa(origen, destino)
+
+    def convertir_lote(self, conversiones: list[tuple[float, str, str]]) -> list[float | MonedaDesconocida]:
+        """
+        Convierte muchas cantidades de una vez. Cada par (origen, destino) distinto se
+        resuelve una sola vez; los elementos con una moneda desconocida llevan el error
+        en su posición en lugar del resultado.
+        """
+        factores: dict[tuple[str, str], float | MonedaDesconocida] = {}
+        resultados: list[float | MonedaDesconocida] = []
+        for cantidad, origen, destino in conversiones:
+            par = (origen, destino)
+            factor = factores.get(par)
+            if factor is None:
+                try:
+                    factor = self.tasa(origen, destino)
+                except MonedaDesconocida as e:
+                    factor = e
+                factores[par] = factor
+            resultados.append(factor if isinstance(factor, MonedaDesconocida) else cantidad * factor)
+        return resultados
+
+
+class Moneda(NamedTuple):
+    codigo: str  # ISO 4217 (ej. "MXN")
+    nombre: str  # Nombre en español (ej. "peso mexicano")
+
+
+@lru_cache(maxsize=1)
+def monedas_por_pais() -> dict[str, Moneda]:
+    """
+    Moneda local por código de país, cargada desde el archivo de datos (una vez).
+    """
+    monedas = {}
+    with open(RUTA_MONEDAS, encoding="utf-8") as archivo:
+        for linea in archivo:
+            if linea.startswith("#") or not linea.strip():
+                continue
+            pais, codigo, nombre = linea.rstrip("\n").split("\t")
+            monedas[pais] = Moneda(codigo, nombre)
+    return monedas
+
+
+def moneda_de_pais(pais: str | None) -> Moneda | None:
+    if not pais:
+        return None
+    return monedas_por_pais().get(pais.upper())
+
+
+def redondear_importe(valor: float) -> float:
+    """
+    Redondeo para mostrar: 2 decimales en importes normales y más precisión en
+    tasas pequeñas (ej. 1 COP = 0.00025 USD).
+    """
+    if valor == 0 or abs(valor) >= 1:
+        return round(valor, 2)
+    return float(f"{valor:.4g}")
@@ -0,0 +1,120 @@
+"""
+Fotos de destinos: resultado de Unsplash recortado y variantes responsivas.
+
+Una sola búsqueda en Unsplash por destino (hasta FOTOS_POR_BUSQUEDA fotos) se guarda
+en caché recortada a los campos que usa la app; cada respuesta toma las primeras
+`cantidad`. En lugar de mandar al cliente la URL `regular` (JPEG de 1080 px) para
+todos los tamaños de pantalla, cada foto se describe con:
+- `srcset` por formato (AVIF, WebP y JPEG de respaldo) con varios anchos, armados
+  con los parámetros de redimensionado de Unsplash (w, fm, q, fit) sobre la URL
+  `raw`. El navegador elige el formato que soporta y el ancho que necesita.
+- Dimensiones originales, color dominante y BlurHash, para reservar el espacio y
+  pintar un marcador mientras carga sin otra petición.
+
+La URL `regular` se sigue devolviendo tal cual (campo `fotos` de las respuestas)
+para los clientes que no usan las variantes.
+"""
+import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Fotos pedidas a Unsplash por búsqueda (máx. 30): cuestan la misma llamada que 3
+FOTOS_POR_BUSQUEDA = max(1, min(30, int(os.getenv("FOTOS_POR_BUSQUEDA", "6"))))
+# Anchos (px) de las variantes y formatos modernos, en orden de preferencia
+FOTOS_ANCHOS = tuple(sorted(int(ancho) for ancho in os.getenv("FOTOS_ANCHOS", "400,800,1200").split(",") if ancho.strip()))
+FOTOS_FORMATOS = tuple(
+    formato.strip().lower() for formato in os.getenv("FOTOS_FORMATOS", "avif,webp").split(",") if formato.strip()
+)
+FOTOS_CALIDAD = int(os.getenv("FOTOS_CALIDAD", "75"))
+# Valor por defecto de `sizes`: a una columna en móvil, tres columnas en escritorio
+FOTOS_SIZES = os.getenv("FOTOS_SIZES", "(max-width: 768px) 100vw, 320px")
+
+TIPOS_MIME = {"avif": "image/avif", "webp": "image/webp", "jpg": "image/jpeg", "png": "image/png"}
+
+
+def recortar_foto(foto: dict) -> dict | None:
+    """
+    Campos de un resultado de /search/photos que usa la app (lo que se guarda en
+    caché). Retorna None si el resultado no trae URLs.
+    """
+    urls = foto.get("urls") or {}
+    regular = urls.get("regular")
+    if not regular:
+        return None
+    usuario = foto.get("user") or {}
+    return {
+        "id": str(foto.get("id") or ""),
+        "regular": regular,
+        "raw": urls.get("raw") or "",
+        "ancho": int(foto.get("width") or 0),
+        "alto": int(foto.get("height") or 0),
+        "color": foto.get("color"),
+        "blur_hash": foto.get("blur_hash"),
+        "descripcion": foto.get("alt_description") or foto.get("description") or "",
+        "autor": usuario.get("name") or "",
+        "autor_url": (usuario.get("links") or {}).get("html") or "",
+    }
+
+
+def recortar_resultados(data: dict) -> list[dict]:
+    return [foto for foto in map(recortar_foto, data.get("results", [])) if foto is not None]
+
+
+def url_variante(raw: str, ancho: int, formato: str, calidad: int = FOTOS_CALIDAD) -> str:
+    """
+    URL de Unsplash redimensionada a `ancho` px en `formato`. fit=max no agranda
+    fotos más chicas que el ancho pedido.
+    """
+    partes = urlsplit(raw)
+    parametros = dict(parse_qsl(partes.query))
+    parametros.update({"w": str(ancho), "fm": formato, "q": str(calidad), "fit": "max"})
+    return urlunsplit(partes._replace(query=urlencode(parametros)))
+
+
+def anchos_variantes(ancho_original: int) -> tuple[int, ...]:
+    """
+    Anchos de FOTOS_ANCHOS que no superan el original (al menos el más chico).
+    """
+    if not ancho_original:
+        return FOTOS_ANCHOS
+    return tuple(ancho for ancho in FOTOS_ANCHOS if ancho <= ancho_original) or FOTOS_ANCHOS[:1]
+
+
+def srcset(foto: dict, formato: str) -> str:
+    return ", ".join(f"{url_variante(foto['raw'], ancho, formato)} {ancho}w" for ancho in anchos_variantes(foto["ancho"]))
+
+
+def detalle_foto(foto: dict, sizes: str = FOTOS_SIZES) -> dict:
+    """
+    Descripción de una foto para el cliente (campos de FotoResponse). Sin URL `raw`
+    (resultados viejos o de otra fuente), las variantes quedan vacías y el cliente
+    usa `url`.
+    """
+    tiene_raw = bool(foto.get("raw")) and bool(FOTOS_ANCHOS)
+    return {
+        "id": foto["id"],
+        "url": foto["regular"],
+        "srcset": srcset(foto, "jpg") if tiene_raw else "",
+        "fuentes": [
+            {"tipo": TIPOS_MIME.get(formato, f"image/{formato}"), "srcset": srcset(foto, formato)}
+            for formato in FOTOS_FORMATOS
+        ] if tiene_raw else [],
+        "sizes": sizes,
+        "ancho": foto["ancho"],
+        "alto": foto["alto"],
+        "color": foto["color"],
+        "blur_hash": foto["blur_hash"],
+        "descripcion": foto["descripcion"],
+        "autor": foto["autor"],
+        "autor_url": foto["autor_url"],
+    }
+
+
+def urls_fotos(fotos: list[dict]) -> list[str]:
+    """
+    URLs `regular` (el formato original de `fotos` en las respuestas).
+    """
+    return [foto["regular"] for foto in fotos]
+
+
+def detalles_fotos(fotos: list[dict]) -> list[dict]:
+    return [detalle_foto(foto) for foto in fotos]
@@ -0,0 +1,208 @@
+"""
+Control de admisión y límites de tasa hacia las APIs externas.
+
+- TokenBucket: límite de llamadas por periodo para cada API (OpenWeatherMap,
+  Unsplash, exchangerate-api, Gemini). Si no quedan fichas no se hace la llamada:
+  es mejor degradar al momento que esperar el error o el timeout de la API.
+- ControlAdmision: como máximo N generaciones de Gemini a la vez y una cola de
+  espera acotada. Si la cola está llena, o la espera supera el máximo, se rechaza
+  de inmediato con Sobrecarga en lugar de acumular peticiones.
+
+Ambos exponen contadores (profundidad de cola, tiempos de espera, rechazos).
+"""
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+
+class Sobrecarga(Exception):
+    """
+    Petición rechazada por límite de tasa (429) o por cola llena (503).
+    `reintentar_en` son los segundos sugeridos para la cabecera Retry-After.
+    """
+
+    def __init__(self, mensaje: str, codigo: int, reintentar_en: float):
+        super().__init__(mensaje)
+        self.codigo = codigo
+        self.reintentar_en = max(1, math.ceil(reintentar_en))
+
+
+class TokenBucket:
+    """
+    Cubo de fichas: se recargan `por_periodo` fichas cada `periodo` segundos, con
+    un máximo de `rafaga` fichas acumuladas. Cada llamada consume una ficha.
+    """
+
+    def __init__(self, nombre: str, por_periodo: float, periodo: float = 60, rafaga: float | None = None):
+        self.nombre = nombre
+        self.tasa = por_periodo / periodo  # fichas por segundo
+        self.capacidad = rafaga if rafaga is not None else por_periodo
+        self._fichas = self.capacidad
+        self._actualizado = time.monotonic()
+        self.permitidas = 0
+        self.rechazadas = 0
+
+    def _recargar(self) -> None:
+        ahora = time.monotonic()
+        self._fichas = min(self.capacidad, self._fichas + (ahora - self._actualizado) * self.tasa)
+        self._actualizado = ahora
+
+    def intentar(self) -> bool:
+        """
+        Consume una ficha si hay alguna disponible. No espera.
+        """
+        self._recargar()
+        if self._fichas >= 1:
+            self._fichas -= 1
+            self.permitidas += 1
+            return True
+        self.rechazadas += 1
+        return False
+
+    def fichas_disponibles(self) -> float:
+        """
+        Fichas disponibles ahora mismo (sin consumir ninguna).
+        """
+        self._recargar()
+        return self._fichas
+
+    def segundos_para_ficha(self) -> float:
+        self._recargar()
+        if self._fichas >= 1 or self.tasa <= 0:
+            return 0.0
+        return (1 - self._fichas) / self.tasa
+
+    def tomar(self) -> None:
+        """
+        Consume una ficha o lanza Sobrecarga (429) con el tiempo hasta la siguiente.
+        """
+        if not self.intentar():
+            raise Sobrecarga(
+                f"Límite de peticiones a {self.nombre} alcanzado", 429, self.segundos_para_ficha()
+            )
+
+    def estadisticas(self) -> dict:
+        self._recargar()
+        return {
+            "fichas_disponibles": round(self._fichas, 2),
+            "capacidad": self.capacidad,
+            "por_minuto": round(self.tasa * 60, 2),
+            "permitidas": self.permitidas,
+            "rechazadas": self.rechazadas,
+        }
+
+
+class ControlAdmision:
+    """
+    Semáforo con cola de espera acotada y tiempo máximo de espera.
+    """
+
+    def __init__(self, nombre: str, concurrencia: int, max_cola: int, espera_maxima: float):
+        self.nombre = nombre
+        self.concurrencia = concurrencia
+        self.max_cola = max_cola
+        self.espera_maxima = espera_maxima
+        self._semaforo = asyncio.Semaphore(concurrencia)
+        self.en_curso = 0
+        self.en_cola = 0
+        self.admitidas = 0
+        self.rechazadas = 0
+        self.espera_total = 0.0
+        self.espera_maxima_observada = 0.0
+        # Media móvil del tiempo de servicio para estimar Retry-After
+        self.tiempo_servicio_medio = 5.0
+
+    def _reintentar_en(self) -> float:
+        return self.tiempo_servicio_medio * (self.en_cola / self.concurrencia + 1)
+
+    def verificar(self) -> None:
+        """
+        Rechaza de inmediato (503) si no hay sitio libre ni hueco en la cola.
+        """
+        if self.en_curso >= self.concurrencia and self.en_cola >= self.max_cola:
+            self.rechazadas += 1
+            raise Sobrecarga(f"{self.nombre} saturado, intenta de nuevo en unos segundos", 503, self._reintentar_en())
+
+    @asynccontextmanager
+    async def ocupar(self):
+        """
+        Espera un sitio libre (como máximo `espera_maxima` segundos) y lo ocupa
+        durante el bloque `async with`.
+        """
+        self.verificar()
+        inicio = time.monotonic()
+        self.en_cola += 1
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), self.espera_maxima)
+        except asyncio.TimeoutError:
+            self.rechazadas += 1
+            raise Sobrecarga(f"{self.nombre} saturado, intenta de nuevo en unos segundos", 503, self._reintentar_en())
+        finally:
+            self.en_cola -= 1
+
+        espera = time.monotonic() - inicio
+        self.admitidas += 1
+        self.espera_total += espera
+        self.espera_maxima_observada = max(self.espera_maxima_observada, espera)
+        self.en_curso += 1
+        inicio_servicio = time.monotonic()
+        try:
+            yield
+        finally:
+            self.en_curso -= 1
+            self._semaforo.release()
+            self.tiempo_servicio_medio = 0.8 * self.tiempo_servicio_medio + 0.2 * (time.monotonic() - inicio_servicio)
+
+    def estadisticas(self) -> dict:
+        return {
+            "concurrencia": self.concurrencia,
+            "en_curso": self.en_curso,
+            "en_cola": self.en_cola,
+            "max_cola": self.max_cola,
+            "admitidas": self.admitidas,
+            "rechazadas": self.rechazadas,
+            "espera_media_ms": round(1000 * self.espera_total / self.admitidas, 1) if self.admitidas else 0.0,
+            "espera_maxima_ms": round(1000 * self.espera_maxima_observada, 1),
+            "tiempo_servicio_medio_ms": round(1000 * self.tiempo_servicio_medio, 1),
+        }
+
+
+# Límites por API (llamadas por minuto y ráfaga), configurables por variables de entorno.
+# OpenWeatherMap (plan gratuito): 60 llamadas/minuto. Unsplash (demo): 50 llamadas/hora.
+LIMITE_OPENWEATHER = TokenBucket(
+    "OpenWeatherMap",
+    float(os.getenv("LIMITE_OPENWEATHER_POR_MINUTO", "60")),
+    rafaga=float(os.getenv("LIMITE_OPENWEATHER_RAFAGA", "10")),
+)
+LIMITE_UNSPLASH = TokenBucket(
+    "Unsplash",
+    float(os.getenv("LIMITE_UNSPLASH_POR_HORA", "50")),
+    periodo=3600,
+    rafaga=float(os.getenv("LIMITE_UNSPLASH_RAFAGA", "10")),
+)
+LIMITE_TIPO_CAMBIO = TokenBucket(
+    "exchangerate-api",
+    float(os.getenv("LIMITE_TIPO_CAMBIO_POR_MINUTO", "10")),
+)
+LIMITE_GEMINI = TokenBucket(
+    "Gemini",
+    float(os.getenv("LIMITE_GEMINI_POR_MINUTO", "15")),
+)
+LIMITES = [LIMITE_OPENWEATHER, LIMITE_UNSPLASH, LIMITE_TIPO_CAMBIO, LIMITE_GEMINI]
+
+# Generaciones de Gemini simultáneas, tamaño de la cola y espera máxima en ella (segundos)
+ADMISION_GEMINI = ControlAdmision(
+    "Gemini",
+    concurrencia=int(os.getenv("GEMINI_CONCURRENCIA", "8")),
+    max_cola=int(os.getenv("GEMINI_MAX_COLA", "32")),
+    espera_maxima=float(os.getenv("GEMINI_ESPERA_MAXIMA", "10")),
+)
+
+
+def estadisticas_limites() -> dict:
+    return {
+        "limites": {limite.nombre: limite.estadisticas() for limite in LIMITES},
+        "admision": {ADMISION_GEMINI.nombre: ADMISION_GEMINI.estadisticas()},
+    }
@@ -0,0 +1,182 @@
+"""
+Detección de destinos (ciudades y países) en el texto de una pregunta.
+
+Usa un gazetteer incluido en el proyecto (datos/lugares.tsv) con nombres en español,
+alias (nombres en inglés u otras variantes), coordenadas y zona horaria IANA. Todos los nombres se
+compilan una sola vez en un trie de palabras sin acentos y en minúsculas, así que
+la búsqueda recorre la pregunta una sola vez (tiempo lineal) sin importar cuántos
+lugares haya en el gazetteer, y solo coincide con palabras completas.
+
+Algunos nombres de una palabra también son palabras comunes ("chile", "lima",
+"pisa"): solo cuentan como lugar si van con mayúscula o después de una preposición.
+"""
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+from cache import normalizar_clave
+
+RUTA_DATOS = Path(__file__).parent / "datos" / "lugares.tsv"
+
+# Si el lugar va justo después de "desde" es el origen del viaje, no el destino
+PALABRAS_ORIGEN = ("desde",)
+
+# Nombres (normalizados) que también son palabras comunes en español o inglés: el
+# chile (ají), la lima (fruta), pisa (verbo), la india, una cuba, la granada...
+NOMBRES_AMBIGUOS = frozenset({
+    "chile", "lima", "pisa", "china", "india", "cuba", "granada", "bahia", "fez", "split", "nice", "male",
+})
+# Preposiciones tras las que un nombre ambiguo sí se toma como lugar ("viajo a lima")
+PREPOSICIONES_LUGAR = ("a", "en", "de") + PALABRAS_ORIGEN
+
+
+def palabras_normalizadas(texto: str) -> list[str]:
+    """
+    Palabras de un texto sin acentos, en minúsculas y sin signos de puntuación.
+    """
+    return re.findall(r"\w+", normalizar_clave(texto))
+
+
+class Lugar(NamedTuple):
+    nombre: str  # Nombre en español (ej. "Nueva York")
+    tipo: str  # "ciudad" o "pais"
+    pais: str  # Código ISO 3166-1 alfa-2
+    lat: float
+    lon: float
+    zona: str  # Zona horaria IANA (ej. "America/Los_Angeles")
+
+
+# Marca de fin de patrón dentro de un nodo del trie
+_FIN = ""
+
+
+class TriePalabras:
+    """
+    Trie sobre secuencias de palabras para buscar muchos nombres a la vez.
+    Como ningún nombre tiene más de unas pocas palabras, recorrer el texto desde
+    cada palabra cuesta O(longitud del texto × palabras del nombre más largo),
+    es decir, lineal en la pregunta e independiente del número de lugares.
+    """
+
+    def __init__(self, patrones: dict[tuple[str, ...], int]):
+        self._raiz: dict = {}
+        for palabras, valor in patrones.items():
+            nodo = self._raiz
+            for palabra in palabras:
+                nodo = nodo.setdefault(palabra, {})
+            nodo[_FIN] = valor
+
+    def buscar(self, palabras: list[str]) -> list[tuple[int, int, int]]:
+        """
+        Coincidencias no solapadas como (inicio, fin, valor) en índices de palabra.
+        Se recorre de izquierda a derecha y en cada posición gana el nombre más
+        largo ("nueva york" frente a "york").
+        """
+        coincidencias = []
+        raiz = self._raiz
+        inicio, total = 0, len(palabras)
+        while inicio < total:
+            nodo = raiz.get(palabras[inicio])
+            mejor = None
+            fin = inicio + 1
+            while nodo is not None:
+                if _FIN in nodo:
+                    mejor = (inicio, fin, nodo[_FIN])
+                if fin >= total:
+                    break
+                nodo = nodo.get(palabras[fin])
+                fin += 1
+            if mejor:
+                coincidencias.append(mejor)
+                inicio = mejor[1]
+            else:
+                inicio += 1
+        return coincidencias
+
+
+class Gazetteer:
+    """
+    Lugares conocidos con búsqueda por nombre exacto y por texto libre.
+    """
+
+    def __init__(self, lugares: list[Lugar], alias: list[tuple[str, int]]):
+        self.lugares = lugares
+        self._por_nombre: dict[str, int] = {}
+        patrones: dict[tuple[str, ...], int] = {}
+        for nombre, indice in alias:
+            self._por_nombre.setdefault(normalizar_clave(nombre), indice)
+            patrones.setdefault(tuple(palabras_normalizadas(nombre)), indice)
+        self._trie = TriePalabras(patrones)
+
+    @classmethod
+    def desde_archivo(cls, ruta: Path = RUTA_DATOS) -> "Gazetteer":
+        lugares, alias = [], []
+        with open(ruta, encoding="utf-8") as archivo:
+            for linea in archivo:
+                if linea.startswith("#") or not linea.strip():
+                    continue
+                nombre, otros_nombres, tipo, pais, lat, lon, zona = linea.rstrip("\n").split("\t")
+                indice = len(lugares)
+                lugares.append(Lugar(nombre, tipo, pais, float(lat), float(lon), zona))
+                alias.append((nombre, indice))
+                alias.extend((otro, indice) for otro in otros_nombres.split("|") if otro)
+        return cls(lugares, alias)
+
+    def por_nombre(self, nombre: str) -> Lugar | None:
+        indice = self._por_nombre.get(normalizar_clave(nombre))
+        return self.lugares[indice] if indice is not None else None
+
+    def buscar_en_texto(self, texto: str) -> Lugar | None:
+        """
+        Busca el destino mencionado en un texto: el primer lugar conocido que no
+        vaya precedido de "desde" (origen del viaje) o, si no hay otro, el primero.
+        Los nombres ambiguos (NOMBRES_AMBIGUOS) sin mayúscula ni preposición delante
+        no cuentan.
+        """
+        palabras = palabras_normalizadas(texto)
+        coincidencias = self._trie.buscar(palabras)
+        if any(fin - inicio == 1 and palabras[inicio] in NOMBRES_AMBIGUOS for inicio, fin, _indice in coincidencias):
+            coincidencias = _sin_ambiguos_comunes(coincidencias, palabras, texto)
+        if not coincidencias:
+            return None
+        for inicio, _fin, indice in coincidencias:
+            if inicio > 0 and palabras[inicio - 1] in PALABRAS_ORIGEN:
+                continue
+            return self.lugares[indice]
+        return self.lugares[coincidencias[0][2]]
+
+
+def _sin_ambiguos_comunes(coincidencias: list[tuple[int, int, int]], palabras: list[str], texto: str) -> list[tuple[int, int, int]]:
+    """
+    Quita las coincidencias de nombres ambiguos usados como palabra común: en
+    minúscula y sin una preposición delante ("¿dónde como chile en Oaxaca?").
+    """
+    originales = re.findall(r"\w+", texto)
+    # normalizar_clave no parte ni une palabras; si no coinciden, no se mira la mayúscula
+    alineadas = len(originales) == len(palabras)
+    resultado = []
+    for inicio, fin, indice in coincidencias:
+        if fin - inicio == 1 and palabras[inicio] in NOMBRES_AMBIGUOS:
+            mayuscula = alineadas and originales[inicio][:1].isupper()
+            preposicion = inicio > 0 and palabras[inicio - 1] in PREPOSICIONES_LUGAR
+            if not (mayuscula or preposicion):
+                continue
+        resultado.append((inicio, fin, indice))
+    return resultado
+
+
+@lru_cache(maxsize=1)
+def gazetteer() -> Gazetteer:
+    """
+    Gazetteer cargado desde el archivo de datos (solo la primera vez que se usa).
+    """
+    return Gazetteer.desde_archivo()
+
+
+def buscar_lugar_en_texto(texto: str) -> Lugar | None:
+    return gazetteer().buscar_en_texto(texto)
+
+
+def lugar_por_nombre(nombre: str) -> Lugar | None:
+    return gazetteer().por_nombre(nombre)
@@ -1,25 +1,98 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+# Primero: el tiempo de importación de la app se mide desde aquí
+from arranque import ESTADO_ARRANQUE
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import google.generativeai as genai
+import asyncio
+import json
 import os
-import requests
 import re
-from datetime import datetime
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
 from typing import Optional
 from dotenv import load_dotenv
 
 # Cargar variables de entorno desde el archivo .env
 load_dotenv()
 
-app = FastAPI(title="ViajeIA API")
+from cliente_http import HTTP_TIMEOUT, obtener_cliente, cerrar_cliente
+from modelos_gemini import SelectorModelos, sdk_gemini
+from zonas_horarias import desfase_utc_segundos, indice_zonas_horarias, zona_horaria_por_coordenadas
+from lugares import buscar_lugar_en_texto, gazetteer, lugar_por_nombre
+from cache_respuestas import CacheRespuestas, resumen_historial
+from sesiones import AlmacenSesiones, Sesion
+from fotos import FOTOS_POR_BUSQUEDA, detalles_fotos, recortar_resultados, urls_fotos
+from divisas import Moneda, MonedaDesconocida, TablaTipos, moneda_de_pais, monedas_por_pais, redondear_importe
+from plazos import (
+    PLAZO_INFO_PANEL,
+    PLAZO_INFO_PANEL_BATCH,
+    PLAZO_PLANIFICAR,
+    con_plazo,
+    datos_omitidos,
+    get_con_plazo,
+    iniciar_plazo,
+    segundos_restantes,
+)
+from refresco import REFRESCO_ACTIVO, FuenteDestino, FuentePeriodica, Refrescador
+from limites import (
+    ADMISION_GEMINI,
+    LIMITE_GEMINI,
+    LIMITE_OPENWEATHER,
+    LIMITE_TIPO_CAMBIO,
+    LIMITE_UNSPLASH,
+    Sobrecarga,
+    estadisticas_limites,
+)
+from middlewares import MiddlewareCompresion, MiddlewareCORS, MiddlewareValidacion
+from metricas import (
+    MiddlewareMetricas,
+    RutaMedida,
+    exportar_prometheus,
+    medir_etapa,
+    medir_gemini,
+    medir_upstream,
+    registrar_error_upstream,
+    registrar_prompt,
+    tiempos_peticion,
+)
+from cache import (
+    CacheTTL,
+    CACHE_CLIMA,
+    CACHE_FOTOS,
+    CACHE_TIPO_CAMBIO,
+    cancelar_descargas,
+    cerrar_cache_compartida,
+    estadisticas_caches,
+    normalizar_clave,
+)
+from cache_compartida import ALMACEN_COMPARTIDO
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Abrir el cliente HTTP compartido al iniciar y cerrarlo al apagar
+    obtener_cliente()
+    # El calentamiento corre en segundo plano: uvicorn abre el puerto sin esperarlo
+    ESTADO_ARRANQUE.iniciar(ETAPAS_CALENTAMIENTO)
+    # El refresco en segundo plano y las descargas de las cachés (incluidos los
+    # refrescos de valores obsoletos) se detienen antes de cerrar el cliente que usan
+    if REFRESCO_ACTIVO:
+        REFRESCADOR.iniciar()
+    yield
+    await ESTADO_ARRANQUE.detener()
+    await REFRESCADOR.detener()
+    await cancelar_descargas()
+    await cerrar_cache_compartida()
+    await cerrar_cliente()
 
-# Configurar Gemini con la API key
+app = FastAPI(title="ViajeIA API", lifespan=lifespan)
+# Las rutas anotan cuándo termina el endpoint para medir la serialización
+app.router.route_class = RutaMedida
+
+# API key de Gemini (el SDK se importa y configura la primera vez que se usa, ver sdk_gemini)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-else:
+if not GEMINI_API_KEY:
     print("⚠️  ADVERTENCIA: GEMINI_API_KEY no encontrada. Asegúrate de crear un archivo .env con tu API key.")
 
 # Configurar OpenWeatherMap
@@ -34,6 +107,11 @@ UNSPLASH_ACCESS_KEY = os.getenv("UNSPLASH_ACCESS_KEY")
 if not UNSPLASH_ACCESS_KEY:
     print("⚠️  ADVERTENCIA: UNSPLASH_ACCESS_KEY no encontrada. Las fotos no estarán disponibles.")
 
+# URLs base de las APIs externas (se pueden cambiar, por ejemplo, para los benchmarks)
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "http://api.openweathermap.org").rstrip("/")
+UNSPLASH_URL = os.getenv("UNSPLASH_URL", "https://api.unsplash.com").rstrip("/")
+TIPO_CAMBIO_URL = os.getenv("TIPO_CAMBIO_URL", "https://api.exchangerate-api.com").rstrip("/")
+
 # Configurar CORS para permitir peticiones desde el frontend
 # En producción, permite cualquier origen de Vercel o el especificado en la variable de entorno
 ALLOWED_ORIGINS_ENV = os.getenv("ALLOWED_ORIGINS", "")
@@ -59,51 +137,21 @@ else:
     ]
     ALLOW_ORIGIN_REGEX = None
 
-# Configurar CORS
-cors_config = {
-    "allow_credentials": True,
-    "allow_methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    "allow_headers": ["*"],
-    "expose_headers": ["*"],
-}
-
-if ALLOW_ORIGIN_REGEX:
-    cors_config["allow_origin_regex"] = ALLOW_ORIGIN_REGEX
-else:
-    cors_config["allow_origins"] = ALLOWED_ORIGINS
+# Middlewares ASGI puros (el último agregado envuelve a los demás), de dentro hacia fuera:
+# - ETag y Cache-Control en /api/info-panel y /api/fotos para que el navegador revalide con un 304
+# - Compresión gzip/brotli de las respuestas de más de COMPRESION_MINIMO bytes
+# - Métricas y cabecera Server-Timing
+# - CORS, con el preflight respondido sin pasar por el resto de la app
+INFO_PANEL_CACHE_CONTROL = os.getenv("INFO_PANEL_CACHE_CONTROL", "public, max-age=60, stale-while-revalidate=300")
+FOTOS_CACHE_CONTROL = os.getenv("FOTOS_CACHE_CONTROL", "public, max-age=3600, stale-while-revalidate=86400")
+COMPRESION_MINIMO = int(os.getenv("COMPRESION_MINIMO", "1024"))
 
 app.add_middleware(
-    CORSMiddleware,
-    **cors_config
+    MiddlewareValidacion, rutas={"/api/info-panel": INFO_PANEL_CACHE_CONTROL, "/api/fotos": FOTOS_CACHE_CONTROL}
 )
-
-# Agregar headers CORS manualmente como respaldo y manejar OPTIONS
-@app.middleware("http")
-async def add_cors_headers(request, call_next):
-    # Si es una petición OPTIONS (preflight), responder inmediatamente
-    if request.method == "OPTIONS":
-        from fastapi.responses import Response
-        origin = request.headers.get("origin")
-        headers = {
-            "Access-Control-Allow-Origin": origin if origin else "*",
-            "Access-Control-Allow-Credentials": "true",
-            "Access-Control-Allow-Methods": "GET, POST, PUT, DELETE, OPTIONS",
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Max-Age": "3600",
-        }
-        return Response(status_code=200, headers=headers)
-    
-    # Para otras peticiones, agregar headers CORS
-    response = await call_next(request)
-    # Si estamos en producción, agregar headers CORS manualmente
-    if IS_PRODUCTION:
-        origin = request.headers.get("origin")
-        if origin:
-            response.headers["Access-Control-Allow-Origin"] = origin
-            response.headers["Access-Control-Allow-Credentials"] = "true"
-            response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-            response.headers["Access-Control-Allow-Headers"] = "*"
-    return response
+app.add_middleware(MiddlewareCompresion, minimo=COMPRESION_MINIMO)
+app.add_middleware(MiddlewareMetricas)
+app.add_middleware(MiddlewareCORS, origenes=ALLOWED_ORIGINS, origen_regex=ALLOW_ORIGIN_REGEX)
 
 class InformacionViaje(BaseModel):
     destino: str = ""
@@ -118,375 +166,408 @@ class MensajeHistorial(BaseModel):
 class PreguntaRequest(BaseModel):
     pregunta: str
     informacion_viaje: InformacionViaje = InformacionViaje()
-    historial: list[MensajeHistorial] = []  # Historial de conversaciones anteriores
+    historial: list[MensajeHistorial] = []  # Historial de conversaciones anteriores (solo si no hay sesión)
+    sesion_id: Optional[str] = None  # Sesión devuelta por una respuesta anterior
+    usar_cache: bool = True  # False para forzar una respuesta nueva de Gemini
+
+class FuenteFoto(BaseModel):
+    tipo: str  # MIME del formato (ej. "image/avif"), para <source type>
+    srcset: str
+
+class FotoResponse(BaseModel):
+    id: str
+    url: str  # La misma URL que en `fotos` (JPEG de 1080 px)
+    srcset: str = ""  # Variantes JPEG por ancho, para <img srcset>
+    fuentes: list[FuenteFoto] = []  # Formatos modernos en orden de preferencia, para <picture>
+    sizes: str = ""  # Valor sugerido de `sizes`
+    ancho: int = 0  # Dimensiones originales (relación de aspecto)
+    alto: int = 0
+    color: Optional[str] = None  # Color dominante (#rrggbb), fondo mientras carga
+    blur_hash: Optional[str] = None  # Marcador difuminado (https://blurha.sh)
+    descripcion: str = ""
+    autor: str = ""
+    autor_url: str = ""
 
 class RespuestaResponse(BaseModel):
     respuesta: str
     fotos: list[str] = []  # URLs de las fotos de Unsplash
+    sesion_id: Optional[str] = None  # Enviar en la siguiente pregunta en lugar del historial
+    fotos_detalle: list[FotoResponse] = []  # Las mismas fotos con variantes responsivas y marcador
+
+class FotosResponse(BaseModel):
+    destino: str
+    fotos: list[str] = []
+    fotos_detalle: list[FotoResponse] = []
 
 class InfoPanelResponse(BaseModel):
     temperatura: Optional[float] = None
     descripcion_clima: Optional[str] = None
     tipo_cambio_usd: Optional[float] = None
     tipo_cambio_eur: Optional[float] = None
+    moneda_local: Optional[str] = None  # Código ISO 4217 de la moneda del destino
+    tipo_cambio_local: Optional[float] = None  # 1 USD en la moneda local
     diferencia_horaria: Optional[str] = None
-    hora_local: Optional[str] = None
+    # Desfase exacto respecto a UTC: el cliente calcula la hora local con su reloj
+    # (una hora HH:MM en el cuerpo cambiaría el ETag cada minuto y quedaría vieja en caché)
+    desfase_utc_minutos: Optional[int] = None
     ciudad: Optional[str] = None
 
-def obtener_info_clima_detallada(ciudad: str) -> dict:
+class InfoPanelBatchRequest(BaseModel):
+    ciudades: list[str]
+
+class InfoPanelBatchItem(BaseModel):
+    indice: int
+    ciudad: str
+    info: Optional[InfoPanelResponse] = None
+    error: Optional[str] = None
+
+class InfoPanelBatchResponse(BaseModel):
+    resultados: list[InfoPanelBatchItem]  # En el mismo orden que las ciudades pedidas
+
+class PlanificarBatchRequest(BaseModel):
+    preguntas: list[PreguntaRequest]
+
+class PlanificarBatchItem(BaseModel):
+    indice: int
+    pregunta: str
+    respuesta: Optional[RespuestaResponse] = None
+    error: Optional[str] = None
+
+class PlanificarBatchResponse(BaseModel):
+    resultados: list[PlanificarBatchItem]  # En el mismo orden que las preguntas pedidas
+
+class ConversionRequest(BaseModel):
+    cantidad: float
+    de: str  # Código ISO 4217 (ej. "USD")
+    a: str
+
+class ConversionResponse(ConversionRequest):
+    resultado: float
+    tasa: float  # Unidades de `a` por cada unidad de `de`
+    actualizado: str  # Fecha (UTC) de los tipos de cambio usados
+
+class ConversionBatchRequest(BaseModel):
+    conversiones: list[ConversionRequest]
+
+class ConversionBatchItem(ConversionRequest):
+    indice: int
+    resultado: Optional[float] = None
+    error: Optional[str] = None
+
+class ConversionBatchResponse(BaseModel):
+    actualizado: str
+    resultados: list[ConversionBatchItem]  # En el mismo orden que las conversiones pedidas
+
+async def obtener_clima_owm(ciudad: str) -> dict:
     """
-    Obtiene información detallada del clima de una ciudad.
-    Retorna un diccionario con temperatura y descripción.
+    Hace una única llamada a OpenWeatherMap para una ciudad.
+    Retorna el JSON crudo de la API (clima, coordenadas y zona horaria) o un
+    diccionario vacío si no está disponible. El resto de funciones de clima y
+    zona horaria reutilizan esta respuesta para no repetir la llamada.
+    Las respuestas se guardan en caché (~10 min) por nombre de ciudad normalizado.
+    """
+    return await CACHE_CLIMA.obtener_o_calcular(
+        normalizar_clave(ciudad), lambda: _descargar_clima_owm(ciudad)
+    )
+
+async def _descargar_clima_owm(ciudad: str) -> dict:
+    """
+    Descarga el clima de OpenWeatherMap sin pasar por la caché.
     """
     if not OPENWEATHER_API_KEY:
         return {}
+    if not LIMITE_OPENWEATHER.intentar():
+        print("⏳ Límite de llamadas a OpenWeatherMap alcanzado, se omite el clima")
+        registrar_error_upstream("openweathermap", "limite")
+        return {}
     
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather"
+        # URL de la API de OpenWeatherMap
+        url = f"{OPENWEATHER_URL}/data/2.5/weather"
         params = {
             "q": ciudad,
             "appid": OPENWEATHER_API_KEY,
-            "units": "metric",
-            "lang": "es"
+            "units": "metric",  # Para obtener temperatura en Celsius
+            "lang": "es"  # Para obtener descripciones en español
         }
         
-        response = requests.get(url, params=params, timeout=5)
+        # Si el lugar está en el gazetteer, consultar por coordenadas y saltar la geocodificación
+        lugar = lugar_por_nombre(ciudad)
+        if lugar:
+            del params["q"]
+            params["lat"] = lugar.lat
+            params["lon"] = lugar.lon
+        
+        with medir_upstream("openweathermap"):
+            response = await get_con_plazo(url, "openweathermap", LIMITE_OPENWEATHER, params=params)
         
         if response.status_code == 200:
             data = response.json()
-            return {
-                "temperatura": round(data["main"]["temp"], 1),
-                "descripcion": data["weather"][0]["description"].capitalize(),
-                "ciudad": data["name"],
-                "pais": data["sys"]["country"]
-            }
+            if lugar:
+                # Por coordenadas, OpenWeatherMap devuelve el nombre de la estación más cercana
+                data["name"] = lugar.nombre
+            return data
+        registrar_error_upstream("openweathermap", f"http_{response.status_code}")
         return {}
     except Exception as e:
-        print(f"Error al obtener clima detallado: {e}")
+        print(f"Error al obtener clima de OpenWeatherMap: {e}")
         return {}
 
-def obtener_info_clima_detallada(ciudad: str) -> dict:
+async def obtener_info_clima_detallada(ciudad: str, datos_clima: dict | None = None) -> dict:
     """
     Obtiene información detallada del clima de una ciudad.
     Retorna un diccionario con temperatura y descripción.
+    Si se pasa `datos_clima` (respuesta de obtener_clima_owm) no se llama a la API.
     """
-    if not OPENWEATHER_API_KEY:
+    if datos_clima is None:
+        datos_clima = await obtener_clima_owm(ciudad)
+    if not datos_clima:
         return {}
     
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather"
-        params = {
-            "q": ciudad,
-            "appid": OPENWEATHER_API_KEY,
-            "units": "metric",
-            "lang": "es"
+        data = datos_clima
+        return {
+            "temperatura": round(data["main"]["temp"], 1),
+            "descripcion": data["weather"][0]["description"].capitalize(),
+            "ciudad": data["name"],
+            "pais": data["sys"]["country"]
         }
-        
-        response = requests.get(url, params=params, timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            return {
-                "temperatura": round(data["main"]["temp"], 1),
-                "descripcion": data["weather"][0]["description"].capitalize(),
-                "ciudad": data["name"],
-                "pais": data["sys"]["country"]
-            }
-        return {}
     except Exception as e:
         print(f"Error al obtener clima detallado: {e}")
         return {}
 
-def obtener_clima_ciudad(ciudad: str) -> str:
+async def obtener_clima_ciudad(ciudad: str, datos_clima: dict | None = None) -> str:
     """
     Obtiene el clima actual de una ciudad usando OpenWeatherMap API.
     Retorna una cadena con la información del clima o un mensaje de error.
     """
-    if not OPENWEATHER_API_KEY:
+    if datos_clima is None:
+        datos_clima = await obtener_clima_owm(ciudad)
+    if not datos_clima:
         return None
     
     try:
-        # URL de la API de OpenWeatherMap
-        url = f"http://api.openweathermap.org/data/2.5/weather"
-        params = {
-            "q": ciudad,
-            "appid": OPENWEATHER_API_KEY,
-            "units": "metric",  # Para obtener temperatura en Celsius
-            "lang": "es"  # Para obtener descripciones en español
-        }
+        data = datos_clima
         
-        response = requests.get(url, params=params, timeout=5)
+        # Extraer información relevante
+        temperatura = data["main"]["temp"]
+        sensacion_termica = data["main"]["feels_like"]
+        descripcion = data["weather"][0]["description"].capitalize()
+        humedad = data["main"]["humidity"]
+        viento = data["wind"]["speed"] * 3.6  # Convertir m/s a km/h
+        nombre_ciudad = data["name"]
+        pais = data["sys"]["country"]
         
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Extraer información relevante
-            temperatura = data["main"]["temp"]
-            sensacion_termica = data["main"]["feels_like"]
-            descripcion = data["weather"][0]["description"].capitalize()
-            humedad = data["main"]["humidity"]
-            viento = data["wind"]["speed"] * 3.6  # Convertir m/s a km/h
-            nombre_ciudad = data["name"]
-            pais = data["sys"]["country"]
-            
-            # Formatear la información del clima
-            info_clima = f"""🌤️ CLIMA ACTUAL EN {nombre_ciudad.upper()}, {pais}:
+        # Formatear la información del clima
+        info_clima = f"""🌤️ CLIMA ACTUAL EN {nombre_ciudad.upper()}, {pais}:
 • Temperatura: {temperatura:.1f}°C
 • Sensación térmica: {sensacion_termica:.1f}°C
 • Condiciones: {descripcion}
 • Humedad: {humedad}%
 • Viento: {viento:.1f} km/h"""
-            
-            return info_clima
-        else:
-            return None
+        
+        return info_clima
     
     except Exception as e:
         print(f"Error al obtener clima: {e}")
         return None
 
-def obtener_tipo_cambio() -> dict:
+async def obtener_tabla_tipos() -> TablaTipos | None:
     """
-    Obtiene el tipo de cambio actual (USD y EUR) usando exchangerate-api.com
-    Retorna un diccionario con las tasas de cambio.
+    Obtiene la tabla completa de tipos de cambio (todas las monedas respecto al USD)
+    usando exchangerate-api.com, o None si no está disponible.
+    La tabla se guarda en caché (~1 h) y el refresco en segundo plano la mantiene al día.
     """
+    return await CACHE_TIPO_CAMBIO.obtener_o_calcular("USD", _descargar_tipo_cambio)
+
+async def _descargar_tipo_cambio() -> TablaTipos | None:
+    """
+    Descarga las tasas de cambio sin pasar por la caché.
+    """
+    if not LIMITE_TIPO_CAMBIO.intentar():
+        print("⏳ Límite de llamadas a exchangerate-api alcanzado, se omite el tipo de cambio")
+        registrar_error_upstream("exchangerate", "limite")
+        return None
+    
     try:
         # API gratuita sin necesidad de API key para uso básico
-        url = "https://api.exchangerate-api.com/v4/latest/USD"
-        response = requests.get(url, timeout=5)
+        url = f"{TIPO_CAMBIO_URL}/v4/latest/USD"
+        with medir_upstream("exchangerate"):
+            response = await get_con_plazo(url, "exchangerate", LIMITE_TIPO_CAMBIO)
         
         if response.status_code == 200:
-            data = response.json()
-            # Obtener tasas para EUR y MXN (peso mexicano) como ejemplo
-            eur_rate = data["rates"].get("EUR", 0)
-            mxn_rate = data["rates"].get("MXN", 0)
-            
-            return {
-                "usd_to_eur": round(1 / eur_rate, 4) if eur_rate else None,
-                "usd_to_mxn": round(mxn_rate, 2) if mxn_rate else None,
-                "eur_to_usd": round(eur_rate, 4) if eur_rate else None
-            }
-        return {}
+            # Se guarda la tabla entera: cualquier par de monedas se convierte sin otra llamada
+            return TablaTipos.desde_respuesta(response.json())
+        registrar_error_upstream("exchangerate", f"http_{response.status_code}")
+        return None
     except Exception as e:
         print(f"Error al obtener tipo de cambio: {e}")
-        return {}
+        return None
+
+def _formatear_diferencia(offset_seconds: int, timezone_id: str = "") -> dict:
+    """
+    Construye el diccionario de zona horaria a partir del desfase UTC en segundos.
+    """
+    offset_horas = offset_seconds / 3600
+    return {
+        "desfase_minutos": offset_seconds // 60,
+        "offset_horas": offset_horas,
+        "diferencia": f"{offset_horas:+.0f}h" if offset_horas != 0 else "0h",
+        "timezone": timezone_id
+    }
+
+def diferencia_horaria_lugar(ciudad: str) -> dict:
+    """
+    Diferencia horaria de un lugar del gazetteer, calculada con su zona IANA sin
+    llamar a ninguna API. Retorna {} si el lugar no está en el gazetteer.
+    """
+    lugar = lugar_por_nombre(ciudad)
+    if lugar:
+        offset_seconds = desfase_utc_segundos(lugar.zona)
+        if offset_seconds is not None:
+            return _formatear_diferencia(offset_seconds, lugar.zona)
+    return {}
 
-def obtener_diferencia_horaria(ciudad: str) -> dict:
+async def obtener_diferencia_horaria(ciudad: str, datos_clima: dict | None = None) -> dict:
     """
-    Obtiene la diferencia horaria y hora local de una ciudad usando worldtimeapi.org
+    Obtiene la diferencia horaria y el desfase UTC de una ciudad.
+    Los lugares del gazetteer traen su zona IANA y el desfase se calcula con zoneinfo.
+    Para el resto se usa el desfase exacto que trae OpenWeatherMap; la zona del
+    punto de referencia más cercano solo aporta el nombre si su desfase coincide
+    (o el desfase, si OpenWeatherMap no lo trae).
     Retorna un diccionario con la información de zona horaria.
     """
     try:
-        # Primero necesitamos obtener las coordenadas de la ciudad para la zona horaria
-        if not OPENWEATHER_API_KEY:
-            return {}
-        
-        # Obtener coordenadas de OpenWeatherMap
-        url_weather = f"http://api.openweathermap.org/data/2.5/weather"
-        params = {
-            "q": ciudad,
-            "appid": OPENWEATHER_API_KEY,
-            "units": "metric"
-        }
+        # Si el lugar está en el gazetteer ya tenemos su zona horaria
+        tz_lugar = diferencia_horaria_lugar(ciudad)
+        if tz_lugar:
+            return tz_lugar
         
-        response = requests.get(url_weather, params=params, timeout=5)
-        if response.status_code != 200:
+        # Reutilizar la respuesta de OpenWeatherMap si ya la tenemos
+        if datos_clima is None:
+            datos_clima = await obtener_clima_owm(ciudad)
+        if not datos_clima:
             return {}
+        offset_owm = datos_clima.get("timezone")
         
-        data = response.json()
-        lat = data["coord"]["lat"]
-        lon = data["coord"]["lon"]
-        
-        # Obtener zona horaria usando timeapi.io (gratis y sin API key)
-        try:
-            # Usar timeapi.io que es más simple y no requiere API key
-            url_tz = f"https://timeapi.io/api/TimeZone/coordinate?latitude={lat}&longitude={lon}"
-            tz_response = requests.get(url_tz, timeout=5)
-            
-            if tz_response.status_code == 200:
-                tz_data = tz_response.json()
-                timezone_id = tz_data.get("timeZone", "")
-                
-                # Obtener hora actual en esa zona horaria
-                url_current = f"https://timeapi.io/api/Time/current/zone?timeZone={timezone_id}"
-                current_response = requests.get(url_current, timeout=5)
-                
-                if current_response.status_code == 200:
-                    current_data = current_response.json()
-                    hora_local = current_data.get("time", "")
-                    offset_seconds = current_data.get("offset", 0)
-                    offset_horas = offset_seconds / 3600
-                    
-                    # Calcular diferencia con hora local del usuario (UTC)
-                    hora_usuario_utc = datetime.utcnow()
-                    
-                    return {
-                        "hora_local": hora_local.split("T")[1].split(".")[0] if "T" in hora_local else hora_local,
-                        "offset_horas": offset_horas,
-                        "diferencia": f"{offset_horas:+.0f}h" if offset_horas != 0 else "0h",
-                        "timezone": timezone_id
-                    }
-        except Exception as e:
-            print(f"Error al obtener zona horaria: {e}")
-            # Fallback: usar worldtimeapi.org
-            try:
-                # Buscar zona horaria por nombre de ciudad (aproximado)
-                url_wt = f"http://worldtimeapi.org/api/timezone"
-                wt_response = requests.get(url_wt, timeout=5)
-                if wt_response.status_code == 200:
-                    # Esta es una aproximación simple
-                    return {
-                        "diferencia": "N/A",
-                        "hora_local": ""
-                    }
-            except:
-                pass
+        # El vecino más cercano falla cerca de los límites entre zonas (ej. Seattle
+        # quedaba en America/Boise): no se usa si contradice a OpenWeatherMap
+        coordenadas = datos_clima.get("coord") or {}
+        timezone_id, offset_zona = None, None
+        if "lat" in coordenadas and "lon" in coordenadas:
+            timezone_id = zona_horaria_por_coordenadas(
+                coordenadas["lat"], coordenadas["lon"], datos_clima.get("sys", {}).get("country")
+            )
+            offset_zona = desfase_utc_segundos(timezone_id) if timezone_id else None
         
+        if offset_owm is not None:
+            return _formatear_diferencia(offset_owm, timezone_id if offset_zona == offset_owm else "")
+        if offset_zona is not None:
+            return _formatear_diferencia(offset_zona, timezone_id)
         return {}
     except Exception as e:
         print(f"Error al obtener diferencia horaria: {e}")
         return {}
 
-def obtener_fotos_destino(ciudad: str, cantidad: int = 3) -> list[str]:
+async def obtener_fotos_destino(ciudad: str, cantidad: int = 3) -> list[dict]:
     """
     Obtiene fotos de una ciudad usando Unsplash API.
-    Retorna una lista de URLs de fotos.
+    Retorna las primeras `cantidad` fotos recortadas (ver fotos.recortar_foto).
+    La búsqueda (FOTOS_POR_BUSQUEDA fotos) se guarda en caché (~1 día) por ciudad
+    normalizada, sin importar cuántas se pidan.
+    """
+    fotos = await CACHE_FOTOS.obtener_o_calcular(normalizar_clave(ciudad), lambda: _descargar_fotos_destino(ciudad))
+    return fotos[:cantidad]
+
+async def _descargar_fotos_destino(ciudad: str) -> list[dict]:
+    """
+    Descarga fotos de Unsplash sin pasar por la caché.
     """
     if not UNSPLASH_ACCESS_KEY:
         return []
+    if not LIMITE_UNSPLASH.intentar():
+        print("⏳ Límite de llamadas a Unsplash alcanzado, se omiten las fotos")
+        registrar_error_upstream("unsplash", "limite")
+        return []
     
     try:
         # URL de la API de Unsplash
-        url = "https://api.unsplash.com/search/photos"
+        url = f"{UNSPLASH_URL}/search/photos"
         headers = {
             "Authorization": f"Client-ID {UNSPLASH_ACCESS_KEY}"
         }
         params = {
             "query": ciudad,
-            "per_page": cantidad,
+            "per_page": FOTOS_POR_BUSQUEDA,
             "orientation": "landscape",  # Fotos horizontales se ven mejor
             "order_by": "popular"  # Las más populares primero
         }
         
-        response = requests.get(url, headers=headers, params=params, timeout=5)
+        with medir_upstream("unsplash"):
+            # Sin petición duplicada: el límite de Unsplash (50/hora) no da para ello
+            response = await get_con_plazo(url, "unsplash", headers=headers, params=params)
         
         if response.status_code == 200:
-            data = response.json()
-            fotos = []
-            
-            for photo in data.get("results", [])[:cantidad]:
-                # Usar la URL regular (no raw) para mejor calidad
-                foto_url = photo["urls"]["regular"]
-                fotos.append(foto_url)
-            
-            return fotos
+            # Solo los campos que usa la app: URLs, dimensiones, color, BlurHash y autor
+            return recortar_resultados(response.json())[:FOTOS_POR_BUSQUEDA]
         else:
             print(f"Error Unsplash API: {response.status_code}")
+            registrar_error_upstream("unsplash", f"http_{response.status_code}")
             return []
     
     except Exception as e:
         print(f"Error al obtener fotos de Unsplash: {e}")
         return []
 
+# Mantiene calientes el clima y las fotos de los destinos más pedidos y el tipo de cambio
+REFRESCADOR = Refrescador(
+    fuentes_destino=[
+        FuenteDestino("clima", CACHE_CLIMA, normalizar_clave, _descargar_clima_owm, LIMITE_OPENWEATHER),
+        FuenteDestino("fotos", CACHE_FOTOS, normalizar_clave, _descargar_fotos_destino, LIMITE_UNSPLASH),
+    ],
+    fuentes_periodicas=[
+        FuentePeriodica(
+            "tipo_cambio", CACHE_TIPO_CAMBIO, "USD", _descargar_tipo_cambio, LIMITE_TIPO_CAMBIO,
+            intervalo=float(os.getenv("REFRESCO_INTERVALO_TIPO_CAMBIO", "3000")),
+        ),
+    ],
+)
+
+# Respaldo para destinos que no están en el gazetteer: un nombre propio (con
+# mayúscula) después de "en", "a", "para", etc. Se compila una sola vez.
+PATRON_DESTINO = re.compile(
+    r'\b(?i:en|a|de|para|hacia|desde)\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)?)'
+)
+PALABRAS_NO_DESTINO = {'viaje', 'viajar', 'viajero', 'destino', 'lugar', 'ciudad', 'país'}
+
 def extraer_destino_de_pregunta(pregunta: str, info_viaje: InformacionViaje | None = None) -> str | None:
     """
     Intenta extraer el nombre de una ciudad/destino de la pregunta o información del viaje.
+    Primero busca lugares conocidos del gazetteer (sin importar acentos ni mayúsculas)
+    y, si no encuentra ninguno, un nombre propio después de una preposición.
     """
-    # Primero verificar si hay un destino en la información del viaje
-    if info_viaje and info_viaje.destino:
-        return info_viaje.destino.strip()
+    with medir_etapa("destino"):
+        # Primero verificar si hay un destino en la información del viaje
+        if info_viaje and info_viaje.destino:
+            return info_viaje.destino.strip()
     
-    # Buscar patrones comunes en la pregunta
-    # Buscar frases como "en París", "a Tokio", "de Madrid", etc.
-    patrones = [
-        r'(?:en|a|de|para|hacia|desde)\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)?)',
-        r'([A-ZÁÉÍÓÚÑ][a-záéíóúñ]+(?:\s+[A-ZÁÉÍÓÚÑ][a-záéíóúñ]+)?)\s+(?:es|tiene|tiene|ofrece)',
-    ]
+        # Buscar ciudades y países conocidos en la pregunta
+        lugar = buscar_lugar_en_texto(pregunta)
+        if lugar:
+            return lugar.nombre
     
-    for patron in patrones:
-        match = re.search(patron, pregunta, re.IGNORECASE)
-        if match:
+        # Buscar frases como "en Cholula", "a Tulcán", etc.
+        for match in PATRON_DESTINO.finditer(pregunta):
             posible_destino = match.group(1).strip()
-            # Filtrar palabras comunes que no son ciudades
-            palabras_comunes = ['viaje', 'viajar', 'viajero', 'destino', 'lugar', 'ciudad', 'país', 'país']
-            if posible_destino.lower() not in palabras_comunes:
+            if posible_destino.lower() not in PALABRAS_NO_DESTINO:
                 return posible_destino
     
-    return None
+        return None
 
-def generar_respuesta_viaje(pregunta: str, info_viaje: InformacionViaje | None = None, historial: list[MensajeHistorial] = None) -> tuple[str, list[str]]:
-    """
-    Genera una respuesta usando Gemini AI.
-    """
-    if not GEMINI_API_KEY:
-        return ("❌ Error: La API key de Gemini no está configurada. Por favor, crea un archivo .env en la carpeta backend con tu GEMINI_API_KEY.", [])
-    
-    # Lista de modelos a intentar (en orden de preferencia)
-    # Primero intentamos con los modelos más recientes disponibles
-    modelos_a_intentar = [
-        'gemini-2.5-flash',                    # Modelo más reciente y rápido
-        'gemini-2.5-flash-preview-05-20',      # Preview más reciente
-        'gemini-2.5-pro-preview-03-25',       # Modelo pro más reciente
-        'gemini-2.5-flash-lite-preview-06-17', # Versión lite
-        'gemini-1.5-flash',                    # Versión anterior estable
-        'gemini-1.5-pro',                      # Versión anterior pro
-        'gemini-pro',                          # Versión legacy
-    ]
-    
-    for nombre_modelo in modelos_a_intentar:
-        try:
-            # Crear el modelo de Gemini
-            model = genai.GenerativeModel(nombre_modelo)
-            
-            # Intentar obtener el clima y fotos del destino
-            info_clima = None
-            fotos_destino = []
-            destino = extraer_destino_de_pregunta(pregunta, info_viaje)
-            if destino:
-                info_clima = obtener_clima_ciudad(destino)
-                fotos_destino = obtener_fotos_destino(destino, cantidad=3)
-            
-            # Construir contexto de información del viaje
-            contexto_viaje = ""
-            if info_viaje and (info_viaje.destino or info_viaje.fecha or info_viaje.presupuesto or info_viaje.preferencia):
-                contexto_viaje = "\n\n📋 INFORMACIÓN DEL VIAJE DEL USUARIO:\n"
-                if info_viaje.destino:
-                    contexto_viaje += f"- Destino: {info_viaje.destino}\n"
-                if info_viaje.fecha:
-                    contexto_viaje += f"- Fecha: {info_viaje.fecha}\n"
-                if info_viaje.presupuesto:
-                    presupuesto_texto = {
-                        'economico': 'Económico (menos de $500)',
-                        'medio': 'Medio ($500 - $1,500)',
-                        'alto': 'Alto ($1,500 - $3,000)',
-                        'premium': 'Premium (más de $3,000)'
-                    }.get(info_viaje.presupuesto, info_viaje.presupuesto)
-                    contexto_viaje += f"- Presupuesto: {presupuesto_texto}\n"
-                if info_viaje.preferencia:
-                    preferencia_texto = {
-                        'aventura': 'Aventura 🏔️',
-                        'relajacion': 'Relajación 🏖️',
-                        'cultura': 'Cultura 🏛️'
-                    }.get(info_viaje.preferencia, info_viaje.preferencia)
-                    contexto_viaje += f"- Preferencia: {preferencia_texto}\n"
-                contexto_viaje += "\nUsa esta información para personalizar tus respuestas y recomendaciones."
-            
-            # Agregar información del clima al contexto si está disponible
-            if info_clima:
-                contexto_viaje += f"\n\n{info_clima}\n\nIncluye esta información del clima actual al inicio de tu respuesta, justo después del saludo y antes de la sección ALOJAMIENTO."
-            
-            # Agregar historial de conversación al contexto
-            contexto_historial = ""
-            if historial and len(historial) > 0:
-                contexto_historial = "\n\n💬 HISTORIAL DE CONVERSACIÓN ANTERIOR:\n"
-                for i, msg in enumerate(historial[-5:], 1):  # Solo últimas 5 conversaciones
-                    contexto_historial += f"\nConversación {i}:\n"
-                    contexto_historial += f"Usuario: {msg.pregunta}\n"
-                    contexto_historial += f"Alex: {msg.respuesta[:200]}...\n"  # Resumen de la respuesta
-                contexto_historial += "\nIMPORTANTE: Si el usuario pregunta sobre 'allí', 'ese lugar', 'ese destino', o hace referencias similares, se refiere al último destino mencionado en el historial. Usa el contexto del historial para dar respuestas coherentes y continuar la conversación de manera natural."
-            
-            # Crear el prompt con la personalidad de Alex
-            prompt = f"""Eres Alex, el consultor personal de viajes de ViajeIA. Tu personalidad es:
+# Instrucciones fijas de Alex (personalidad y formato). Se construyen una sola vez y
+# se pasan como system_instruction al crear cada modelo, así el prompt de cada
+# petición solo lleva las partes dinámicas.
+INSTRUCCIONES_SISTEMA = """Eres Alex, el consultor personal de viajes de ViajeIA. Tu personalidad es:
 
 🎯 IDENTIDAD:
 - Te presentas siempre como "Alex, tu consultor personal de viajes"
@@ -515,31 +596,329 @@ IMPORTANTE:
 - Puedes terminar con una pregunta amigable después de la estructura
 - Mantén un tono conversacional y cercano
 
-Pregunta del usuario: {pregunta}{contexto_viaje}{contexto_historial}
-
-Responde como Alex, SIEMPRE usando la estructura obligatoria con las 5 secciones (ALOJAMIENTO, COMIDA LOCAL, LUGARES IMPERDIBLES, CONSEJOS LOCALES, ESTIMACIÓN DE COSTOS), siendo entusiasta, organizado con bullets, incluyendo emojis de viajes, y personalizando según la información del viaje disponible. Si hay historial de conversación, úsalo para dar continuidad y contexto a tu respuesta:"""
-            
-            # Generar la respuesta
-            response = model.generate_content(prompt)
-            
-            return response.text, fotos_destino
-            
-        except Exception as e:
-            # Si este modelo falla, intentar el siguiente
-            error_msg = str(e)
-            if "404" in error_msg or "not found" in error_msg.lower():
-                # Este modelo no está disponible, intentar el siguiente
-                continue
-            else:
-                # Otro tipo de error, devolver el mensaje
-                return (f"❌ Error al comunicarse con Gemini: {error_msg}\n\nPor favor, verifica tu API key e intenta de nuevo.", [])
+Responde como Alex, SIEMPRE usando la estructura obligatoria con las 5 secciones (ALOJAMIENTO, COMIDA LOCAL, LUGARES IMPERDIBLES, CONSEJOS LOCALES, ESTIMACIÓN DE COSTOS), siendo entusiasta, organizado con bullets, incluyendo emojis de viajes, y personalizando según la información del viaje disponible. Si hay historial de conversación, úsalo para dar continuidad y contexto a tu respuesta."""
+
+# Presupuesto de tokens del prompt (instrucciones de sistema + partes dinámicas)
+PROMPT_PRESUPUESTO_TOKENS = int(os.getenv("PROMPT_PRESUPUESTO_TOKENS", "2000"))
+# Turnos de historial como máximo y caracteres de cada respuesta anterior
+PROMPT_MAX_TURNOS_HISTORIAL = int(os.getenv("PROMPT_MAX_TURNOS_HISTORIAL", "5"))
+PROMPT_LARGO_RESPUESTA_HISTORIAL = int(os.getenv("PROMPT_LARGO_RESPUESTA_HISTORIAL", "200"))
+
+def estimar_tokens(texto: str) -> int:
+    """
+    Estimación rápida de tokens (~4 caracteres por token), sin llamar a la API.
+    """
+    return (len(texto) + 3) // 4
+
+TOKENS_INSTRUCCIONES_SISTEMA = estimar_tokens(INSTRUCCIONES_SISTEMA)
+
+def _contexto_viaje(info_viaje: InformacionViaje | None) -> str:
+    """
+    Sección con la información del viaje del formulario.
+    """
+    contexto_viaje = ""
+    if info_viaje and (info_viaje.destino or info_viaje.fecha or info_viaje.presupuesto or info_viaje.preferencia):
+        contexto_viaje = "\n\n📋 INFORMACIÓN DEL VIAJE DEL USUARIO:\n"
+        if info_viaje.destino:
+            contexto_viaje += f"- Destino: {info_viaje.destino}\n"
+        if info_viaje.fecha:
+            contexto_viaje += f"- Fecha: {info_viaje.fecha}\n"
+        if info_viaje.presupuesto:
+            presupuesto_texto = {
+                'economico': 'Económico (menos de $500)',
+                'medio': 'Medio ($500 - $1,500)',
+                'alto': 'Alto ($1,500 - $3,000)',
+                'premium': 'Premium (más de $3,000)'
+            }.get(info_viaje.presupuesto, info_viaje.presupuesto)
+            contexto_viaje += f"- Presupuesto: {presupuesto_texto}\n"
+        if info_viaje.preferencia:
+            preferencia_texto = {
+                'aventura': 'Aventura 🏔️',
+                'relajacion': 'Relajación 🏖️',
+                'cultura': 'Cultura 🏛️'
+            }.get(info_viaje.preferencia, info_viaje.preferencia)
+            contexto_viaje += f"- Preferencia: {preferencia_texto}\n"
+        contexto_viaje += "\nUsa esta información para personalizar tus respuestas y recomendaciones."
+    return contexto_viaje
+
+def _contexto_historial(turnos: list[MensajeHistorial], turnos_resumidos: int, resumen: str | None = None) -> str:
+    """
+    Sección del historial. El `resumen` compacto de la sesión va primero; de los
+    turnos, los `turnos_resumidos` más antiguos solo llevan la pregunta del usuario
+    y el resto, también el inicio de la respuesta de Alex.
+    """
+    if not turnos and not resumen:
+        return ""
+    contexto_historial = "\n\n💬 HISTORIAL DE CONVERSACIÓN ANTERIOR:\n"
+    if resumen:
+        contexto_historial += f"\nTemas anteriores de la conversación:\n{resumen}\n"
+    for i, msg in enumerate(turnos, 1):
+        contexto_historial += f"\nConversación {i}:\n"
+        contexto_historial += f"Usuario: {msg.pregunta}\n"
+        if i > turnos_resumidos:
+            contexto_historial += f"Alex: {msg.respuesta[:PROMPT_LARGO_RESPUESTA_HISTORIAL]}...\n"  # Resumen de la respuesta
+    contexto_historial += "\nIMPORTANTE: Si el usuario pregunta sobre 'allí', 'ese lugar', 'ese destino', o hace referencias similares, se refiere al último destino mencionado en el historial. Usa el contexto del historial para dar respuestas coherentes y continuar la conversación de manera natural."
+    return contexto_historial
+
+def construir_prompt(pregunta: str, info_viaje: InformacionViaje | None = None, historial: list[MensajeHistorial] = None, info_clima: str | None = None, resumen: str | None = None, info_moneda: str | None = None) -> tuple[str, dict]:
+    """
+    Construye la parte dinámica del prompt (pregunta, información del viaje, clima,
+    tipo de cambio e historial); la personalidad de Alex va en INSTRUCCIONES_SISTEMA.
+    `resumen` es el resumen compacto de los turnos antiguos de la sesión e
+    `info_moneda` el tipo de cambio a la moneda local del destino (es corto y no se recorta).
+    Si el total estimado supera PROMPT_PRESUPUESTO_TOKENS se recorta por prioridad:
+    1. Se resumen los turnos de historial más antiguos (solo la pregunta)
+    2. Se eliminan los turnos más antiguos
+    3. Se quita el resumen de la sesión
+    4. Se quita el bloque del clima
+    Retorna (prompt, tamaño) con los tokens estimados y lo que se incluyó o recortó
+    (los llamadores lo registran con registrar_prompt).
+    """
+    contexto_viaje = _contexto_viaje(info_viaje)
+    if info_moneda:
+        contexto_viaje += f"\n\n{info_moneda}"
+    turnos = list((historial or [])[-PROMPT_MAX_TURNOS_HISTORIAL:])
+    turnos_disponibles = len(turnos)
+    turnos_resumidos = 0
+    incluir_clima = bool(info_clima)
+    incluir_resumen = bool(resumen)
+    
+    while True:
+        contexto = contexto_viaje
+        # Agregar información del clima al contexto si está disponible
+        if incluir_clima:
+            contexto += f"\n\n{info_clima}\n\nIncluye esta información del clima actual al inicio de tu respuesta, justo después del saludo y antes de la sección ALOJAMIENTO."
+        prompt = f"Pregunta del usuario: {pregunta}{contexto}{_contexto_historial(turnos, turnos_resumidos, resumen if incluir_resumen else None)}\n\nResponde como Alex:"
+        
+        tokens = TOKENS_INSTRUCCIONES_SISTEMA + estimar_tokens(prompt)
+        if tokens <= PROMPT_PRESUPUESTO_TOKENS:
+            break
+        if turnos_resumidos < len(turnos):
+            turnos_resumidos += 1
+        elif turnos:
+            turnos.pop(0)
+            turnos_resumidos -= 1
+        elif incluir_resumen:
+            incluir_resumen = False
+        elif incluir_clima:
+            incluir_clima = False
+        else:
+            # Solo quedan la pregunta y la información del viaje: no se recortan
+            break
+    
+    tamano = {
+        "tokens_estimados": tokens,
+        "tokens_sistema": TOKENS_INSTRUCCIONES_SISTEMA,
+        "tokens_dinamicos": tokens - TOKENS_INSTRUCCIONES_SISTEMA,
+        "turnos_historial": len(turnos),
+        "turnos_resumidos": turnos_resumidos,
+        "turnos_eliminados": turnos_disponibles - len(turnos),
+        "resumen_incluido": incluir_resumen,
+        "resumen_recortado": bool(resumen) and not incluir_resumen,
+        "clima_incluido": incluir_clima,
+        "clima_recortado": bool(info_clima) and not incluir_clima,
+    }
+    return prompt, tamano
+
+# Caché de respuestas de Gemini (por defecto solo para preguntas sin historial)
+CACHE_RESPUESTAS_ACTIVA = os.getenv("CACHE_RESPUESTAS_ACTIVA", "true").lower() == "true"
+CACHE_RESPUESTAS_CON_HISTORIAL = os.getenv("CACHE_RESPUESTAS_CON_HISTORIAL", "false").lower() == "true"
+CACHE_RESPUESTAS = CacheRespuestas(
+    ttl=float(os.getenv("CACHE_TTL_RESPUESTAS", "21600")),
+    max_entradas=int(os.getenv("CACHE_MAX_RESPUESTAS", "500")),
+    # 0 desactiva la búsqueda de preguntas similares
+    umbral_similitud=float(os.getenv("CACHE_RESPUESTAS_UMBRAL_SIMILITUD", "0.8")),
+    compartida=ALMACEN_COMPARTIDO,
+)
+
+def _perfil_respuesta(pregunta: str, info_viaje: InformacionViaje | None, historial: list[MensajeHistorial] | None, resumen: str = "") -> tuple | None:
+    """
+    Perfil del viaje que, junto con la pregunta, forma la clave de la caché de respuestas.
+    Retorna None si la petición no debe usar la caché.
+    """
+    if not CACHE_RESPUESTAS_ACTIVA:
+        return None
+    if (historial or resumen) and not CACHE_RESPUESTAS_CON_HISTORIAL:
+        return None
     
-    # Si todos los modelos fallaron
+    info_viaje = info_viaje or InformacionViaje()
+    destino = extraer_destino_de_pregunta(pregunta, info_viaje) or ""
+    return (
+        normalizar_clave(destino),
+        normalizar_clave(info_viaje.fecha),
+        info_viaje.presupuesto,
+        info_viaje.preferencia,
+        resumen_historial(([("", resumen)] if resumen else []) + [(msg.pregunta, msg.respuesta) for msg in historial or []]),
+    )
+
+def _respuesta_cacheable(resultado: tuple[str, list]) -> bool:
+    # Los mensajes de error empiezan con ❌ y no se guardan
+    return not resultado[0].startswith("❌")
+
+def _respuesta_completa(resultado: tuple[str, list]) -> bool:
+    # Las respuestas sin clima o sin fotos por agotar el plazo no se guardan en caché
+    return _respuesta_cacheable(resultado) and not datos_omitidos()
+
+# Sesiones de conversación: turnos recientes y resumen compacto guardados en el servidor
+SESIONES = AlmacenSesiones()
+
+# Las sesiones son de cada proceso: tras un reinicio, en otro worker, por inactividad
+# o por desalojo el `sesion_id` deja de existir y el cliente debe reenviar su historial
+MENSAJE_SESION_NO_ENCONTRADA = "Sesión no encontrada: reenvía la pregunta sin sesion_id y con el historial de la conversación"
+
+def _resolver_sesion(request: PreguntaRequest) -> Sesion:
+    """
+    Sesión de la petición. Si no se envía `sesion_id` se prepara una nueva a partir
+    del `historial` de la petición (se guarda al registrar su primer turno).
+    Si el `sesion_id` no existe y la petición no trae historial, responde 409: seguir
+    con una sesión vacía perdería el contexto de la conversación sin avisar.
+    """
+    sesion = SESIONES.obtener(request.sesion_id) if request.sesion_id else None
+    if sesion is None:
+        if request.sesion_id and not request.historial:
+            raise HTTPException(status_code=409, detail=MENSAJE_SESION_NO_ENCONTRADA)
+        sesion = SESIONES.crear((msg.pregunta, msg.respuesta) for msg in request.historial)
+    return sesion
+
+def _historial_sesion(sesion: Sesion) -> list[MensajeHistorial]:
+    return [MensajeHistorial(pregunta=pregunta, respuesta=respuesta) for pregunta, respuesta in sesion.turnos]
+
+# Tiempo máximo (segundos) que la generación espera al clima antes de empezar sin él
+TIMEOUT_CLIMA_PROMPT = float(os.getenv("TIMEOUT_CLIMA_PROMPT", "2"))
+
+# Si la respuesta en curso lleva el bloque de clima actual. Se anota al preparar el
+# prompt y se lee al guardar la respuesta en caché (en el mismo contexto, como datos_omitidos)
+_CLIMA_EN_RESPUESTA: ContextVar[bool] = ContextVar("clima_en_respuesta", default=False)
+
+async def _clima_para_prompt(destino: str | None) -> str | None:
+    """
+    Obtiene el bloque de clima para el prompt sin esperar más de TIMEOUT_CLIMA_PROMPT
+    (ni más de lo que quede del plazo de la petición).
+    Si OpenWeatherMap tarda más, se genera la respuesta sin el clima.
+    """
+    info_clima = await _esperar_clima_para_prompt(destino)
+    _CLIMA_EN_RESPUESTA.set(bool(info_clima))
+    return info_clima
+
+def _ttl_respuesta(_resultado: tuple[str, list]) -> float | None:
+    """
+    TTL de una respuesta en caché: Gemini incluye el clima actual del prompt en la
+    respuesta, así que esas respuestas no duran más que el clima en CACHE_CLIMA.
+    None usa el TTL de la caché de respuestas.
+    """
+    return min(CACHE_RESPUESTAS.ttl, CACHE_CLIMA.ttl) if _CLIMA_EN_RESPUESTA.get() else None
+
+async def _esperar_clima_para_prompt(destino: str | None) -> str | None:
+    if not destino:
+        return None
+    restante = segundos_restantes()
+    if restante is not None and restante < TIMEOUT_CLIMA_PROMPT:
+        return await con_plazo(obtener_clima_ciudad(destino), None, "clima")
+    try:
+        return await asyncio.wait_for(obtener_clima_ciudad(destino), TIMEOUT_CLIMA_PROMPT)
+    except asyncio.TimeoutError:
+        registrar_error_upstream("openweathermap", "timeout_prompt")
+        return None
+
+def _moneda_destino(destino: str | None) -> Moneda | None:
+    """
+    Moneda local de un destino del gazetteer (None si no se conoce o es el USD).
+    """
+    lugar = lugar_por_nombre(destino) if destino else None
+    moneda = moneda_de_pais(lugar.pais) if lugar else None
+    return moneda if moneda and moneda.codigo != "USD" else None
+
+def _contexto_moneda(destino: str | None) -> str | None:
+    """
+    Tipo de cambio a la moneda local del destino para la ESTIMACIÓN DE COSTOS.
+    Solo usa la tabla que ya está en caché (la mantiene el refresco en segundo
+    plano): nunca llama a la API durante la generación.
+    """
+    moneda = _moneda_destino(destino)
+    if moneda is None:
+        return None
+    encontrada, tabla = CACHE_TIPO_CAMBIO.consultar("USD")
+    if not encontrada or moneda.codigo not in tabla:
+        return None
+    tasa = redondear_importe(tabla.tasa("USD", moneda.codigo))
+    return (f"💱 Tipo de cambio actual: 1 USD = {tasa} {moneda.codigo} ({moneda.nombre}). "
+            f"En la ESTIMACIÓN DE COSTOS da cada importe en USD y en {moneda.nombre} ({moneda.codigo}).")
+
+# Lista de modelos a intentar (en orden de preferencia)
+# Primero intentamos con los modelos más recientes disponibles
+MODELOS_A_INTENTAR = [
+    'gemini-2.5-flash',                    # Modelo más reciente y rápido
+    'gemini-2.5-flash-preview-05-20',      # Preview más reciente
+    'gemini-2.5-pro-preview-03-25',       # Modelo pro más reciente
+    'gemini-2.5-flash-lite-preview-06-17', # Versión lite
+    'gemini-1.5-flash',                    # Versión anterior estable
+    'gemini-1.5-pro',                      # Versión anterior pro
+    'gemini-pro',                          # Versión legacy
+]
+
+# Objetos de modelo reutilizados, modelo resuelto y circuit breaker por modelo
+SELECTOR_MODELOS = SelectorModelos(
+    MODELOS_A_INTENTAR,
+    lambda nombre: crear_modelo_gemini(nombre),
+    lambda nombre: comprobar_modelo_gemini(nombre),
+)
+
+# La lista de modelos disponibles solo se usa para el mensaje de error: se guarda en caché
+CACHE_LISTA_MODELOS = CacheTTL("lista_modelos", 600, 1)
+
+# Modelos legacy que no aceptan system_instruction: las instrucciones van en el prompt
+MODELOS_SIN_INSTRUCCION_SISTEMA = {'gemini-pro'}
+
+def crear_modelo_gemini(nombre_modelo: str):
+    """
+    Crea un modelo de Gemini con las instrucciones de Alex como system_instruction.
+    """
+    if nombre_modelo in MODELOS_SIN_INSTRUCCION_SISTEMA:
+        return sdk_gemini().GenerativeModel(nombre_modelo)
+    return sdk_gemini().GenerativeModel(nombre_modelo, system_instruction=INSTRUCCIONES_SISTEMA)
+
+async def comprobar_modelo_gemini(nombre_modelo: str) -> bool:
+    """
+    Indica si el modelo existe consultando sus metadatos (no genera nada ni gasta
+    cuota de generación). get_model es síncrono: se ejecuta en un hilo.
+    """
+    try:
+        await asyncio.to_thread(lambda: sdk_gemini().get_model(f"models/{nombre_modelo}"))
+    except Exception as e:
+        if _es_modelo_no_disponible(e):
+            return False
+        raise
+    return True
+
+def _prompt_para_modelo(nombre_modelo: str, prompt: str) -> str:
+    if nombre_modelo in MODELOS_SIN_INSTRUCCION_SISTEMA:
+        return f"{INSTRUCCIONES_SISTEMA}\n\n{prompt}"
+    return prompt
+
+MENSAJE_SIN_API_KEY = "❌ Error: La API key de Gemini no está configurada. Por favor, crea un archivo .env en la carpeta backend con tu GEMINI_API_KEY."
+
+def _es_modelo_no_disponible(error: Exception) -> bool:
+    """
+    Indica si el error de Gemini significa que el modelo no existe (404).
+    """
+    error_msg = str(error)
+    return "404" in error_msg or "not found" in error_msg.lower()
+
+def _mensaje_error_gemini(error: Exception) -> str:
+    return f"❌ Error al comunicarse con Gemini: {error}\n\nPor favor, verifica tu API key e intenta de nuevo."
+
+async def _mensaje_sin_modelos() -> str:
+    """
+    Mensaje de error cuando ningún modelo de la lista está disponible.
+    """
     try:
         # Intentar listar modelos disponibles para ayudar al usuario
-        modelos_disponibles = [m.name for m in genai.list_models()]
+        # list_models es síncrono: ejecutarlo en un hilo para no bloquear el event loop
+        modelos_disponibles = await CACHE_LISTA_MODELOS.obtener_o_calcular(
+            "modelos", lambda: asyncio.to_thread(lambda: [m.name for m in sdk_gemini().list_models()])
+        )
         modelos_texto = "\n".join([f"  - {m}" for m in modelos_disponibles[:5]])
-        return (f"""❌ No se pudo encontrar un modelo compatible de Gemini.
+        return f"""❌ No se pudo encontrar un modelo compatible de Gemini.
 
 Modelos disponibles detectados:
 {modelos_texto}
@@ -547,53 +926,596 @@ Modelos disponibles detectados:
 Por favor, verifica:
 1. Que tu API key sea válida
 2. Que tengas acceso a los modelos de Gemini
-3. Intenta usar uno de los modelos listados arriba""", [])
+3. Intenta usar uno de los modelos listados arriba"""
     except:
-        return ("❌ Error: No se pudo conectar con Gemini. Por favor, verifica tu API key y que tengas acceso a los modelos de Gemini.", [])
+        return "❌ Error: No se pudo conectar con Gemini. Por favor, verifica tu API key y que tengas acceso a los modelos de Gemini."
+
+def _admitir_generacion() -> None:
+    """
+    Admisión rápida de una generación de Gemini: lanza Sobrecarga (503 si la cola
+    está llena, 429 si se agotó el límite de tasa) antes de pedir clima y fotos.
+    """
+    ADMISION_GEMINI.verificar()
+    LIMITE_GEMINI.tomar()
+
+async def generar_respuesta_viaje(pregunta: str, info_viaje: InformacionViaje | None = None, historial: list[MensajeHistorial] = None, resumen: str | None = None) -> tuple[str, list[dict]]:
+    """
+    Genera una respuesta usando Gemini AI.
+    """
+    if not GEMINI_API_KEY:
+        return (MENSAJE_SIN_API_KEY, [])
+    _admitir_generacion()
+    
+    # Pipeline: el clima y las fotos se piden en paralelo (una sola vez, fuera del
+    # bucle de modelos). La generación empieza en cuanto el clima está listo y las
+    # fotos, que no hacen falta para el prompt, terminan mientras Gemini responde.
+    destino = extraer_destino_de_pregunta(pregunta, info_viaje)
+    REFRESCADOR.populares.registrar(destino)
+    tarea_fotos = asyncio.ensure_future(obtener_fotos_destino(destino, cantidad=3)) if destino else None
+    
+    try:
+        info_clima = await _clima_para_prompt(destino)
+        with medir_etapa("prompt"):
+            prompt, tamano = construir_prompt(pregunta, info_viaje, historial, info_clima, resumen, _contexto_moneda(destino))
+        registrar_prompt(tamano)
+        
+        # Como máximo GEMINI_CONCURRENCIA generaciones a la vez; el resto espera en cola
+        async with ADMISION_GEMINI.ocupar():
+            for nombre_modelo in SELECTOR_MODELOS.candidatos():
+                try:
+                    # Reutilizar el objeto de modelo de Gemini
+                    model = SELECTOR_MODELOS.modelo(nombre_modelo)
+                
+                    # Generar la respuesta
+                    with medir_gemini(nombre_modelo):
+                        response = await model.generate_content_async(_prompt_para_modelo(nombre_modelo, prompt))
+                        texto = response.text
+                
+                    SELECTOR_MODELOS.registrar_exito(nombre_modelo)
+                    fotos_destino = await con_plazo(tarea_fotos, [], "fotos") if tarea_fotos else []
+                    return texto, fotos_destino
+                
+                except Exception as e:
+                    # Si este modelo falla, abrir su circuito (si corresponde) e intentar el siguiente
+                    SELECTOR_MODELOS.registrar_fallo(nombre_modelo, _es_modelo_no_disponible(e))
+                    if _es_modelo_no_disponible(e):
+                        # Este modelo no está disponible, intentar el siguiente
+                        continue
+                    else:
+                        # Otro tipo de error, devolver el mensaje
+                        return (_mensaje_error_gemini(e), [])
+        
+        # Si todos los modelos fallaron
+        return (await _mensaje_sin_modelos(), [])
+    finally:
+        if tarea_fotos is not None and not tarea_fotos.done():
+            tarea_fotos.cancel()
+
+async def generar_respuesta_viaje_stream(pregunta: str, info_viaje: InformacionViaje | None = None, historial: list[MensajeHistorial] = None, resumen: str | None = None):
+    """
+    Versión en streaming de generar_respuesta_viaje.
+    Produce tuplas (evento, datos) en este orden:
+    - "clima": bloque del clima del destino, en cuanto está listo
+    - "fotos": fotos recortadas de Unsplash, en cuanto están listas (durante la generación o al final)
+    - "texto": fragmentos de la respuesta de Gemini según se van generando
+    - "error": mensaje de error, si algo falla
+    - "fin": la respuesta terminó
+    La admisión rápida (_admitir_generacion) la hace el endpoint antes de empezar
+    el streaming, para poder responder 429/503 con Retry-After.
+    """
+    if not GEMINI_API_KEY:
+        yield "error", {"mensaje": MENSAJE_SIN_API_KEY}
+        yield "fin", {}
+        return
+    
+    # Las fotos no hacen falta para el prompt: se piden en paralelo
+    destino = extraer_destino_de_pregunta(pregunta, info_viaje)
+    REFRESCADOR.populares.registrar(destino)
+    tarea_fotos = asyncio.ensure_future(obtener_fotos_destino(destino, cantidad=3)) if destino else None
+    fotos_enviadas = tarea_fotos is None
+    
+    try:
+        info_clima = await _clima_para_prompt(destino)
+        yield "clima", {"clima": info_clima}
+        
+        with medir_etapa("prompt"):
+            prompt, tamano = construir_prompt(pregunta, info_viaje, historial, info_clima, resumen, _contexto_moneda(destino))
+        registrar_prompt(tamano)
+        
+        try:
+            async with ADMISION_GEMINI.ocupar():
+                for nombre_modelo in SELECTOR_MODELOS.candidatos():
+                    texto_enviado = False
+                    try:
+                        model = SELECTOR_MODELOS.modelo(nombre_modelo)
+                        with medir_gemini(nombre_modelo):
+                            response = await model.generate_content_async(_prompt_para_modelo(nombre_modelo, prompt), stream=True)
+                            async for chunk in response:
+                                if not fotos_enviadas and tarea_fotos.done():
+                                    fotos_enviadas = True
+                                    yield "fotos", {"fotos": tarea_fotos.result()}
+                                texto = _texto_de_fragmento(chunk)
+                                if texto:
+                                    texto_enviado = True
+                                    yield "texto", {"texto": texto}
+                        SELECTOR_MODELOS.registrar_exito(nombre_modelo)
+                        break
+                    except Exception as e:
+                        SELECTOR_MODELOS.registrar_fallo(nombre_modelo, _es_modelo_no_disponible(e))
+                        # Un 404 antes del primer fragmento: probar el siguiente modelo
+                        if not texto_enviado and _es_modelo_no_disponible(e):
+                            continue
+                        yield "error", {"mensaje": _mensaje_error_gemini(e)}
+                        break
+                else:
+                    yield "error", {"mensaje": await _mensaje_sin_modelos()}
+        except Sobrecarga as e:
+            yield "error", {"mensaje": f"❌ {e}", "reintentar_en": e.reintentar_en}
+        
+        if not fotos_enviadas:
+            fotos_enviadas = True
+            yield "fotos", {"fotos": await con_plazo(tarea_fotos, [], "fotos")}
+        yield "fin", {}
+    finally:
+        # Si el cliente se desconecta, no dejar la tarea de fotos colgando
+        if tarea_fotos is not None and not tarea_fotos.done():
+            tarea_fotos.cancel()
+
+def _texto_de_fragmento(chunk) -> str:
+    """
+    Texto de un fragmento del streaming de Gemini. Los fragmentos sin partes de
+    texto (por ejemplo, el de cierre) lanzan ValueError al leer `.text`.
+    """
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def _evento_sse(evento: str, datos: dict) -> str:
+    """
+    Formatea un evento para Server-Sent Events.
+    """
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+# Endpoints por lotes: elementos como máximo por petición y elementos procesados a la vez
+BATCH_MAX_ELEMENTOS = int(os.getenv("BATCH_MAX_ELEMENTOS", "10"))
+BATCH_CONCURRENCIA = int(os.getenv("BATCH_CONCURRENCIA", "4"))
+
+def _validar_lote(elementos: list) -> None:
+    if not elementos:
+        raise HTTPException(status_code=400, detail="El lote está vacío")
+    if len(elementos) > BATCH_MAX_ELEMENTOS:
+        raise HTTPException(status_code=400, detail=f"El lote admite como máximo {BATCH_MAX_ELEMENTOS} elementos")
+
+async def _procesar_lote(elementos: list, procesar):
+    """
+    Procesa los elementos de un lote con `procesar(elemento)`, como máximo
+    BATCH_CONCURRENCIA a la vez. Produce (indice, resultado, error) según va
+    terminando cada elemento; el error de un elemento no afecta a los demás.
+    """
+    semaforo = asyncio.Semaphore(BATCH_CONCURRENCIA)
+    
+    async def procesar_uno(indice: int, elemento) -> tuple[int, object, str | None]:
+        async with semaforo:
+            try:
+                return indice, await procesar(elemento), None
+            except Exception as e:
+                print(f"Error en el elemento {indice} del lote: {e}")
+                return indice, None, str(e)
+    
+    tareas = [asyncio.ensure_future(procesar_uno(i, elemento)) for i, elemento in enumerate(elementos)]
+    try:
+        for siguiente in asyncio.as_completed(tareas):
+            yield await siguiente
+    finally:
+        # Si el cliente se desconecta a mitad del streaming, no dejar tareas colgando
+        for tarea in tareas:
+            if not tarea.done():
+                tarea.cancel()
+
+async def _respuesta_lote(items, modelo_respuesta, stream: bool):
+    """
+    Respuesta de un endpoint por lotes: todos los resultados en orden o, con
+    `stream`, una línea JSON (NDJSON) por elemento según va terminando.
+    """
+    if stream:
+        async def lineas():
+            async for item in items:
+                yield item.model_dump_json() + "\n"
+        return StreamingResponse(lineas(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+    
+    resultados = [item async for item in items]
+    return modelo_respuesta(resultados=sorted(resultados, key=lambda item: item.indice))
+
+@app.exception_handler(Sobrecarga)
+async def manejar_sobrecarga(request, exc: Sobrecarga):
+    """
+    Respuesta rápida cuando se supera un límite: 429 o 503 con Retry-After.
+    """
+    return JSONResponse(
+        status_code=exc.codigo,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.reintentar_en)},
+    )
 
 @app.get("/")
 def read_root():
     return {"message": "ViajeIA API está funcionando correctamente"}
 
 @app.post("/api/planificar", response_model=RespuestaResponse)
-def planificar_viaje(request: PreguntaRequest):
+async def planificar_viaje(request: PreguntaRequest):
     """
     Endpoint para recibir preguntas sobre viajes y generar respuestas.
+    El historial se toma de la sesión (`sesion_id`); la respuesta devuelve el
+    `sesion_id` a usar en la siguiente pregunta. Si la sesión ya no existe responde
+    409 y el cliente reenvía la pregunta con su historial.
     """
-    respuesta, fotos = generar_respuesta_viaje(request.pregunta, request.informacion_viaje, request.historial)
-    return RespuestaResponse(respuesta=respuesta, fotos=fotos)
+    return await _planificar(request)
+
+async def _planificar(request: PreguntaRequest, guardar_sesion: bool = True) -> RespuestaResponse:
+    # Cada pregunta (también cada elemento de un lote) tiene su propio plazo
+    iniciar_plazo(PLAZO_PLANIFICAR)
+    sesion = _resolver_sesion(request)
+    historial, resumen = _historial_sesion(sesion), sesion.resumen
+    perfil = _perfil_respuesta(request.pregunta, request.informacion_viaje, historial, resumen) if request.usar_cache else None
+    if perfil is None:
+        respuesta, fotos = await generar_respuesta_viaje(request.pregunta, request.informacion_viaje, historial, resumen)
+    else:
+        respuesta, fotos = await CACHE_RESPUESTAS.obtener_o_generar(
+            request.pregunta,
+            perfil,
+            lambda: generar_respuesta_viaje(request.pregunta, request.informacion_viaje, historial, resumen),
+            cachear_si=_respuesta_completa,
+            ttl_de=_ttl_respuesta,
+        )
+    # Sin `guardar_sesion` (elementos de un lote) solo se continúan las sesiones existentes
+    if _respuesta_cacheable((respuesta, fotos)) and (guardar_sesion or sesion.guardada):
+        SESIONES.registrar_turno(sesion, request.pregunta, respuesta)
+    return RespuestaResponse(
+        respuesta=respuesta, fotos=urls_fotos(fotos), fotos_detalle=detalles_fotos(fotos),
+        sesion_id=sesion.id if sesion.guardada else None,
+    )
+
+@app.post("/api/planificar/stream")
+async def planificar_viaje_stream(request: PreguntaRequest):
+    """
+    Igual que /api/planificar pero la respuesta llega como Server-Sent Events:
+    primero la sesión, el clima y las fotos, luego el texto de Gemini fragmento a
+    fragmento y al final un evento "fin". El `sesion_id` del primer evento solo sirve
+    para la siguiente pregunta si la respuesta termina sin error.
+    """
+    iniciar_plazo(PLAZO_PLANIFICAR)
+    sesion = _resolver_sesion(request)
+    historial, resumen = _historial_sesion(sesion), sesion.resumen
+    perfil = _perfil_respuesta(request.pregunta, request.informacion_viaje, historial, resumen) if request.usar_cache else None
+    encontrado, valor = CACHE_RESPUESTAS.buscar(request.pregunta, perfil) if perfil is not None else (False, None)
+    if not encontrado and perfil is not None:
+        # Quizá otro proceso ya la generó
+        encontrado, valor = await CACHE_RESPUESTAS.buscar_compartida(request.pregunta, perfil)
+    if not encontrado and GEMINI_API_KEY:
+        # Rechazar antes de abrir el stream si Gemini está saturado
+        _admitir_generacion()
+    
+    async def eventos():
+        yield _evento_sse("sesion", {"sesion_id": sesion.id})
+        if encontrado:
+            respuesta, fotos = valor
+            SESIONES.registrar_turno(sesion, request.pregunta, respuesta)
+            yield _evento_sse("fotos", _datos_fotos(fotos))
+            yield _evento_sse("texto", {"texto": respuesta})
+            yield _evento_sse("fin", {"cache": True})
+            return
+        
+        # Acumular la respuesta para guardarla en caché y en la sesión si termina sin errores
+        fragmentos, fotos, hubo_error = [], [], False
+        async for evento, datos in generar_respuesta_viaje_stream(request.pregunta, request.informacion_viaje, historial, resumen):
+            if evento == "texto":
+                fragmentos.append(datos["texto"])
+            elif evento == "fotos":
+                fotos = datos["fotos"]
+                datos = _datos_fotos(fotos)
+            elif evento == "error":
+                hubo_error = True
+            elif evento == "fin":
+                if fragmentos and not hubo_error:
+                    respuesta = "".join(fragmentos)
+                    SESIONES.registrar_turno(sesion, request.pregunta, respuesta)
+                    if perfil is not None and not datos_omitidos():
+                        CACHE_RESPUESTAS.guardar(request.pregunta, perfil, (respuesta, fotos), _ttl_respuesta((respuesta, fotos)))
+                # La cabecera Server-Timing sale antes de generar: el desglose completo va aquí
+                datos = {**datos, "server_timing": tiempos_peticion()}
+            yield _evento_sse(evento, datos)
+    
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def _datos_fotos(fotos: list[dict]) -> dict:
+    """
+    Evento "fotos" del stream: las URLs de siempre y el detalle con las variantes.
+    """
+    return {"fotos": urls_fotos(fotos), "fotos_detalle": detalles_fotos(fotos)}
+
+@app.get("/api/fotos", response_model=FotosResponse)
+async def obtener_fotos(destino: str, response: Response, cantidad: int = 3):
+    """
+    Fotos de un destino, en el mismo formato que las de /api/planificar. El frontend
+    la llama en cuanto conoce el destino (al enviar la encuesta) para que las fotos
+    ya estén en caché y el navegador las vaya descargando antes de la primera pregunta.
+    """
+    destino = destino.strip()
+    if not destino:
+        raise HTTPException(status_code=400, detail="Falta el destino")
+    if not 1 <= cantidad <= FOTOS_POR_BUSQUEDA:
+        raise HTTPException(status_code=400, detail=f"cantidad debe estar entre 1 y {FOTOS_POR_BUSQUEDA}")
+    iniciar_plazo(PLAZO_INFO_PANEL)
+    REFRESCADOR.populares.registrar(destino)
+    fotos = await con_plazo(obtener_fotos_destino(destino, cantidad), [], "fotos")
+    if not fotos or datos_omitidos():
+        # Sin fotos (plazo agotado, límite de Unsplash, error o sin API key): que ni el
+        # navegador ni la CDN guarden la lista vacía
+        response.headers["Cache-Control"] = "no-store"
+    return FotosResponse(destino=destino, fotos=urls_fotos(fotos), fotos_detalle=detalles_fotos(fotos))
 
 @app.get("/api/health")
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/api/ready")
+def disponibilidad():
+    """
+    Disponibilidad (readiness): 503 mientras dura el calentamiento del arranque y
+    200 cuando termina. /api/health sigue respondiendo 200 en cuanto el proceso está
+    vivo. Incluye los tiempos de arranque y el resultado de cada etapa.
+    """
+    estado = ESTADO_ARRANQUE.estado()
+    estado["modelo_gemini"] = SELECTOR_MODELOS.resuelto
+    return JSONResponse(estado, status_code=200 if estado["listo"] else 503)
+
+@app.get("/api/cache")
+def estado_cache():
+    """
+    Endpoint con los contadores de aciertos/fallos de las cachés de APIs externas.
+    """
+    estadisticas = estadisticas_caches()
+    estadisticas["respuestas"] = CACHE_RESPUESTAS.estadisticas()
+    estadisticas["sesiones"] = SESIONES.estadisticas()
+    estadisticas["refresco"] = REFRESCADOR.estadisticas()
+    return estadisticas
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metricas_prometheus():
+    """
+    Latencias por etapa, API externa y modelo de Gemini, y contadores de errores,
+    en formato Prometheus.
+    """
+    return PlainTextResponse(exportar_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/limites")
+def estado_limites():
+    """
+    Endpoint con el estado de los límites de tasa por API y de la cola de Gemini
+    (profundidad, tiempos de espera y rechazos).
+    """
+    return estadisticas_limites()
+
 @app.get("/api/info-panel", response_model=InfoPanelResponse)
-def obtener_info_panel(ciudad: Optional[str] = None):
+async def obtener_info_panel(response: Response, ciudad: Optional[str] = None):
     """
     Endpoint para obtener información del panel lateral:
     - Temperatura actual
-    - Tipo de cambio (USD/EUR)
+    - Tipo de cambio (USD/EUR y USD/moneda local del destino)
     - Diferencia horaria
+    Si un dato no llega dentro del plazo (PLAZO_INFO_PANEL), su campo queda en null
+    y la respuesta lleva Cache-Control: no-store.
+    """
+    iniciar_plazo(PLAZO_INFO_PANEL)
+    # El tipo de cambio no depende de la ciudad: se consulta en paralelo
+    tabla_a_tiempo = con_plazo(obtener_tabla_tipos(), None, "tipo_cambio")
+    if ciudad:
+        tabla, (clima_info, tz_info) = await asyncio.gather(
+            tabla_a_tiempo, _info_ciudad(ciudad)
+        )
+    else:
+        tabla, clima_info, tz_info = await tabla_a_tiempo, {}, {}
+    info = _armar_info_panel(tabla, clima_info, tz_info, ciudad)
+    if _info_panel_incompleto(info, ciudad):
+        # Panel parcial (plazo agotado, límite de tasa o error de la API): que ni el
+        # navegador ni la CDN lo guarden ni lo revaliden con un 304
+        response.headers["Cache-Control"] = "no-store"
+    return info
+
+def _info_panel_incompleto(info: InfoPanelResponse, ciudad: str | None) -> bool:
+    if datos_omitidos() or info.tipo_cambio_usd is None:
+        return True
+    return bool(ciudad) and (info.temperatura is None or info.diferencia_horaria is None)
+
+async def _info_ciudad(ciudad: str) -> tuple[dict, dict]:
+    """
+    Clima y zona horaria de una ciudad con una sola llamada a OpenWeatherMap.
+    Solo esa llamada se limita al plazo: la zona horaria de un lugar del gazetteer
+    se calcula sin la API y llega aunque el clima no llegue a tiempo.
+    """
+    REFRESCADOR.populares.registrar(ciudad)
+    tz_info = diferencia_horaria_lugar(ciudad)
+    datos_clima = await con_plazo(obtener_clima_owm(ciudad), {}, "clima")
+    clima_info = await obtener_info_clima_detallada(ciudad, datos_clima)
+    if not tz_info and datos_clima:
+        tz_info = await obtener_diferencia_horaria(ciudad, datos_clima)
+    return clima_info, tz_info
+
+def _pais_destino(ciudad: str | None, clima_info: dict) -> str | None:
+    """
+    País del destino: el del gazetteer o, si no está en él, el que devuelve OpenWeatherMap.
     """
+    lugar = lugar_por_nombre(ciudad) if ciudad else None
+    return lugar.pais if lugar else clima_info.get("pais")
+
+def _armar_info_panel(tabla: TablaTipos | None, clima_info: dict, tz_info: dict, ciudad: str | None = None) -> InfoPanelResponse:
     resultado = {}
+    if tabla and "EUR" in tabla:
+        eur_rate = tabla.tasa("USD", "EUR")
+        resultado["tipo_cambio_usd"] = round(1 / eur_rate, 4)
+        resultado["tipo_cambio_eur"] = round(eur_rate, 4)
+        
+        moneda = moneda_de_pais(_pais_destino(ciudad, clima_info))
+        if moneda and moneda.codigo in tabla:
+            resultado["moneda_local"] = moneda.codigo
+            resultado["tipo_cambio_local"] = redondear_importe(tabla.tasa("USD", moneda.codigo))
     
-    # Obtener tipo de cambio (no depende de la ciudad)
-    tipo_cambio = obtener_tipo_cambio()
-    resultado["tipo_cambio_usd"] = tipo_cambio.get("usd_to_eur")
-    resultado["tipo_cambio_eur"] = tipo_cambio.get("eur_to_usd")
+    if clima_info:
+        resultado["temperatura"] = clima_info.get("temperatura")
+        resultado["descripcion_clima"] = clima_info.get("descripcion")
+        resultado["ciudad"] = clima_info.get("ciudad")
     
-    # Si hay una ciudad, obtener clima y diferencia horaria
-    if ciudad:
-        clima_info = obtener_info_clima_detallada(ciudad)
-        if clima_info:
-            resultado["temperatura"] = clima_info.get("temperatura")
-            resultado["descripcion_clima"] = clima_info.get("descripcion")
-            resultado["ciudad"] = clima_info.get("ciudad")
-        
-        tz_info = obtener_diferencia_horaria(ciudad)
-        if tz_info:
-            resultado["diferencia_horaria"] = tz_info.get("diferencia")
-            resultado["hora_local"] = tz_info.get("hora_local")
+    if tz_info:
+        resultado["diferencia_horaria"] = tz_info.get("diferencia")
+        resultado["desfase_utc_minutos"] = tz_info.get("desfase_minutos")
     
     return InfoPanelResponse(**resultado)
 
+@app.post("/api/info-panel/batch", response_model=InfoPanelBatchResponse)
+async def obtener_info_panel_batch(request: InfoPanelBatchRequest, stream: bool = False):
+    """
+    Información del panel lateral para varias ciudades a la vez (por ejemplo, para
+    comparar destinos). El tipo de cambio se consulta una sola vez para todo el lote
+    y las ciudades se procesan en paralelo con concurrencia acotada.
+    Con `?stream=true` cada resultado se envía (NDJSON) en cuanto está listo.
+    """
+    _validar_lote(request.ciudades)
+    iniciar_plazo(PLAZO_INFO_PANEL_BATCH)
+    tarea_tipo_cambio = asyncio.ensure_future(obtener_tabla_tipos())
+    
+    async def info_panel(ciudad: str) -> InfoPanelResponse:
+        clima_info, tz_info = await _info_ciudad(ciudad)
+        tabla = await con_plazo(asyncio.shield(tarea_tipo_cambio), None, "tipo_cambio")
+        return _armar_info_panel(tabla, clima_info, tz_info, ciudad)
+    
+    async def items():
+        try:
+            async for indice, info, error in _procesar_lote(request.ciudades, info_panel):
+                yield InfoPanelBatchItem(indice=indice, ciudad=request.ciudades[indice], info=info, error=error)
+        finally:
+            if not tarea_tipo_cambio.done():
+                tarea_tipo_cambio.cancel()
+    
+    return await _respuesta_lote(items(), InfoPanelBatchResponse, stream)
+
+@app.post("/api/planificar/batch", response_model=PlanificarBatchResponse)
+async def planificar_viaje_batch(request: PlanificarBatchRequest, stream: bool = False):
+    """
+    Varias preguntas a la vez (por ejemplo, la misma pregunta para varios destinos
+    candidatos). Las respuestas se generan en paralelo con concurrencia acotada y se
+    devuelven en el mismo orden; si una falla, su elemento lleva `error`.
+    Con `?stream=true` cada resultado se envía (NDJSON) en cuanto está listo.
+    """
+    _validar_lote(request.preguntas)
+    
+    async def items():
+        # Los elementos de un lote no abren sesiones nuevas: no continúan una conversación
+        planificar = lambda pregunta: _planificar(pregunta, guardar_sesion=False)
+        async for indice, respuesta, error in _procesar_lote(request.preguntas, planificar):
+            if respuesta is not None and not _respuesta_cacheable((respuesta.respuesta, respuesta.fotos)):
+                # Los mensajes de error de Gemini (❌) se reportan como error del elemento
+                respuesta, error = None, respuesta.respuesta
+            yield PlanificarBatchItem(indice=indice, pregunta=request.preguntas[indice].pregunta, respuesta=respuesta, error=error)
+    
+    return await _respuesta_lote(items(), PlanificarBatchResponse, stream)
+
+# Conversiones como máximo por petición en /api/convert/batch (son baratas: no llaman a APIs)
+CONVERTIR_MAX_ELEMENTOS = int(os.getenv("CONVERTIR_MAX_ELEMENTOS", "1000"))
+
+async def _tabla_para_convertir() -> TablaTipos:
+    tabla = await obtener_tabla_tipos()
+    if not tabla:
+        raise HTTPException(status_code=503, detail="Tipo de cambio no disponible en este momento")
+    return tabla
+
+def _fecha_tabla(tabla: TablaTipos) -> str:
+    return datetime.fromtimestamp(tabla.actualizada, timezone.utc).isoformat()
+
+@app.get("/api/convert", response_model=ConversionResponse)
+async def convertir_moneda(cantidad: float, de: str, a: str):
+    """
+    Convierte una cantidad entre dos monedas cualesquiera (códigos ISO 4217) con la
+    tabla de tipos de cambio en caché: no llama a la API en cada petición.
+    """
+    tabla = await _tabla_para_convertir()
+    try:
+        tasa = tabla.tasa(de, a)
+    except MonedaDesconocida as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ConversionResponse(
+        cantidad=cantidad, de=de.upper(), a=a.upper(),
+        resultado=redondear_importe(cantidad * tasa), tasa=redondear_importe(tasa), actualizado=_fecha_tabla(tabla),
+    )
+
+@app.post("/api/convert/batch", response_model=ConversionBatchResponse)
+async def convertir_moneda_batch(request: ConversionBatchRequest):
+    """
+    Muchas conversiones en una sola pasada sobre la tabla de tipos de cambio (por
+    ejemplo, todos los importes de una estimación de costos). Las conversiones con
+    una moneda desconocida llevan `error` y no afectan a las demás.
+    """
+    if not request.conversiones:
+        raise HTTPException(status_code=400, detail="El lote está vacío")
+    if len(request.conversiones) > CONVERTIR_MAX_ELEMENTOS:
+        raise HTTPException(status_code=400, detail=f"El lote admite como máximo {CONVERTIR_MAX_ELEMENTOS} conversiones")
+    tabla = await _tabla_para_convertir()
+    resultados = tabla.convertir_lote([(c.cantidad, c.de, c.a) for c in request.conversiones])
+    return ConversionBatchResponse(
+        actualizado=_fecha_tabla(tabla),
+        resultados=[
+            ConversionBatchItem(
+                indice=i, cantidad=c.cantidad, de=c.de.upper(), a=c.a.upper(),
+                **({"error": str(r)} if isinstance(r, MonedaDesconocida) else {"resultado": redondear_importe(r)}),
+            )
+            for i, (c, r) in enumerate(zip(request.conversiones, resultados))
+        ],
+    )
+
+# Calentamiento del arranque: lo que pagaría la primera petición, en segundo plano
+# mientras la app ya atiende (ver arranque.py y /api/ready)
+async def _calentar_gemini() -> None:
+    """
+    Importa el SDK en un hilo y resuelve el modelo de Gemini sin generar nada.
+    """
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY no configurada")
+    await asyncio.to_thread(sdk_gemini)
+    modelo = await SELECTOR_MODELOS.resolver()
+    if modelo is None:
+        raise RuntimeError("Ningún modelo de la lista está disponible")
+    print(f"✅ Modelo de Gemini resuelto al arrancar: {modelo}")
+
+async def _calentar_conexiones() -> None:
+    """
+    Abre en el pool una conexión (DNS, TCP y TLS) con cada API externa configurada.
+    Vale cualquier respuesta al HEAD, incluso un 404: lo que se reutiliza es la conexión.
+    """
+    urls = [TIPO_CAMBIO_URL]
+    if OPENWEATHER_API_KEY:
+        urls.append(OPENWEATHER_URL)
+    if UNSPLASH_ACCESS_KEY:
+        urls.append(UNSPLASH_URL)
+    cliente = obtener_cliente()
+    resultados = await asyncio.gather(*(cliente.head(url, timeout=HTTP_TIMEOUT) for url in urls), return_exceptions=True)
+    errores = [f"{url}: {r!r}" for url, r in zip(urls, resultados) if isinstance(r, Exception)]
+    if errores:
+        raise RuntimeError("; ".join(errores))
+
+async def _calentar_datos_locales() -> None:
+    """
+    Carga el gazetteer, el índice de zonas horarias y las monedas por país.
+    """
+    await asyncio.to_thread(lambda: (gazetteer(), indice_zonas_horarias(), monedas_por_pais()))
+
+ETAPAS_CALENTAMIENTO = {
+    "gemini": _calentar_gemini,
+    "conexiones": _calentar_conexiones,
+    "datos_locales": _calentar_datos_locales,
+}
+
+ESTADO_ARRANQUE.marcar_importacion()
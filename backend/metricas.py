@@ -0,0 +1,400 @@
+"""
+Métricas de latencia y errores, en formato Prometheus y como cabecera Server-Timing.
+
+- Histogramas de duración por etapa del pipeline (extracción de destino, prompt,
+  serialización), por API externa y por modelo de Gemini, más contadores de errores.
+- Tamaño estimado de cada prompt y secciones recortadas para no pasar del presupuesto.
+- Cola de Gemini (en curso, en cola, esperas y rechazos) y fichas de los límites de
+  tasa, leídas de limites.py al exportar.
+- GET /metrics las expone en el formato de texto de Prometheus.
+- Cada petición acumula sus tiempos en una ContextVar; el middleware los envía en
+  la cabecera Server-Timing para verlos en las herramientas de desarrollo del navegador.
+
+Registrar una observación es un bisect sobre unos pocos límites y un par de sumas,
+así que la instrumentación puede quedarse activa en producción.
+"""
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+
+from arranque import ESTADO_ARRANQUE
+from limites import ADMISION_GEMINI, LIMITES
+
+# Límites de los histogramas en segundos (de 5 ms a 30 s)
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Límites del histograma de tamaño del prompt, en tokens estimados
+LIMITES_TOKENS = (250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000)
+
+
+def _formatear_etiquetas(nombres: tuple[str, ...], valores: tuple[str, ...], extra: str = "") -> str:
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Contador:
+    """
+    Contador con etiquetas (solo sube).
+    """
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores: dict[tuple[str, ...], float] = {}
+
+    def incrementar(self, *valores: str, cantidad: float = 1) -> None:
+        self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def valor(self, *valores: str) -> float:
+        return self._valores.get(valores, 0)
+
+    def exportar(self) -> list[str]:
+        return [
+            f"{self.nombre}{_formatear_etiquetas(self.etiquetas, valores)} {total}"
+            for valores, total in self._valores.items()
+        ]
+
+
+class Indicador:
+    """
+    Valor que sube y baja (gauge), leído de `leer` al exportar: devuelve
+    {valores de etiquetas: valor}. Con tipo="counter" exporta un total que ya
+    lleva otro objeto (ej. los rechazos de un límite de tasa).
+    """
+
+    tipo = "gauge"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...], leer, tipo: str | None = None):
+        if tipo:
+            self.tipo = tipo
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._leer = leer
+
+    def exportar(self) -> list[str]:
+        return [
+            f"{self.nombre}{_formatear_etiquetas(self.etiquetas, valores)} {valor}"
+            for valores, valor in self._leer().items()
+        ]
+
+
+class Histograma:
+    """
+    Histograma con etiquetas y límites fijos (acumulativos al exportar).
+    """
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: tuple[str, ...] = (), limites: tuple[float, ...] = LIMITES_LATENCIA):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.limites = limites
+        # valores de etiquetas -> [conteos por cubeta (+Inf al final), suma, total]
+        self._series: dict[tuple[str, ...], list] = {}
+
+    def observar(self, valor: float, *valores: str) -> None:
+        serie = self._series.get(valores)
+        if serie is None:
+            serie = self._series[valores] = [[0] * (len(self.limites) + 1), 0.0, 0]
+        serie[0][bisect_left(self.limites, valor)] += 1
+        serie[1] += valor
+        serie[2] += 1
+
+    def exportar(self) -> list[str]:
+        lineas = []
+        for valores, (cubetas, suma, total) in self._series.items():
+            acumulado = 0
+            for limite, conteo in zip(self.limites + (float("inf"),), cubetas):
+                acumulado += conteo
+                le = 'le="+Inf"' if limite == float("inf") else f'le="{limite!r}"'
+                lineas.append(f"{self.nombre}_bucket{_formatear_etiquetas(self.etiquetas, valores, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_formatear_etiquetas(self.etiquetas, valores)} {suma}")
+            lineas.append(f"{self.nombre}_count{_formatear_etiquetas(self.etiquetas, valores)} {total}")
+        return lineas
+
+
+PETICIONES = Histograma(
+    "viajeia_peticiones_segundos", "Duración de las peticiones HTTP", ("ruta", "metodo", "estado")
+)
+ETAPAS = Histograma(
+    "viajeia_etapa_segundos", "Duración de cada etapa del pipeline", ("etapa",)
+)
+UPSTREAM = Histograma(
+    "viajeia_upstream_segundos", "Duración de las llamadas a APIs externas", ("api",)
+)
+UPSTREAM_ERRORES = Contador(
+    "viajeia_upstream_errores_total", "Errores de las APIs externas", ("api", "tipo")
+)
+GEMINI = Histograma(
+    "viajeia_gemini_segundos", "Duración de las generaciones por modelo de Gemini", ("modelo",)
+)
+GEMINI_ERRORES = Contador(
+    "viajeia_gemini_errores_total", "Errores de Gemini por modelo", ("modelo", "tipo")
+)
+PLAZOS_AGOTADOS = Contador(
+    "viajeia_plazo_agotado_total", "Datos omitidos por agotar el plazo de la petición", ("dato",)
+)
+COBERTURAS = Contador(
+    "viajeia_http_coberturas_total", "Peticiones duplicadas (hedging) a APIs externas", ("api", "resultado")
+)
+PROMPT_TOKENS = Histograma(
+    "viajeia_prompt_tokens", "Tokens estimados de cada prompt (instrucciones de sistema incluidas)",
+    limites=LIMITES_TOKENS,
+)
+PROMPT_RECORTES = Contador(
+    "viajeia_prompt_recortes_total", "Secciones del prompt resumidas o quitadas por el presupuesto de tokens", ("seccion",)
+)
+ARRANQUE = Indicador(
+    "viajeia_arranque_segundos", "Tiempos de arranque: importación, calentamiento y primera respuesta correcta",
+    ("fase",), lambda: {(fase,): segundos for fase, segundos in ESTADO_ARRANQUE.tiempos().items()},
+)
+# Cola de Gemini y límites de tasa: los mismos datos que /api/limites
+ADMISION_EN_CURSO = Indicador(
+    "viajeia_admision_en_curso", "Generaciones de Gemini en curso", ("cola",),
+    lambda: {(ADMISION_GEMINI.nombre,): ADMISION_GEMINI.en_curso},
+)
+ADMISION_EN_COLA = Indicador(
+    "viajeia_admision_en_cola", "Peticiones esperando turno en la cola de Gemini", ("cola",),
+    lambda: {(ADMISION_GEMINI.nombre,): ADMISION_GEMINI.en_cola},
+)
+ADMISION_PETICIONES = Indicador(
+    "viajeia_admision_peticiones_total", "Peticiones admitidas y rechazadas por la cola de Gemini", ("cola", "resultado"),
+    lambda: {
+        (ADMISION_GEMINI.nombre, "admitida"): ADMISION_GEMINI.admitidas,
+        (ADMISION_GEMINI.nombre, "rechazada"): ADMISION_GEMINI.rechazadas,
+    },
+    tipo="counter",
+)
+ADMISION_ESPERA = Indicador(
+    "viajeia_admision_espera_segundos_total", "Tiempo total de espera en la cola de Gemini de las peticiones admitidas",
+    ("cola",), lambda: {(ADMISION_GEMINI.nombre,): ADMISION_GEMINI.espera_total}, tipo="counter",
+)
+ADMISION_ESPERA_MAXIMA = Indicador(
+    "viajeia_admision_espera_maxima_segundos", "Espera más larga observada en la cola de Gemini", ("cola",),
+    lambda: {(ADMISION_GEMINI.nombre,): ADMISION_GEMINI.espera_maxima_observada},
+)
+LIMITE_FICHAS = Indicador(
+    "viajeia_limite_fichas", "Fichas disponibles en el límite de tasa de cada API", ("api",),
+    lambda: {(limite.nombre,): limite.fichas_disponibles() for limite in LIMITES},
+)
+LIMITE_LLAMADAS = Indicador(
+    "viajeia_limite_llamadas_total", "Llamadas permitidas y rechazadas por el límite de tasa de cada API", ("api", "resultado"),
+    lambda: {
+        (limite.nombre, resultado): total
+        for limite in LIMITES
+        for resultado, total in (("permitida", limite.permitidas), ("rechazada", limite.rechazadas))
+    },
+    tipo="counter",
+)
+METRICAS = [
+    PETICIONES, ETAPAS, UPSTREAM, UPSTREAM_ERRORES, GEMINI, GEMINI_ERRORES, PLAZOS_AGOTADOS, COBERTURAS,
+    PROMPT_TOKENS, PROMPT_RECORTES, ADMISION_EN_CURSO, ADMISION_EN_COLA, ADMISION_PETICIONES, ADMISION_ESPERA,
+    ADMISION_ESPERA_MAXIMA, LIMITE_FICHAS, LIMITE_LLAMADAS, ARRANQUE,
+]
+
+# Tiempos (nombre, segundos) de la petición en curso, para la cabecera Server-Timing
+_TIEMPOS_PETICION: ContextVar[list | None] = ContextVar("tiempos_peticion", default=None)
+# Momento en que terminó el endpoint (para medir la serialización)
+_FIN_ENDPOINT: ContextVar[list | None] = ContextVar("fin_endpoint", default=None)
+
+
+def _anotar_tiempo(nombre: str, segundos: float) -> None:
+    tiempos = _TIEMPOS_PETICION.get()
+    if tiempos is not None:
+        tiempos.append((nombre, segundos))
+
+
+def tiempos_peticion() -> dict[str, float]:
+    """
+    Tiempos acumulados de la petición en curso en milisegundos, por nombre.
+    """
+    resultado: dict[str, float] = {}
+    for nombre, segundos in _TIEMPOS_PETICION.get() or ():
+        resultado[nombre] = round(resultado.get(nombre, 0) + 1000 * segundos, 1)
+    return resultado
+
+
+@contextmanager
+def medir_etapa(etapa: str):
+    """
+    Mide una etapa del pipeline (ej. "destino", "prompt").
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        ETAPAS.observar(duracion, etapa)
+        _anotar_tiempo(etapa, duracion)
+
+
+@contextmanager
+def medir_upstream(api: str):
+    """
+    Mide una llamada a una API externa. Las excepciones cuentan como error y se
+    vuelven a lanzar.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        UPSTREAM_ERRORES.incrementar(api, type(e).__name__)
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        UPSTREAM.observar(duracion, api)
+        _anotar_tiempo(api, duracion)
+
+
+def registrar_error_upstream(api: str, tipo: str) -> None:
+    """
+    Cuenta un error que no llega como excepción (ej. "http_500", "limite").
+    """
+    UPSTREAM_ERRORES.incrementar(api, tipo)
+
+
+def registrar_prompt(tamano: dict) -> None:
+    """
+    Registra el tamaño de un prompt armado por construir_prompt y lo que se
+    recortó: turnos de historial resumidos o eliminados, resumen y clima.
+    """
+    PROMPT_TOKENS.observar(tamano["tokens_estimados"])
+    for seccion in ("turnos_resumidos", "turnos_eliminados"):
+        if tamano[seccion]:
+            PROMPT_RECORTES.incrementar(seccion, cantidad=tamano[seccion])
+    for seccion in ("resumen", "clima"):
+        if tamano[f"{seccion}_recortado"]:
+            PROMPT_RECORTES.incrementar(seccion)
+
+
+@contextmanager
+def medir_gemini(modelo: str):
+    """
+    Mide una generación de Gemini con un modelo concreto.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        GEMINI_ERRORES.incrementar(modelo, type(e).__name__)
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        GEMINI.observar(duracion, modelo)
+        _anotar_tiempo("gemini", duracion)
+
+
+def exportar_prometheus() -> str:
+    """
+    Todas las métricas en el formato de texto de Prometheus.
+    """
+    lineas = []
+    for metrica in METRICAS:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica.exportar())
+    return "\n".join(lineas) + "\n"
+
+
+def cabecera_server_timing(tiempos: list[tuple[str, float]]) -> str:
+    return ", ".join(f"{nombre};dur={1000 * segundos:.1f}" for nombre, segundos in tiempos)
+
+
+def _marcar_fin_endpoint(endpoint):
+    """
+    Envuelve un endpoint para anotar cuándo termina; lo que pasa entre ese momento
+    y el envío de las cabeceras es la serialización de la respuesta.
+    """
+    def marcar():
+        fin = _FIN_ENDPOINT.get()
+        if fin is not None:
+            fin.append(time.perf_counter())
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def envoltura(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                marcar()
+    else:
+        @functools.wraps(endpoint)
+        def envoltura(*args, **kwargs):
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                marcar()
+    return envoltura
+
+
+class RutaMedida(APIRoute):
+    """
+    Ruta de FastAPI que anota el fin del endpoint para medir la serialización.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _marcar_fin_endpoint(endpoint), **kwargs)
+
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que mide cada petición HTTP y añade la cabecera Server-Timing
+    con los tiempos de las etapas terminadas antes de enviar las cabeceras (en las
+    respuestas en streaming, las posteriores solo aparecen en /metrics).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        tiempos: list[tuple[str, float]] = []
+        fin_endpoint: list[float] = []
+        token_tiempos = _TIEMPOS_PETICION.set(tiempos)
+        token_fin = _FIN_ENDPOINT.set(fin_endpoint)
+        estado = [500]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+                ahora = time.perf_counter()
+                if ESTADO_ARRANQUE.primera_respuesta is None and estado[0] < 400:
+                    ESTADO_ARRANQUE.marcar_primera_respuesta()
+                if fin_endpoint:
+                    duracion = ahora - fin_endpoint[0]
+                    ETAPAS.observar(duracion, "serializacion")
+                    tiempos.append(("serializacion", duracion))
+                tiempos.append(("total", ahora - inicio))
+                mensaje["headers"] = list(mensaje.get("headers", [])) + [
+                    (b"server-timing", cabecera_server_timing(tiempos).encode("latin-1"))
+                ]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _TIEMPOS_PETICION.reset(token_tiempos)
+            _FIN_ENDPOINT.reset(token_fin)
+            # Etiquetar con la plantilla de la ruta para no crear una serie por URL
+            ruta = scope.get("route")
+            nombre_ruta = getattr(ruta, "path", None) or "otra"
+            PETICIONES.observar(time.perf_counter() - inicio, nombre_ruta, scope["method"], str(estado[0]))
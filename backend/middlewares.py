@@ -0,0 +1,290 @@
+"""
+Middlewares ASGI puros para el camino de las respuestas.
+
+A diferencia de @app.middleware("http") (BaseHTTPMiddleware), no crean tareas ni
+envuelven la respuesta en otro objeto por cada petición, y dejan pasar el streaming
+(SSE, NDJSON) sin acumularlo:
+
+- MiddlewareCORS: cabeceras CORS precalculadas y atajo para el preflight (OPTIONS),
+  que se responde sin pasar por el resto de la app.
+- MiddlewareCompresion: brotli o gzip, según el Accept-Encoding del cliente, para las
+  respuestas de más de `minimo` bytes.
+- MiddlewareValidacion: ETag y Cache-Control en rutas GET cacheables, con
+  respuesta 304 sin cuerpo cuando el cliente ya tiene la versión actual.
+"""
+import gzip
+import hashlib
+import re
+
+# brotli viene en requirements.txt; sin él (instalaciones mínimas) se usa solo gzip
+try:
+    import brotli
+    BROTLI_DISPONIBLE = True
+except ImportError:
+    BROTLI_DISPONIBLE = False
+
+# Tipos de contenido que vale la pena comprimir
+TIPOS_COMPRIMIBLES = (b"application/json", b"text/", b"application/javascript")
+# El streaming se envía fragmento a fragmento en cuanto se genera: no se comprime
+TIPOS_STREAMING = (b"text/event-stream", b"application/x-ndjson")
+
+
+def _cabecera(cabeceras: list[tuple[bytes, bytes]], nombre: bytes) -> bytes | None:
+    for clave, valor in cabeceras:
+        if clave.lower() == nombre:
+            return valor
+    return None
+
+
+def _sin_cabeceras(cabeceras: list[tuple[bytes, bytes]], *nombres: bytes) -> list[tuple[bytes, bytes]]:
+    return [(clave, valor) for clave, valor in cabeceras if clave.lower() not in nombres]
+
+
+def _agregar_vary(cabeceras: list[tuple[bytes, bytes]], valor: bytes) -> list[tuple[bytes, bytes]]:
+    actual = _cabecera(cabeceras, b"vary")
+    if actual is None:
+        return cabeceras + [(b"vary", valor)]
+    if valor.lower() in actual.lower():
+        return cabeceras
+    return _sin_cabeceras(cabeceras, b"vary") + [(b"vary", actual + b", " + valor)]
+
+
+class MiddlewareCORS:
+    """
+    CORS con las cabeceras calculadas una sola vez. Los orígenes permitidos son una
+    lista fija o una expresión regular; la decisión por origen se memoriza.
+    """
+
+    def __init__(
+        self,
+        app,
+        origenes: list[str] | None = None,
+        origen_regex: str | None = None,
+        metodos: tuple[str, ...] = ("GET", "POST", "PUT", "DELETE", "OPTIONS"),
+        expuestas: tuple[str, ...] = ("ETag", "Retry-After", "Server-Timing"),
+        max_age: int = 3600,
+    ):
+        self.app = app
+        self._origenes = set(origenes or [])
+        self._regex = re.compile(origen_regex) if origen_regex else None
+        self._permitidos: dict[bytes, bool] = {}
+        self._cabeceras_preflight = [
+            (b"access-control-allow-methods", ", ".join(metodos).encode()),
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-max-age", str(max_age).encode()),
+            (b"vary", b"Origin"),
+        ]
+        self._cabeceras_respuesta = [
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-expose-headers", ", ".join(expuestas).encode()),
+        ]
+
+    def _permitido(self, origen: bytes) -> bool:
+        permitido = self._permitidos.get(origen)
+        if permitido is None:
+            texto = origen.decode("latin-1")
+            permitido = texto in self._origenes or bool(self._regex and self._regex.fullmatch(texto))
+            # Acotado: con la regex de producción cualquier origen es válido
+            if len(self._permitidos) < 1000:
+                self._permitidos[origen] = permitido
+        return permitido
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        cabeceras = scope["headers"]
+        origen = _cabecera(cabeceras, b"origin")
+        if origen is None:
+            await self.app(scope, receive, send)
+            return
+
+        if scope["method"] == "OPTIONS" and _cabecera(cabeceras, b"access-control-request-method") is not None:
+            await self._preflight(origen, cabeceras, send)
+            return
+
+        if not self._permitido(origen):
+            await self.app(scope, receive, send)
+            return
+
+        extra = [(b"access-control-allow-origin", origen), (b"timing-allow-origin", origen)] + self._cabeceras_respuesta
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                mensaje["headers"] = _agregar_vary(list(mensaje.get("headers", [])) + extra, b"Origin")
+            await send(mensaje)
+
+        await self.app(scope, receive, enviar)
+
+    async def _preflight(self, origen: bytes, cabeceras: list[tuple[bytes, bytes]], send) -> None:
+        if not self._permitido(origen):
+            cuerpo = "Origen CORS no permitido".encode()
+            await send({"type": "http.response.start", "status": 400, "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"), (b"content-length", str(len(cuerpo)).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": cuerpo})
+            return
+        respuesta = [(b"access-control-allow-origin", origen), (b"content-length", b"0")] + self._cabeceras_preflight
+        # Se permiten las cabeceras que pida el navegador (equivale a allow_headers=["*"])
+        pedidas = _cabecera(cabeceras, b"access-control-request-headers")
+        if pedidas:
+            respuesta.append((b"access-control-allow-headers", pedidas))
+        await send({"type": "http.response.start", "status": 200, "headers": respuesta})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def _elegir_codificacion(accept_encoding: bytes | None) -> bytes | None:
+    """
+    "br" si el cliente lo acepta y brotli está instalado; si no, "gzip" si lo acepta.
+    """
+    if not accept_encoding:
+        return None
+    aceptadas = set()
+    for parte in accept_encoding.lower().split(b","):
+        nombre, _, parametros = parte.strip().partition(b";")
+        if parametros.strip().replace(b" ", b"") in (b"q=0", b"q=0.0", b"q=0.00", b"q=0.000"):
+            continue
+        aceptadas.add(nombre.strip())
+    if BROTLI_DISPONIBLE and b"br" in aceptadas:
+        return b"br"
+    if b"gzip" in aceptadas or b"*" in aceptadas:
+        return b"gzip"
+    return None
+
+
+class MiddlewareCompresion:
+    """
+    Comprime las respuestas completas (no en streaming) de tipo JSON o texto de más
+    de `minimo` bytes. Las más pequeñas no compensan el coste de comprimir.
+    """
+
+    def __init__(self, app, minimo: int = 1024, nivel_gzip: int = 6, calidad_brotli: int = 4):
+        self.app = app
+        self.minimo = minimo
+        self.nivel_gzip = nivel_gzip
+        self.calidad_brotli = calidad_brotli
+
+    def _comprimir(self, cuerpo: bytes, codificacion: bytes) -> bytes:
+        if codificacion == b"br":
+            return brotli.compress(cuerpo, quality=self.calidad_brotli)
+        return gzip.compress(cuerpo, compresslevel=self.nivel_gzip, mtime=0)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        codificacion = _elegir_codificacion(_cabecera(scope["headers"], b"accept-encoding"))
+        if codificacion is None:
+            await self.app(scope, receive, send)
+            return
+
+        inicio: dict | None = None
+        pasar = False
+
+        async def enviar(mensaje):
+            nonlocal inicio, pasar
+            if pasar:
+                await send(mensaje)
+                return
+            if mensaje["type"] == "http.response.start":
+                cabeceras = mensaje.get("headers", [])
+                tipo = _cabecera(cabeceras, b"content-type") or b""
+                if (
+                    _cabecera(cabeceras, b"content-encoding") is not None
+                    or not tipo.startswith(TIPOS_COMPRIMIBLES)
+                    or tipo.startswith(TIPOS_STREAMING)
+                ):
+                    pasar = True
+                    await send(mensaje)
+                else:
+                    # Se decide con el primer fragmento del cuerpo
+                    inicio = mensaje
+                return
+
+            # Primer fragmento del cuerpo
+            cuerpo = mensaje.get("body", b"")
+            pasar = True
+            if mensaje.get("more_body", False) or len(cuerpo) < self.minimo:
+                await send(inicio)
+                await send(mensaje)
+                return
+            comprimido = self._comprimir(cuerpo, codificacion)
+            cabeceras = _sin_cabeceras(inicio.get("headers", []), b"content-length")
+            cabeceras += [(b"content-encoding", codificacion), (b"content-length", str(len(comprimido)).encode())]
+            etag = _cabecera(cabeceras, b"etag")
+            if etag is not None and not etag.startswith(b"W/"):
+                # La representación comprimida ya no es idéntica byte a byte
+                cabeceras = _sin_cabeceras(cabeceras, b"etag") + [(b"etag", b"W/" + etag)]
+            inicio["headers"] = _agregar_vary(cabeceras, b"Accept-Encoding")
+            await send(inicio)
+            await send({"type": "http.response.body", "body": comprimido})
+
+        await self.app(scope, receive, enviar)
+
+
+def _etags(if_none_match: bytes) -> set[bytes]:
+    return {etag.strip().removeprefix(b"W/") for etag in if_none_match.split(b",")}
+
+
+class MiddlewareValidacion:
+    """
+    ETag (hash del cuerpo) y Cache-Control en las respuestas 200 de las rutas GET
+    indicadas. Si el If-None-Match del cliente coincide, responde 304 sin cuerpo:
+    el navegador (o la caché de la CDN) revalida sin volver a descargar.
+    Si el endpoint marca la respuesta con no-store (datos incompletos), pasa tal cual.
+    """
+
+    def __init__(self, app, rutas: dict[str, str]):
+        self.app = app
+        # ruta -> valor de Cache-Control
+        self.rutas = {ruta: valor.encode() for ruta, valor in rutas.items()}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        cache_control = self.rutas.get(scope["path"])
+        if cache_control is None:
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = _cabecera(scope["headers"], b"if-none-match")
+        inicio: dict | None = None
+        pasar = False
+
+        async def enviar(mensaje):
+            nonlocal inicio, pasar
+            if pasar:
+                await send(mensaje)
+                return
+            if mensaje["type"] == "http.response.start":
+                # Respuestas parciales: el endpoint pone no-store y no llevan ETag ni 304
+                propio = _cabecera(mensaje.get("headers", []), b"cache-control")
+                if mensaje["status"] != 200 or (propio is not None and b"no-store" in propio.lower()):
+                    pasar = True
+                    await send(mensaje)
+                else:
+                    inicio = mensaje
+                return
+
+            cuerpo = mensaje.get("body", b"")
+            pasar = True
+            if mensaje.get("more_body", False):
+                await send(inicio)
+                await send(mensaje)
+                return
+            etag = b'"' + hashlib.blake2b(cuerpo, digest_size=12).hexdigest().encode() + b'"'
+            # Un Cache-Control propio del endpoint se respeta
+            propio = _cabecera(inicio.get("headers", []), b"cache-control")
+            cabeceras = _sin_cabeceras(inicio.get("headers", []), b"etag", b"cache-control")
+            cabeceras += [(b"etag", etag), (b"cache-control", propio if propio is not None else cache_control)]
+            if if_none_match is not None and etag in _etags(if_none_match):
+                cabeceras = _sin_cabeceras(cabeceras, b"content-length", b"content-type")
+                await send({"type": "http.response.start", "status": 304, "headers": cabeceras})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            inicio["headers"] = cabeceras
+            await send(inicio)
+            await send(mensaje)
+
+        await self.app(scope, receive, enviar)
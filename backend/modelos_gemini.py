@@ -0,0 +1,154 @@
+"""
+Selección del modelo de Gemini con caché de objetos y circuit breaker por modelo.
+
+En lugar de recorrer la lista de modelos desde el principio en cada petición,
+se recuerda el primer modelo que respondió bien y se reutilizan los objetos
+GenerativeModel ya creados. Los modelos que fallan se saltan durante un tiempo
+de enfriamiento (circuito abierto) para no pagar errores 404 repetidos.
+
+El SDK (google.generativeai) no se importa al cargar la app: junto con gRPC y
+protobuf tarda alrededor de un segundo. sdk_gemini() lo importa y configura la
+primera vez que se necesita (en el calentamiento del arranque o en la primera
+petición, lo que llegue antes).
+"""
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+# Enfriamiento para modelos que no existen (404) y para fallos transitorios
+ENFRIAMIENTO_MODELO_NO_DISPONIBLE = float(os.getenv("GEMINI_ENFRIAMIENTO_404", "3600"))
+ENFRIAMIENTO_MODELO_FALLIDO = float(os.getenv("GEMINI_ENFRIAMIENTO_FALLO", "60"))
+# Fallos transitorios consecutivos antes de abrir el circuito
+UMBRAL_FALLOS = int(os.getenv("GEMINI_UMBRAL_FALLOS", "3"))
+
+_sdk = None
+_sdk_lock = threading.Lock()
+
+
+def sdk_gemini():
+    """
+    Módulo google.generativeai, importado y configurado con GEMINI_API_KEY la
+    primera vez. Puede llamarse desde un hilo (el calentamiento lo importa con
+    asyncio.to_thread para no bloquear el event loop).
+    """
+    global _sdk
+    if _sdk is None:
+        with _sdk_lock:
+            if _sdk is None:
+                import google.generativeai as genai
+                api_key = os.getenv("GEMINI_API_KEY")
+                if api_key:
+                    genai.configure(api_key=api_key)
+                _sdk = genai
+    return _sdk
+
+
+class CircuitBreaker:
+    """
+    Circuito de un modelo: se abre tras `umbral` fallos consecutivos (o de
+    inmediato si el modelo no existe) y se cierra al pasar el enfriamiento.
+    """
+
+    def __init__(self, umbral: int = UMBRAL_FALLOS):
+        self.umbral = umbral
+        self.fallos_consecutivos = 0
+        self.abierto_hasta = 0.0
+
+    def disponible(self) -> bool:
+        return time.monotonic() >= self.abierto_hasta
+
+    def registrar_exito(self) -> None:
+        self.fallos_consecutivos = 0
+        self.abierto_hasta = 0.0
+
+    def registrar_fallo(self, enfriamiento: float, abrir_ya: bool = False) -> None:
+        self.fallos_consecutivos += 1
+        if abrir_ya or self.fallos_consecutivos >= self.umbral:
+            self.abierto_hasta = time.monotonic() + enfriamiento
+
+
+class SelectorModelos:
+    """
+    Decide qué modelos intentar y en qué orden, y guarda los objetos de modelo.
+    """
+
+    def __init__(
+        self,
+        nombres: list[str],
+        crear_modelo: Callable[[str], Any],
+        comprobar_modelo: Callable[[str], Awaitable[bool]] | None = None,
+    ):
+        self.nombres = list(nombres)
+        self._crear_modelo = crear_modelo
+        # Indica si el modelo existe sin generar nada (para resolverlo al arrancar)
+        self._comprobar_modelo = comprobar_modelo
+        self._modelos: dict[str, Any] = {}
+        self._circuitos = {nombre: CircuitBreaker() for nombre in self.nombres}
+        self.resuelto: str | None = None
+
+    def modelo(self, nombre: str) -> Any:
+        """
+        Devuelve el objeto de modelo para `nombre`, creándolo solo la primera vez.
+        """
+        if nombre not in self._modelos:
+            self._modelos[nombre] = self._crear_modelo(nombre)
+        return self._modelos[nombre]
+
+    def candidatos(self) -> list[str]:
+        """
+        Modelos a intentar en orden: primero el que ya funcionó, luego el resto
+        por preferencia, saltando los que tienen el circuito abierto.
+        """
+        orden = self.nombres
+        if self.resuelto:
+            orden = [self.resuelto] + [n for n in self.nombres if n != self.resuelto]
+        return [n for n in orden if self._circuitos[n].disponible()]
+
+    def registrar_exito(self, nombre: str) -> None:
+        self._circuitos[nombre].registrar_exito()
+        self.resuelto = nombre
+
+    def registrar_fallo(self, nombre: str, no_disponible: bool = False) -> None:
+        """
+        Registra un fallo. Si el modelo no existe (404) su circuito se abre de
+        inmediato con un enfriamiento largo.
+        """
+        if no_disponible:
+            self._circuitos[nombre].registrar_fallo(ENFRIAMIENTO_MODELO_NO_DISPONIBLE, abrir_ya=True)
+            self._modelos.pop(nombre, None)
+        else:
+            self._circuitos[nombre].registrar_fallo(ENFRIAMIENTO_MODELO_FALLIDO)
+        if self.resuelto == nombre and not self._circuitos[nombre].disponible():
+            self.resuelto = None
+
+    async def resolver(self) -> str | None:
+        """
+        Resuelve el modelo antes de la primera petición: comprueba los candidatos en
+        orden de preferencia hasta encontrar uno que exista y crea su objeto. Los que
+        no existen quedan con el circuito abierto, como tras un 404 en una petición.
+        Los errores que no son un 404 (red, API key) se propagan sin marcar el modelo.
+        """
+        if self.resuelto or self._comprobar_modelo is None:
+            return self.resuelto
+        for nombre in self.candidatos():
+            if await self._comprobar_modelo(nombre):
+                self.modelo(nombre)
+                self.resuelto = nombre
+                return nombre
+            self.registrar_fallo(nombre, no_disponible=True)
+        return None
+
+    def estado(self) -> dict:
+        ahora = time.monotonic()
+        return {
+            "resuelto": self.resuelto,
+            "circuitos": {
+                nombre: {
+                    "abierto": not circuito.disponible(),
+                    "fallos_consecutivos": circuito.fallos_consecutivos,
+                    "segundos_para_reintento": max(0.0, round(circuito.abierto_hasta - ahora, 1)),
+                }
+                for nombre, circuito in self._circuitos.items()
+            },
+        }
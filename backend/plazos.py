@@ -0,0 +1,143 @@
+"""
+Plazo (presupuesto de latencia) por petición.
+
+Cada endpoint fija al empezar el tiempo total que puede tardar (configurable por
+endpoint). Los datos de enriquecimiento (clima, fotos, tipo de cambio) se esperan
+con con_plazo: si no llegan a tiempo el endpoint deja de esperarlos y responde con
+lo que sí llegó en vez de esperar al dato más lento.
+
+El plazo vive en una ContextVar, así que lo heredan las tareas que crea la petición
+(las descargas en paralelo, los elementos de un lote). Las descargas a APIs externas
+pasan todas por las cachés, cuyo single-flight (y el refresco en segundo plano)
+corre sin plazo (ver sin_plazo): sirven a varias peticiones y deben terminar para
+llenar la caché aunque la petición que las lanzó ya no espere, así que en la
+práctica su timeout es HTTP_TIMEOUT. timeout_http solo recorta el timeout al plazo
+restante para una llamada hecha directamente desde la petición, fuera de la caché.
+
+Opcionalmente, un GET idempotente que tarda más de HTTP_COBERTURA_RETRASO se repite
+(hedging) y se usa la primera respuesta que llegue.
+"""
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable
+
+import httpx
+
+from cliente_http import HTTP_TIMEOUT, obtener_cliente
+from limites import TokenBucket
+from metricas import COBERTURAS, PLAZOS_AGOTADOS
+
+# Plazo total por endpoint (segundos). En /api/planificar el plazo limita el
+# enriquecimiento (clima y fotos), no la generación de Gemini, que se deja terminar.
+PLAZO_INFO_PANEL = float(os.getenv("PLAZO_INFO_PANEL", "3"))
+PLAZO_INFO_PANEL_BATCH = float(os.getenv("PLAZO_INFO_PANEL_BATCH", "6"))
+PLAZO_PLANIFICAR = float(os.getenv("PLAZO_PLANIFICAR", "15"))
+
+# Segundos sin respuesta tras los que se lanza la petición duplicada (0 = sin hedging)
+HTTP_COBERTURA_RETRASO = float(os.getenv("HTTP_COBERTURA_RETRASO", "1"))
+
+# (momento límite en time.monotonic(), datos omitidos por agotar el plazo)
+_PLAZO: ContextVar[tuple[float, list[str]] | None] = ContextVar("plazo_peticion", default=None)
+
+
+def iniciar_plazo(segundos: float) -> None:
+    """
+    Fija el plazo de la petición (o del elemento del lote) en curso.
+    """
+    _PLAZO.set((time.monotonic() + segundos, []))
+
+
+def segundos_restantes() -> float | None:
+    """
+    Segundos que quedan del plazo (0 si ya se agotó) o None si no hay plazo.
+    """
+    plazo = _PLAZO.get()
+    if plazo is None:
+        return None
+    return max(0.0, plazo[0] - time.monotonic())
+
+
+def timeout_http() -> float:
+    """
+    Timeout para una llamada HTTP: lo que queda del plazo, como máximo HTTP_TIMEOUT.
+    Dentro de una descarga de la caché no hay plazo y es siempre HTTP_TIMEOUT.
+    """
+    restante = segundos_restantes()
+    return HTTP_TIMEOUT if restante is None else min(HTTP_TIMEOUT, restante)
+
+
+def datos_omitidos() -> list[str]:
+    """
+    Datos que se omitieron en la petición en curso por agotar el plazo.
+    """
+    plazo = _PLAZO.get()
+    return list(plazo[1]) if plazo is not None else []
+
+
+async def sin_plazo(espera: Awaitable[Any]) -> Any:
+    """
+    Espera `espera` sin el plazo de la petición en curso: sus llamadas HTTP usan
+    HTTP_TIMEOUT. Solo para ejecutar dentro de una tarea propia (que copia el
+    contexto de quien la crea), así el plazo de la petición no cambia.
+    """
+    _PLAZO.set(None)
+    return await espera
+
+
+async def con_plazo(espera: Awaitable[Any], por_defecto: Any, dato: str) -> Any:
+    """
+    Espera un dato de enriquecimiento como máximo lo que queda del plazo. Si no
+    llega a tiempo se cancela la espera y se devuelve `por_defecto`. Las descargas
+    compartidas en la caché (single-flight) siguen en curso y la guardan para la
+    siguiente petición.
+    """
+    restante = segundos_restantes()
+    if restante is None:
+        return await espera
+    try:
+        return await asyncio.wait_for(espera, restante)
+    except asyncio.TimeoutError:
+        PLAZOS_AGOTADOS.incrementar(dato)
+        _PLAZO.get()[1].append(dato)
+        print(f"⏱️ Plazo agotado, se omite: {dato}")
+        return por_defecto
+
+
+async def get_con_plazo(url: str, api: str, cobertura: TokenBucket | None = None, **kwargs) -> httpx.Response:
+    """
+    GET con el cliente compartido y timeout según timeout_http (HTTP_TIMEOUT en las
+    descargas de la caché, que corren sin plazo).
+    Si se indica `cobertura` (el límite de tasa de la API) y la respuesta tarda más
+    de HTTP_COBERTURA_RETRASO, se lanza una segunda petición idéntica (si quedan
+    fichas y plazo) y se usa la primera que responda bien. Solo para GETs idempotentes.
+    """
+    cliente = obtener_cliente()
+    timeout = timeout_http()
+    if cobertura is None or HTTP_COBERTURA_RETRASO <= 0 or timeout <= HTTP_COBERTURA_RETRASO:
+        return await cliente.get(url, timeout=timeout, **kwargs)
+
+    tareas = [asyncio.ensure_future(cliente.get(url, timeout=timeout, **kwargs))]
+    try:
+        hechas, _pendientes = await asyncio.wait(tareas, timeout=HTTP_COBERTURA_RETRASO)
+        if not hechas and cobertura.intentar():
+            COBERTURAS.incrementar(api, "lanzada")
+            tareas.append(asyncio.ensure_future(cliente.get(url, timeout=timeout_http(), **kwargs)))
+
+        pendientes = set(tareas)
+        while pendientes:
+            hechas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            for tarea in hechas:
+                if tarea.exception() is None:
+                    if len(tareas) > 1 and tarea is tareas[1]:
+                        COBERTURAS.incrementar(api, "ganada")
+                    return tarea.result()
+        # Todas fallaron: se propaga el error de la petición original
+        return tareas[0].result()
+    finally:
+        for tarea in tareas:
+            if not tarea.done():
+                tarea.cancel()
+            elif not tarea.cancelled():
+                tarea.exception()
@@ -0,0 +1,201 @@
+"""
+Refresco en segundo plano de los datos más pedidos (stale-while-revalidate).
+
+Una tarea que vive en el lifespan de la app:
+- Lleva la cuenta de los destinos más pedidos en /api/info-panel y /api/planificar
+  (con decaimiento, para que los destinos que dejan de pedirse salgan de la lista).
+- Poco antes de que venzan, refresca el clima y las fotos de esos destinos, así la
+  primera petición tras el vencimiento no paga la latencia de la API.
+- Mantiene caliente el tipo de cambio refrescándolo a intervalo fijo.
+
+El refresco nunca gasta las últimas fichas del límite de tasa de cada API (quedan
+reservadas para las peticiones de los usuarios) y se detiene limpiamente al apagar.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, NamedTuple
+
+from cache import CacheTTL, normalizar_clave
+from limites import TokenBucket
+
+REFRESCO_ACTIVO = os.getenv("REFRESCO_ACTIVO", "true").lower() == "true"
+# Segundos entre ciclos y margen antes del vencimiento en el que se refresca una entrada
+REFRESCO_INTERVALO = float(os.getenv("REFRESCO_INTERVALO", "30"))
+REFRESCO_MARGEN = float(os.getenv("REFRESCO_MARGEN", "90"))
+# Destinos populares que se mantienen calientes
+REFRESCO_MAX_DESTINOS = int(os.getenv("REFRESCO_MAX_DESTINOS", "20"))
+# Fracción de la ráfaga de cada límite de tasa reservada para las peticiones de usuarios
+REFRESCO_RESERVA_LIMITE = float(os.getenv("REFRESCO_RESERVA_LIMITE", "0.5"))
+
+# Factor por ciclo con el que decae la popularidad y puntuación mínima para seguir en la lista
+DECAIMIENTO_POPULARIDAD = 0.8
+POPULARIDAD_MINIMA = 0.1
+
+
+class DestinosPopulares:
+    """
+    Contador de peticiones por destino con decaimiento exponencial.
+    """
+
+    def __init__(self, max_destinos: int = 500):
+        self.max_destinos = max_destinos
+        # clave normalizada -> [puntuación, nombre tal como se pidió]
+        self._destinos: dict[str, list] = {}
+
+    def registrar(self, destino: str | None) -> None:
+        if not destino:
+            return
+        clave = normalizar_clave(destino)
+        entrada = self._destinos.get(clave)
+        if entrada is None:
+            if len(self._destinos) >= self.max_destinos:
+                del self._destinos[min(self._destinos, key=lambda c: self._destinos[c][0])]
+            self._destinos[clave] = [1.0, destino]
+        else:
+            entrada[0] += 1
+
+    def mas_populares(self, cantidad: int) -> list[str]:
+        ordenados = sorted(self._destinos.values(), key=lambda entrada: entrada[0], reverse=True)
+        return [nombre for _puntuacion, nombre in ordenados[:cantidad]]
+
+    def decaer(self) -> None:
+        for clave in list(self._destinos):
+            self._destinos[clave][0] *= DECAIMIENTO_POPULARIDAD
+            if self._destinos[clave][0] < POPULARIDAD_MINIMA:
+                del self._destinos[clave]
+
+    def __len__(self) -> int:
+        return len(self._destinos)
+
+
+class FuenteDestino(NamedTuple):
+    """
+    Datos por destino que se refrescan (ej. clima, fotos).
+    """
+    nombre: str
+    cache: CacheTTL
+    clave: Callable[[str], Any]
+    descargar: Callable[[str], Awaitable[Any]]
+    limite: TokenBucket | None
+
+
+class FuentePeriodica(NamedTuple):
+    """
+    Dato global que se refresca a intervalo fijo (ej. tipo de cambio).
+    """
+    nombre: str
+    cache: CacheTTL
+    clave: Any
+    descargar: Callable[[], Awaitable[Any]]
+    limite: TokenBucket | None
+    intervalo: float
+
+
+class Refrescador:
+    """
+    Tarea en segundo plano que refresca las fuentes antes de que venzan.
+    """
+
+    def __init__(
+        self,
+        fuentes_destino: list[FuenteDestino],
+        fuentes_periodicas: list[FuentePeriodica],
+        intervalo: float = REFRESCO_INTERVALO,
+        margen: float = REFRESCO_MARGEN,
+        max_destinos: int = REFRESCO_MAX_DESTINOS,
+        reserva_limite: float = REFRESCO_RESERVA_LIMITE,
+    ):
+        self.fuentes_destino = fuentes_destino
+        self.fuentes_periodicas = fuentes_periodicas
+        self.intervalo = intervalo
+        self.margen = margen
+        self.max_destinos = max_destinos
+        self.reserva_limite = reserva_limite
+        self.populares = DestinosPopulares()
+        self._proximo_periodico = {fuente.nombre: 0.0 for fuente in fuentes_periodicas}
+        self._tarea: asyncio.Task | None = None
+        self.ciclos = 0
+        self.refrescados = {fuente.nombre: 0 for fuente in [*fuentes_destino, *fuentes_periodicas]}
+        self.omitidos_por_limite = 0
+        self.errores = 0
+
+    def _hay_presupuesto(self, limite: TokenBucket | None) -> bool:
+        if limite is None:
+            return True
+        if limite.fichas_disponibles() - 1 >= limite.capacidad * self.reserva_limite:
+            return True
+        self.omitidos_por_limite += 1
+        return False
+
+    async def _refrescar(self, nombre: str, cache: CacheTTL, clave: Any, descargar: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            # Las descargas devuelven un valor vacío si la API falla (y no se guarda)
+            if await cache.refrescar(clave, descargar):
+                self.refrescados[nombre] += 1
+            else:
+                self.errores += 1
+        except Exception as e:
+            self.errores += 1
+            print(f"Error al refrescar {nombre} ({clave}): {e}")
+
+    async def ciclo(self) -> None:
+        """
+        Un ciclo de refresco: fuentes periódicas que tocan y fuentes por destino de
+        los destinos populares que vencen dentro del margen (o ya vencieron).
+        """
+        ahora = time.monotonic()
+        for fuente in self.fuentes_periodicas:
+            if ahora >= self._proximo_periodico[fuente.nombre] and self._hay_presupuesto(fuente.limite):
+                self._proximo_periodico[fuente.nombre] = ahora + fuente.intervalo
+                await self._refrescar(fuente.nombre, fuente.cache, fuente.clave, fuente.descargar)
+
+        for destino in self.populares.mas_populares(self.max_destinos):
+            for fuente in self.fuentes_destino:
+                clave = fuente.clave(destino)
+                restante = fuente.cache.segundos_restantes(clave)
+                # Solo se refresca lo que ya está en caché y está por vencer
+                if restante is None or restante > self.margen:
+                    continue
+                if not self._hay_presupuesto(fuente.limite):
+                    continue
+                await self._refrescar(fuente.nombre, fuente.cache, clave, lambda: fuente.descargar(destino))
+
+        self.populares.decaer()
+        self.ciclos += 1
+
+    async def _ejecutar(self) -> None:
+        while True:
+            try:
+                await self.ciclo()
+            except Exception as e:
+                print(f"Error en el ciclo de refresco: {e}")
+            await asyncio.sleep(self.intervalo)
+
+    def iniciar(self) -> None:
+        if self._tarea is None:
+            self._tarea = asyncio.create_task(self._ejecutar())
+
+    async def detener(self) -> None:
+        """
+        Cancela la tarea y espera a que termine (el refresco en curso se cancela).
+        """
+        if self._tarea is None:
+            return
+        self._tarea.cancel()
+        try:
+            await self._tarea
+        except asyncio.CancelledError:
+            pass
+        self._tarea = None
+
+    def estadisticas(self) -> dict:
+        return {
+            "activo": self._tarea is not None,
+            "ciclos": self.ciclos,
+            "destinos_seguidos": len(self.populares),
+            "destinos_populares": self.populares.mas_populares(self.max_destinos),
+            "refrescados": self.refrescados,
+            "omitidos_por_limite": self.omitidos_por_limite,
+            "errores": self.errores,
+        }
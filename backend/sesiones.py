@@ -0,0 +1,143 @@
+"""
+Sesiones de conversación guardadas en el servidor.
+
+En lugar de que el frontend reenvíe todo el historial en cada petición, el servidor
+guarda por sesión los últimos turnos y un resumen compacto de los anteriores. Cuando
+un turno sale de la ventana de turnos recientes se resume en una línea (la pregunta y
+el destino mencionado) que se añade al resumen, y si el resumen supera su tamaño
+máximo se descartan las líneas más antiguas. Así tanto la petición como el prompt
+tienen un tamaño acotado sin importar lo larga que sea la conversación.
+
+Las sesiones viven en una CacheTTL: expiran tras un tiempo sin actividad y, si se
+alcanza el máximo, se desaloja la usada hace más tiempo. Una sesión nueva solo se
+guarda al registrar su primer turno, así las peticiones que fallan o que no
+continúan una conversación (ej. los elementos de un lote) no ocupan sitio. Las
+sesiones son de cada proceso: tras un reinicio, en otro worker o una vez vencidas,
+el cliente tiene que reenviar su historial.
+"""
+import os
+import secrets
+from collections import deque
+from typing import Iterable
+
+from cache import CacheTTL
+from lugares import buscar_lugar_en_texto
+
+# Tiempo sin actividad (segundos) tras el que una sesión expira y número máximo de sesiones
+SESIONES_TTL = float(os.getenv("SESIONES_TTL", "3600"))
+SESIONES_MAX = int(os.getenv("SESIONES_MAX", "5000"))
+# Turnos completos que se guardan por sesión; los anteriores pasan al resumen
+SESIONES_TURNOS_RECIENTES = int(os.getenv("SESIONES_TURNOS_RECIENTES", "3"))
+# Caracteres guardados de cada respuesta y tamaño máximo del resumen
+SESIONES_LARGO_RESPUESTA = int(os.getenv("SESIONES_LARGO_RESPUESTA", "200"))
+SESIONES_LARGO_RESUMEN = int(os.getenv("SESIONES_LARGO_RESUMEN", "600"))
+
+# Caracteres de la pregunta que se conservan en cada línea del resumen
+LARGO_PREGUNTA_RESUMEN = 120
+
+
+def resumir_turno(pregunta: str) -> str:
+    """
+    Línea del resumen para un turno que sale de la ventana de turnos recientes.
+    """
+    linea = " ".join(pregunta.split())
+    if len(linea) > LARGO_PREGUNTA_RESUMEN:
+        linea = linea[:LARGO_PREGUNTA_RESUMEN].rstrip() + "..."
+    lugar = buscar_lugar_en_texto(pregunta)
+    if lugar:
+        linea += f" (destino: {lugar.nombre})"
+    return f"- {linea}"
+
+
+class Sesion:
+    """
+    Turnos recientes (pregunta, respuesta recortada) y resumen de los anteriores.
+    """
+
+    def __init__(self, sesion_id: str, max_turnos: int, largo_respuesta: int, largo_resumen: int):
+        self.id = sesion_id
+        self.turnos: deque[tuple[str, str]] = deque()
+        self.max_turnos = max_turnos
+        self.largo_respuesta = largo_respuesta
+        self.largo_resumen = largo_resumen
+        self._lineas_resumen: deque[str] = deque()
+        self._largo_lineas = 0
+        self.total_turnos = 0
+        self.guardada = False
+
+    @property
+    def resumen(self) -> str:
+        return "\n".join(self._lineas_resumen)
+
+    def registrar_turno(self, pregunta: str, respuesta: str) -> None:
+        """
+        Añade un turno. Si la ventana está llena, el turno más antiguo se compacta
+        en una línea del resumen (trabajo constante por turno).
+        """
+        self.turnos.append((pregunta, respuesta[:self.largo_respuesta]))
+        self.total_turnos += 1
+        while len(self.turnos) > self.max_turnos:
+            pregunta_antigua, _respuesta = self.turnos.popleft()
+            self._agregar_linea_resumen(resumir_turno(pregunta_antigua))
+
+    def _agregar_linea_resumen(self, linea: str) -> None:
+        self._lineas_resumen.append(linea)
+        self._largo_lineas += len(linea) + 1
+        while self._largo_lineas > self.largo_resumen and len(self._lineas_resumen) > 1:
+            self._largo_lineas -= len(self._lineas_resumen.popleft()) + 1
+
+
+class AlmacenSesiones:
+    """
+    Sesiones acotadas en número, con expiración por inactividad y desalojo LRU.
+    """
+
+    def __init__(
+        self,
+        ttl: float = SESIONES_TTL,
+        max_sesiones: int = SESIONES_MAX,
+        max_turnos: int = SESIONES_TURNOS_RECIENTES,
+        largo_respuesta: int = SESIONES_LARGO_RESPUESTA,
+        largo_resumen: int = SESIONES_LARGO_RESUMEN,
+    ):
+        self._cache = CacheTTL("sesiones", ttl, max_sesiones)
+        self.max_turnos = max_turnos
+        self.largo_respuesta = largo_respuesta
+        self.largo_resumen = largo_resumen
+        self.creadas = 0
+
+    def crear(self, historial: Iterable[tuple[str, str]] = ()) -> Sesion:
+        """
+        Crea una sesión nueva, opcionalmente a partir de un historial enviado por el
+        cliente (por ejemplo, si su sesión anterior expiró). No se guarda hasta que
+        se registra su primer turno.
+        """
+        sesion = Sesion(secrets.token_urlsafe(16), self.max_turnos, self.largo_respuesta, self.largo_resumen)
+        for pregunta, respuesta in historial:
+            sesion.registrar_turno(pregunta, respuesta)
+        return sesion
+
+    def obtener(self, sesion_id: str) -> Sesion | None:
+        """
+        Busca una sesión y renueva su tiempo de expiración.
+        """
+        encontrada, sesion = self._cache.obtener(sesion_id)
+        if not encontrada:
+            return None
+        self._cache.guardar(sesion_id, sesion)
+        return sesion
+
+    def registrar_turno(self, sesion: Sesion, pregunta: str, respuesta: str) -> None:
+        """
+        Añade un turno a la sesión y la guarda (la primera vez, la da de alta).
+        """
+        sesion.registrar_turno(pregunta, respuesta)
+        if not sesion.guardada:
+            sesion.guardada = True
+            self.creadas += 1
+        self._cache.guardar(sesion.id, sesion)
+
+    def estadisticas(self) -> dict:
+        estadisticas = self._cache.estadisticas()
+        estadisticas["creadas"] = self.creadas
+        return estadisticas
@@ -0,0 +1,136 @@
+"""
+Resolución local de zonas horarias a partir de coordenadas.
+
+Se usa un índice espacial compacto sobre los puntos de referencia de la base de
+datos tz de IANA (datos/zonas_horarias.tsv): una rejilla de celdas de 10° para la
+búsqueda del vecino más cercano y, si se conoce el país, una lista por país que
+evita asignar zonas del país vecino cerca de las fronteras. La hora local y el
+desfase se calculan con zoneinfo, sin llamadas de red.
+
+El vecino más cercano es una aproximación: cerca de los límites entre zonas puede
+dar la del otro lado (los puntos de referencia son pocos por país). Los lugares del
+gazetteer llevan su zona en datos/lugares.tsv; este índice es solo para el resto.
+"""
+import math
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+RUTA_DATOS = Path(__file__).parent / "datos" / "zonas_horarias.tsv"
+
+# Tamaño de celda de la rejilla en grados
+TAMANO_CELDA = 10
+# Distancia máxima (km) al punto de referencia para aceptar una zona
+DISTANCIA_MAXIMA_KM = 2500
+
+
+def distancia_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Distancia de gran círculo (haversine) en kilómetros.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(a))
+
+
+def _celda(lat: float, lon: float) -> tuple[int, int]:
+    fila = min(int((lat + 90) // TAMANO_CELDA), 180 // TAMANO_CELDA - 1)
+    columna = int((lon + 180) // TAMANO_CELDA) % (360 // TAMANO_CELDA)
+    return fila, columna
+
+
+class IndiceZonasHorarias:
+    """
+    Índice de vecino más cercano sobre puntos (país, lat, lon, zona).
+    """
+
+    def __init__(self, puntos: list[tuple[str, float, float, str]]):
+        self.puntos = puntos
+        self._celdas: dict[tuple[int, int], list[int]] = {}
+        self._por_pais: dict[str, list[int]] = {}
+        for i, (pais, lat, lon, _zona) in enumerate(puntos):
+            self._celdas.setdefault(_celda(lat, lon), []).append(i)
+            self._por_pais.setdefault(pais, []).append(i)
+
+    @classmethod
+    def desde_archivo(cls, ruta: Path = RUTA_DATOS) -> "IndiceZonasHorarias":
+        puntos = []
+        with open(ruta, encoding="utf-8") as archivo:
+            for linea in archivo:
+                if linea.startswith("#") or not linea.strip():
+                    continue
+                pais, lat, lon, zona = linea.rstrip("\n").split("\t")
+                puntos.append((pais, float(lat), float(lon), zona))
+        return cls(puntos)
+
+    def _mas_cercano(self, lat: float, lon: float, indices: list[int]) -> tuple[float, int | None]:
+        mejor_distancia, mejor = math.inf, None
+        for i in indices:
+            _pais, lat_p, lon_p, _zona = self.puntos[i]
+            distancia = distancia_km(lat, lon, lat_p, lon_p)
+            if distancia < mejor_distancia:
+                mejor_distancia, mejor = distancia, i
+        return mejor_distancia, mejor
+
+    def _candidatos_rejilla(self, lat: float, lon: float) -> list[int]:
+        """
+        Puntos de las celdas alrededor de (lat, lon): se amplía el anillo de celdas
+        hasta encontrar puntos y se incluye un anillo más para no perder el más
+        cercano cuando está justo al otro lado del borde de una celda.
+        """
+        fila, columna = _celda(lat, lon)
+        filas, columnas = 180 // TAMANO_CELDA, 360 // TAMANO_CELDA
+        candidatos: list[int] = []
+        anillo_con_puntos = None
+        for radio in range(max(filas, columnas)):
+            if anillo_con_puntos is not None and radio > anillo_con_puntos + 1:
+                break
+            for df in range(-radio, radio + 1):
+                for dc in range(-radio, radio + 1):
+                    if max(abs(df), abs(dc)) != radio or not 0 <= fila + df < filas:
+                        continue
+                    candidatos.extend(self._celdas.get((fila + df, (columna + dc) % columnas), ()))
+            if candidatos and anillo_con_puntos is None:
+                anillo_con_puntos = radio
+        return candidatos
+
+    def buscar(self, lat: float, lon: float, pais: str | None = None) -> str | None:
+        """
+        Zona IANA del punto de referencia más cercano. Si se indica el código de
+        país (ISO 3166, como el `sys.country` de OpenWeatherMap) solo se consideran
+        las zonas de ese país.
+        """
+        indices = self._por_pais.get(pais.upper()) if pais else None
+        if not indices:
+            indices = self._candidatos_rejilla(lat, lon)
+        distancia, mejor = self._mas_cercano(lat, lon, indices)
+        if mejor is None or distancia > DISTANCIA_MAXIMA_KM:
+            return None
+        return self.puntos[mejor][3]
+
+
+@lru_cache(maxsize=1)
+def indice_zonas_horarias() -> IndiceZonasHorarias:
+    """
+    Índice cargado desde el archivo de datos (solo la primera vez que se usa).
+    """
+    return IndiceZonasHorarias.desde_archivo()
+
+
+def zona_horaria_por_coordenadas(lat: float, lon: float, pais: str | None = None) -> str | None:
+    """
+    Resuelve unas coordenadas a un identificador IANA (ej. "Europe/Paris").
+    """
+    return indice_zonas_horarias().buscar(lat, lon, pais)
+
+
+def desfase_utc_segundos(zona: str) -> int | None:
+    """
+    Desfase UTC actual de una zona (con horario de verano) en segundos, o None si
+    la zona no está disponible en esta instalación.
+    """
+    try:
+        return int(datetime.now(ZoneInfo(zona)).utcoffset().total_seconds())
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
@@ -20,6 +20,34 @@ const apiClient = axios.create({
   timeout: 30000, // 30 segundos de timeout
 })
 
+// Foto de Unsplash con variantes responsivas (AVIF/WebP/JPEG) y el color dominante de
+// fondo mientras carga. Sin `detalle` (respuestas o favoritos anteriores) usa la URL.
+function FotoDestino({ url, detalle, alt, className, sizes }) {
+  if (!detalle || !detalle.srcset) {
+    return <img src={url} alt={alt} className={className} loading="lazy" />
+  }
+  const tamanos = sizes || detalle.sizes
+  return (
+    <picture>
+      {detalle.fuentes.map((fuente) => (
+        <source key={fuente.tipo} type={fuente.tipo} srcSet={fuente.srcset} sizes={tamanos} />
+      ))}
+      <img
+        src={detalle.url}
+        srcSet={detalle.srcset}
+        sizes={tamanos}
+        width={detalle.ancho || undefined}
+        height={detalle.alto || undefined}
+        alt={alt || detalle.descripcion}
+        className={className}
+        loading="lazy"
+        decoding="async"
+        style={detalle.color ? { backgroundColor: detalle.color } : undefined}
+      />
+    </picture>
+  )
+}
+
 function App() {
   const [showSurvey, setShowSurvey] = useState(true)
   const [surveyData, setSurveyData] = useState({
@@ -31,9 +59,11 @@ function App() {
   const [question, setQuestion] = useState('')
   const [response, setResponse] = useState('')
   const [fotos, setFotos] = useState([])
+  const [fotosDetalle, setFotosDetalle] = useState([]) // Variantes responsivas de `fotos`
   const [loading, setLoading] = useState(false)
   const [isFirstMessage, setIsFirstMessage] = useState(true)
   const [historial, setHistorial] = useState([]) // Historial de conversaciones
+  const [sesionId, setSesionId] = useState(null) // Sesión del backend (guarda el historial en el servidor)
   const [ultimoDestino, setUltimoDestino] = useState(null) // Último destino mencionado
   const [favoritos, setFavoritos] = useState([]) // Destinos guardados como favoritos
   const [mostrarFavoritos, setMostrarFavoritos] = useState(false) // Toggle para mostrar favoritos
@@ -92,9 +122,11 @@ function App() {
         pregunta: question || 'Consulta inicial',
         respuesta: response,
         fotos: fotos,
+        fotos_detalle: fotosDetalle,
         timestamp: new Date().toLocaleTimeString('es-ES')
       }] : []),
-      fotos: fotos.length > 0 ? fotos : (historial.length > 0 ? historial[historial.length - 1]?.fotos || [] : [])
+      fotos: fotos.length > 0 ? fotos : (historial.length > 0 ? historial[historial.length - 1]?.fotos || [] : []),
+      fotos_detalle: fotos.length > 0 ? fotosDetalle : (historial.length > 0 ? historial[historial.length - 1]?.fotos_detalle || [] : [])
     }
 
     setFavoritos([...favoritos, nuevoFavorito])
@@ -120,14 +152,40 @@ function App() {
       preferencia: favorito.preferencia
     })
     setHistorial(favorito.historial || [])
+    setSesionId(null) // La siguiente pregunta crea una sesión nueva a partir de este historial
     setUltimoDestino(favorito.destino)
     setShowSurvey(false)
   }
 
+  // Precarga las fotos del destino en cuanto se conoce: el backend las deja en caché
+  // para la primera pregunta y el navegador empieza a descargar la primera foto
+  const precargarFotosDestino = async (destino) => {
+    try {
+      const res = await apiClient.get('/api/fotos', { params: { destino } })
+      const primera = res.data.fotos_detalle?.[0]
+      const fuente = primera?.fuentes?.[0]
+      if (fuente && !document.querySelector(`link[data-foto="${primera.id}"]`)) {
+        // Con `type`, el navegador solo la descarga si soporta el formato (el mismo que elegirá <picture>)
+        const link = document.createElement('link')
+        link.rel = 'preload'
+        link.as = 'image'
+        link.type = fuente.tipo
+        link.setAttribute('imagesrcset', fuente.srcset)
+        link.setAttribute('imagesizes', primera.sizes)
+        link.dataset.foto = primera.id
+        document.head.appendChild(link)
+      }
+    } catch (error) {
+      // La precarga es opcional: si falla, las fotos llegan con la respuesta
+      console.warn('No se pudieron precargar las fotos:', error)
+    }
+  }
+
   const handleSurveySubmit = (e) => {
     e.preventDefault()
     if (surveyData.destino && surveyData.fecha && surveyData.presupuesto && surveyData.preferencia) {
       setShowSurvey(false)
+      precargarFotosDestino(surveyData.destino)
     }
   }
 
@@ -169,18 +227,33 @@ function App() {
     setLoading(true)
     setResponse('')
     setFotos([])
+    setFotosDetalle([])
 
     // Detectar si la pregunta hace referencia al último destino
     const preguntaProcesada = procesarReferencias(question, ultimoDestino)
 
     try {
-      const res = await apiClient.post('/api/planificar', {
+      const enviarPregunta = (sesion) => apiClient.post('/api/planificar', {
         pregunta: preguntaProcesada,
         informacion_viaje: surveyData,
-        historial: historial.slice(-5) // Enviar solo las últimas 5 conversaciones
+        sesion_id: sesion,
+        // Con sesión el backend ya tiene el historial; sin ella, enviar las últimas 5 conversaciones
+        historial: sesion ? [] : historial.slice(-5).map(({ pregunta, respuesta }) => ({ pregunta, respuesta }))
       })
+      let res
+      try {
+        res = await enviarPregunta(sesionId)
+      } catch (error) {
+        // 409: el servidor ya no tiene la sesión (reinicio, inactividad, otro worker).
+        // Se reenvía la pregunta con el historial local para no perder el contexto
+        if (!sesionId || error.response?.status !== 409) throw error
+        setSesionId(null)
+        res = await enviarPregunta(null)
+      }
       setResponse(res.data.respuesta)
+      setSesionId(res.data.sesion_id || null)
       setFotos(res.data.fotos || [])
+      setFotosDetalle(res.data.fotos_detalle || [])
       setIsFirstMessage(false)
       
       // Actualizar historial
@@ -190,6 +263,7 @@ function App() {
           pregunta: question,
           respuesta: res.data.respuesta,
           fotos: res.data.fotos || [],
+          fotos_detalle: res.data.fotos_detalle || [],
           timestamp: new Date().toLocaleTimeString('es-ES')
         }
       ]
@@ -501,7 +575,7 @@ function App() {
                   <div key={favorito.id} className="favorito-card">
                     {favorito.fotos && favorito.fotos.length > 0 && (
                       <div className="favorito-imagen">
-                        <img src={favorito.fotos[0]} alt={favorito.destino} />
+                        <FotoDestino url={favorito.fotos[0]} detalle={favorito.fotos_detalle?.[0]} alt={favorito.destino} />
                       </div>
                     )}
                     <div className="favorito-content">
@@ -694,7 +768,10 @@ function App() {
                   <h3 className="historial-title">💬 Historial de Conversación</h3>
                   <button 
                     className="historial-clear-btn"
-                    onClick={() => setHistorial([])}
+                    onClick={() => {
+                      setHistorial([])
+                      setSesionId(null)
+                    }}
                     title="Limpiar historial"
                   >
                     🗑️
@@ -714,7 +791,14 @@ function App() {
                           {item.fotos.length > 0 && (
                             <div className="historial-fotos">
                               {item.fotos.slice(0, 2).map((foto, idx) => (
-                                <img key={idx} src={foto} alt="" className="historial-foto" />
+                                <FotoDestino
+                                  key={idx}
+                                  url={foto}
+                                  detalle={item.fotos_detalle?.[idx]}
+                                  alt=""
+                                  className="historial-foto"
+                                  sizes="60px"
+                                />
                               ))}
                             </div>
                           )}
@@ -736,12 +820,12 @@ function App() {
                 {fotos.length > 0 && (
                   <div className="fotos-container">
                     {fotos.map((foto, index) => (
-                      <img 
+                      <FotoDestino
                         key={index}
-                        src={foto} 
+                        url={foto}
+                        detalle={fotosDetalle[index]}
                         alt={`Vista del destino ${index + 1}`}
                         className="destino-foto"
-                        loading="lazy"
                       />
                     ))}
                   </div>
@@ -11,16 +11,30 @@ const apiClient = axios.create({
   timeout: 30000, // 30 segundos de timeout
 })
 
+// Hora local (HH:MM) a partir del desfase UTC en minutos que devuelve la API
+function horaLocal(desfaseMinutos, ahora) {
+  return new Date(ahora + desfaseMinutos * 60000).toISOString().slice(11, 16)
+}
+
 function InfoPanel({ ciudad }) {
   const [info, setInfo] = useState({
     temperatura: null,
     descripcion_clima: null,
     tipo_cambio_usd: null,
     tipo_cambio_eur: null,
+    moneda_local: null,
+    tipo_cambio_local: null,
     diferencia_horaria: null,
-    hora_local: null
+    desfase_utc_minutos: null
   })
   const [loading, setLoading] = useState(false)
+  const [ahora, setAhora] = useState(Date.now())
+
+  // El reloj local avanza en el cliente, sin volver a pedir el panel
+  useEffect(() => {
+    const reloj = setInterval(() => setAhora(Date.now()), 30000)
+    return () => clearInterval(reloj)
+  }, [])
 
   useEffect(() => {
     const fetchInfo = async () => {
@@ -79,6 +93,9 @@ function InfoPanel({ ciudad }) {
               {info.tipo_cambio_eur && (
                 <div className="panel-value">1 EUR = {info.tipo_cambio_eur} USD</div>
               )}
+              {info.tipo_cambio_local && !['USD', 'EUR'].includes(info.moneda_local) && (
+                <div className="panel-value">1 USD = {info.tipo_cambio_local} {info.moneda_local}</div>
+              )}
             </div>
           </div>
 
@@ -88,8 +105,8 @@ function InfoPanel({ ciudad }) {
               <div className="panel-content">
                 <div className="panel-label">Diferencia Horaria</div>
                 <div className="panel-value">{info.diferencia_horaria}</div>
-                {info.hora_local && (
-                  <div className="panel-subtext">Hora local: {info.hora_local}</div>
+                {info.desfase_utc_minutos !== null && info.desfase_utc_minutos !== undefined && (
+                  <div className="panel-subtext">Hora local: {horaLocal(info.desfase_utc_minutos, ahora)}</div>
                 )}
               </div>
             </div>